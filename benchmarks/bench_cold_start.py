@@ -0,0 +1,181 @@
+"""
+# cold start(모듈 import) 및 warm 호출당 lambda_handler 오버헤드 벤치마크
+
+# 기본 설정과 STARTUP_OPTIMIZED=true 설정의 import 시간 비교 + 호출당 오버헤드 측정
+python benchmarks/bench_cold_start.py
+
+# import 시간이 기준을 넘으면 실패 (CI 등에서 회귀 감지용)
+python benchmarks/bench_cold_start.py --max-import-ms 600 --max-invoke-ms 5
+
+# 가장 오래 걸리는 import 모듈 확인
+python benchmarks/bench_cold_start.py --importtime
+"""
+
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Slack/AWS 에 연결하지 않고 import 할 수 있도록 하는 공통 환경 변수
+BENCH_ENV = {
+    "SLACK_BOT_TOKEN": "xoxb-benchmark",
+    "SLACK_SIGNING_SECRET": "benchmark-signing-secret",
+    "BEDROCK_MODEL_ID": "anthropic.claude-3-sonnet-20240229-v1:0",
+    "AWS_REGION": "ap-northeast-2",
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "SLACK_TOKEN_VERIFICATION_ENABLED": "false",
+}
+
+PROFILES = {
+    "default": {},
+    "startup_optimized": {"STARTUP_OPTIMIZED": "true"},
+}
+
+IMPORT_SNIPPET = (
+    "import time, logging; logging.disable(logging.CRITICAL); start = time.perf_counter(); "
+    "import slackbot; print((time.perf_counter() - start) * 1000)"
+)
+
+
+def measure_import_ms(extra_env: dict, runs: int) -> list:
+    """새 파이썬 프로세스에서 slackbot 모듈 import 시간(ms)을 runs 번 측정합니다 (인터프리터 시작 시간 제외)."""
+    env = dict(os.environ, **BENCH_ENV, **extra_env)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET], cwd=REPO_ROOT, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return samples
+
+
+def print_importtime(extra_env: dict, top: int):
+    env = dict(os.environ, **BENCH_ENV, **extra_env)
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import slackbot"], cwd=REPO_ROOT, env=env,
+        capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module_name = line.split("|")
+        rows.append((int(cumulative_us), module_name[1:]))
+    # slackbot 이 직접 import 하는 모듈(들여쓰기 1단계)만 사용
+    direct_imports = [(cumulative_us, name.strip()) for cumulative_us, name in rows
+                      if name.startswith("  ") and not name.startswith("    ")]
+    for cumulative_us, module_name in sorted(direct_imports, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {module_name}")
+
+
+def signed_lambda_event(body: dict, signing_secret: str, extra_headers: dict = None) -> dict:
+    from slack_sdk.signature import SignatureVerifier
+    request_body = json.dumps(body)
+    timestamp = str(int(time.time()))
+    headers = {
+        "content-type": "application/json",
+        "x-slack-request-timestamp": timestamp,
+        "x-slack-signature": SignatureVerifier(signing_secret).generate_signature(timestamp=timestamp, body=request_body),
+    }
+    headers.update(extra_headers or {})
+    return {
+        "body": request_body,
+        "headers": headers,
+        "isBase64Encoded": False,
+        "requestContext": {"http": {"method": "POST", "path": "/slack/events"}},
+    }
+
+
+class BenchContext:
+    function_name = "bench-slack-bot"
+    invoked_function_arn = "arn:aws:lambda:local:123456789012:function:bench-slack-bot"
+    aws_request_id = "bench"
+
+    def get_remaining_time_in_millis(self):
+        return 300000
+
+
+def measure_invoke_ms(iterations: int) -> dict:
+    """
+    현재 프로세스에서 lambda_handler 호출당 오버헤드(ms)를 측정합니다.
+    Slack/Bedrock 호출이 없는 경로(url_verification, 이미 처리한 이벤트의 재시도)만 사용합니다.
+    """
+    os.environ.update(BENCH_ENV)
+    sys.path.insert(0, REPO_ROOT)
+    import logging
+    import slackbot
+    logging.disable(logging.CRITICAL)
+
+    signing_secret = BENCH_ENV["SLACK_SIGNING_SECRET"]
+    slackbot.event_deduplicator.claim("EvBenchRetry")
+    scenarios = {
+        "url_verification": lambda: signed_lambda_event(
+            {"type": "url_verification", "challenge": "bench"}, signing_secret),
+        "retry_short_circuit": lambda: signed_lambda_event(
+            {"type": "event_callback", "event_id": "EvBenchRetry", "event": {"type": "app_mention"}}, signing_secret,
+            {"x-slack-retry-num": "1", "x-slack-retry-reason": "http_timeout"}),
+    }
+    results = {}
+    for name, make_event in scenarios.items():
+        samples = []
+        for iteration in range(iterations + 1):
+            event = make_event()
+            start_time = time.perf_counter()
+            response = slackbot.lambda_handler(event, BenchContext())
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+            if response.get("statusCode") != 200:
+                raise RuntimeError(f"{name}: 예상치 못한 응답 {response}")
+            if iteration > 0: # 첫 호출(handler 생성 등 1회성 비용)은 별도로 표시
+                samples.append(elapsed_ms)
+            else:
+                results[f"{name}_first_ms"] = elapsed_ms
+        results[f"{name}_p50_ms"] = statistics.median(samples)
+        results[f"{name}_p99_ms"] = sorted(samples)[max(0, int(len(samples) * 0.99) - 1)]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="slackbot cold start / warm 호출 오버헤드 벤치마크")
+    parser.add_argument("--runs", type=int, default=5, help="import 시간 측정 프로세스 수 (프로필별)")
+    parser.add_argument("--iterations", type=int, default=200, help="호출당 오버헤드 측정 반복 횟수")
+    parser.add_argument("--importtime", action="store_true", help="누적 import 시간 상위 모듈 출력")
+    parser.add_argument("--max-import-ms", type=float, help="startup_optimized 프로필의 import 중앙값이 이 값을 넘으면 실패")
+    parser.add_argument("--max-invoke-ms", type=float, help="warm 호출 p50 이 이 값을 넘으면 실패")
+    args = parser.parse_args()
+
+    failures = []
+    import_medians = {}
+    print("== 모듈 import 시간 (새 프로세스, ms) ==")
+    for profile_name, extra_env in PROFILES.items():
+        samples = measure_import_ms(extra_env, args.runs)
+        import_medians[profile_name] = statistics.median(samples)
+        print(f"{profile_name:<18} median {import_medians[profile_name]:7.1f}  min {min(samples):7.1f}  max {max(samples):7.1f}")
+        if args.importtime:
+            print_importtime(extra_env, top=10)
+    if args.max_import_ms is not None and import_medians["startup_optimized"] > args.max_import_ms:
+        failures.append(f"import 시간 {import_medians['startup_optimized']:.1f}ms > 기준 {args.max_import_ms}ms")
+
+    print("== warm 호출당 lambda_handler 오버헤드 (ms) ==")
+    invoke_results = measure_invoke_ms(args.iterations)
+    for name, value in invoke_results.items():
+        print(f"{name:<30} {value:8.3f}")
+    if args.max_invoke_ms is not None:
+        for name, value in invoke_results.items():
+            if name.endswith("_p50_ms") and value > args.max_invoke_ms:
+                failures.append(f"{name} {value:.3f}ms > 기준 {args.max_invoke_ms}ms")
+
+    if failures:
+        print("회귀 감지:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
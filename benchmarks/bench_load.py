@@ -0,0 +1,548 @@
+"""
+# 오프라인 부하 테스트: 가짜 Slack Web API / Bedrock 서버를 띄우고 서명된 app_mention 이벤트를 재생합니다.
+# 처리량(events/sec), 종단 간 지연 시간(p50/p99, 이벤트 전송 ~ 최종 답변 게시), 이벤트당 Slack 호출 수를 측정합니다.
+
+# lambda_handler(같은 프로세스) 와 로컬 서버(python slackbot.py, LocalSlackRequestHandler) 모두 측정
+python benchmarks/bench_load.py
+
+# 동시 요청 수/이벤트 수, 가짜 서버 지연 시간과 스로틀(429) 비율 지정
+python benchmarks/bench_load.py --target lambda --events 300 --concurrency 16 --bedrock-latency-ms 800 --bedrock-throttle-rate 0.1
+
+# 저장된 기준값(benchmarks/load_baseline.json)과 비교하여 회귀 시 실패 / 기준값 갱신
+python benchmarks/bench_load.py --check-baseline
+python benchmarks/bench_load.py --update-baseline
+
+# 녹화한 app_mention 이벤트(event_callback body 의 JSON 배열)를 재생
+python benchmarks/bench_load.py --payloads path/to/payloads.json
+"""
+
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import socket
+import signal
+import argparse
+import threading
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_cold_start import BENCH_ENV, BenchContext, signed_lambda_event # noqa: E402
+
+BOT_USER_ID = "UABC12345SAMPLE" # 녹화 스레드의 봇 ID (저장소 루트의 system_prompt_UABC12345SAMPLE.txt 사용)
+RESPONSE_MARKER = "[bench-response]" # 가짜 Bedrock 응답에 넣어 최종 답변 게시를 식별하는 표시
+DEFAULT_BASELINE_PATH = os.path.join(BENCH_DIR, "load_baseline.json")
+
+# 기준값 비교 시 지표별 회귀 방향 (높을수록 좋음 / 낮을수록 좋음)
+HIGHER_IS_BETTER = ("events_per_sec",)
+LOWER_IS_BETTER = ("e2e_p50_ms", "e2e_p99_ms", "slack_calls_per_event")
+SLACK_CALLS_TOLERANCE = 0.05 # 이벤트당 Slack 호출 수 허용 오차 (절대값)
+
+
+def percentile(samples: list, pct: float) -> float:
+    """nearest-rank 백분위수 (slackbot.StageLatencyAggregator 와 같은 방식)"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+class FakeServer:
+    """ThreadingHTTPServer 를 백그라운드 스레드에서 실행하고, 지연 시간/스로틀 주입 설정을 보관합니다."""
+    def __init__(self, handler_class, latency_ms: float, throttle_rate: float, seed: int):
+        self.latency_ms = latency_ms
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.throttled = 0
+        handler = type(handler_class.__name__, (handler_class,), {"fake": self})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, name=handler_class.__name__, daemon=True).start()
+
+    def inject(self, name: str, throttleable: bool = True) -> bool:
+        """호출 수를 기록하고 지연 시간을 주입합니다. 이번 호출을 스로틀(429)해야 하면 True 를 반환합니다."""
+        with self._random_lock:
+            jitter = self._random.uniform(0.5, 1.5) # 평균 latency_ms, ±50% 균등 분포
+            throttle = throttleable and self._random.random() < self.throttle_rate
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if throttle:
+                self.throttled += 1
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms * jitter / 1000)
+        return throttle
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls = {}
+            self.throttled = 0
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # 클라이언트의 keep-alive 연결 재사용
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+
+class FakeSlackHandler(JsonHandler):
+    """/api/<method> 형식의 Slack Web API (auth.test, chat.postMessage, chat.update, chat.delete, conversations.replies)"""
+    def do_GET(self):
+        self.handle_api()
+
+    def do_POST(self):
+        self.handle_api()
+
+    def handle_api(self):
+        url = urlparse(self.path)
+        method = url.path.rsplit("/", 1)[-1]
+        args = dict(parse_qsl(url.query))
+        body = self.read_body()
+        if body:
+            if "json" in (self.headers.get("Content-Type") or ""):
+                args.update(json.loads(body))
+            else:
+                args.update(parse_qsl(body.decode("utf-8")))
+        if self.fake.inject(method, method in self.fake.throttle_methods):
+            # slackbot 의 SlackApiLayer 가 Retry-After 를 보고 재시도합니다.
+            self.send_json(429, {"ok": False, "error": "ratelimited"}, {"Retry-After": str(self.fake.retry_after_sec)})
+            return
+        handler = getattr(self.fake, "api_" + method.replace(".", "_"), None)
+        if handler is None:
+            self.send_json(200, {"ok": False, "error": "unknown_method"})
+            return
+        self.send_json(200, handler(args))
+
+
+class FakeSlackServer(FakeServer):
+    """
+    가짜 Slack Web API 서버입니다.
+    이벤트마다 고유한 스레드를 사용하므로, 스레드에 최종 답변(RESPONSE_MARKER 또는 final_texts)이 게시된 시각을 종단 간 완료 시각으로 기록합니다.
+    """
+    def __init__(self, latency_ms: float, throttle_rate: float, retry_after_sec: int, throttle_methods: set, seed: int):
+        super().__init__(FakeSlackHandler, latency_ms, throttle_rate, seed)
+        self.retry_after_sec = retry_after_sec
+        self.throttle_methods = throttle_methods
+        self.final_texts = set()
+        self._ts_counter = 0
+        self._thread_messages = {} # (channel, thread_ts) -> conversations.replies 로 돌려줄 메시지 목록
+        self._message_threads = {} # 게시한 메시지 ts -> (channel, thread_ts) (chat.update 대상 스레드 확인용)
+        self._completions = {} # (channel, thread_ts) -> threading.Event
+        self.completed_at = {} # (channel, thread_ts) -> 최종 답변 게시 시각 (perf_counter)
+
+    def next_ts(self) -> str:
+        with self.lock:
+            self._ts_counter += 1
+            return f"1800000000.{self._ts_counter:06d}"
+
+    def register_thread(self, thread_key: tuple, messages: list) -> threading.Event:
+        completion = threading.Event()
+        with self.lock:
+            self._thread_messages[thread_key] = messages
+            self._completions[thread_key] = completion
+        return completion
+
+    def _record_text(self, thread_key: tuple, text: str):
+        if RESPONSE_MARKER in (text or "") or text in self.final_texts:
+            with self.lock:
+                self.completed_at.setdefault(thread_key, time.perf_counter())
+                completion = self._completions.get(thread_key)
+            if completion:
+                completion.set()
+
+    def api_auth_test(self, args: dict) -> dict:
+        return {"ok": True, "user_id": BOT_USER_ID, "bot_id": "BBENCH", "team_id": "TBENCH", "user": "bench-bot"}
+
+    def api_chat_postMessage(self, args: dict) -> dict:
+        ts = self.next_ts()
+        thread_key = (args.get("channel"), args.get("thread_ts") or ts)
+        with self.lock:
+            self._message_threads[ts] = thread_key
+        self._record_text(thread_key, args.get("text"))
+        return {"ok": True, "channel": args.get("channel"), "ts": ts, "message": {"text": args.get("text"), "ts": ts}}
+
+    def api_chat_update(self, args: dict) -> dict:
+        with self.lock:
+            thread_key = self._message_threads.get(args.get("ts"))
+        if thread_key is None:
+            return {"ok": False, "error": "message_not_found"}
+        self._record_text(thread_key, args.get("text"))
+        return {"ok": True, "channel": args.get("channel"), "ts": args.get("ts"), "text": args.get("text")}
+
+    def api_chat_delete(self, args: dict) -> dict:
+        return {"ok": True, "channel": args.get("channel"), "ts": args.get("ts")}
+
+    def api_conversations_replies(self, args: dict) -> dict:
+        with self.lock:
+            messages = self._thread_messages.get((args.get("channel"), args.get("ts")), [])
+        oldest, latest = args.get("oldest"), args.get("latest")
+        messages = [message for message in messages
+                    if (not oldest or float(message["ts"]) > float(oldest)) and (not latest or float(message["ts"]) <= float(latest))]
+        return {"ok": True, "messages": messages, "has_more": False}
+
+
+class FakeBedrockHandler(JsonHandler):
+    """bedrock-runtime InvokeModel (POST /model/<modelId>/invoke, Anthropic Messages 형식 응답)"""
+    def do_POST(self):
+        match = re.match(r"^/model/(.+)/invoke$", urlparse(self.path).path)
+        request_body = self.read_body()
+        if not match:
+            # 스트리밍(invoke-with-response-stream)은 지원하지 않습니다.
+            self.send_json(404, {"message": f"지원하지 않는 경로: {self.path}"}, {"x-amzn-ErrorType": "UnknownOperationException"})
+            return
+        if self.fake.inject("invoke_model"):
+            self.send_json(429, {"message": "Too many requests, please wait before trying again."},
+                           {"x-amzn-ErrorType": "ThrottlingException"})
+            return
+        self.send_json(200, {
+            "id": "msg_bench",
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": f"{RESPONSE_MARKER} 가짜 Bedrock 응답입니다."}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": max(1, len(request_body) // 4), "output_tokens": self.fake.output_tokens},
+        })
+
+
+class FakeBedrockServer(FakeServer):
+    def __init__(self, latency_ms: float, throttle_rate: float, output_tokens: int, seed: int):
+        super().__init__(FakeBedrockHandler, latency_ms, throttle_rate, seed)
+        self.output_tokens = output_tokens
+
+
+def bench_environment(slack: FakeSlackServer, bedrock: FakeBedrockServer, real_rate_limits: bool) -> dict:
+    env = dict(BENCH_ENV)
+    env.update({
+        "SLACK_API_BASE_URL": f"http://127.0.0.1:{slack.port}/api/",
+        "BEDROCK_ENDPOINT_URL": f"http://127.0.0.1:{bedrock.port}",
+        "PROMPT_BASE_PATH": REPO_ROOT,
+        "LLM_STREAMING_ENABLED": "false",
+        "METRICS_EMF_ENABLED": "false",
+        "DISPATCH_MODE": os.environ.get("DISPATCH_MODE", "inline"),
+    })
+    if not real_rate_limits:
+        # 워크스페이스 하나에 부하가 몰리므로 실제 분당 한도를 적용하면 측정값이 한도 대기 시간이 됩니다.
+        env["SLACK_METHOD_RATE_LIMITS"] = json.dumps({method: 1000000 for method in (
+            "auth.test", "chat.postMessage", "chat.update", "chat.delete", "conversations.replies")})
+    return env
+
+
+def rewrite_thread(messages: list, channel: str, thread_ts: str) -> list:
+    """녹화 스레드의 ts 를 고유한 thread_ts 기준으로 바꿉니다 (메시지 순서 유지)."""
+    base_seconds = int(thread_ts.split(".")[0])
+    rewritten = []
+    for index, message in enumerate(messages):
+        ts = thread_ts if index == 0 else f"{base_seconds}.{int(thread_ts.split('.')[1]) + index:06d}"
+        rewritten.append(dict(message, ts=ts, thread_ts=thread_ts, channel=channel))
+    return rewritten
+
+
+def build_events(slack: FakeSlackServer, count: int, thread_ratio: float, threads: list, payloads: list, run_id: str, seed: int) -> list:
+    """
+    (thread_key, completion, event body) 목록을 만듭니다.
+    이벤트마다 고유한 채널/스레드를 사용하며, 스레드 내 멘션은 녹화 스레드의 대화 기록을 conversations.replies 로 돌려줍니다.
+    """
+    chooser = random.Random(seed)
+    events = []
+    for index in range(count):
+        channel = f"CBENCH{index % 50:04d}"
+        thread_ts = slack.next_ts()
+        if payloads:
+            body = json.loads(json.dumps(payloads[index % len(payloads)]))
+            mention = dict(body["event"], channel=channel, ts=thread_ts)
+            mention.pop("thread_ts", None)
+            messages = [mention]
+        elif threads and chooser.random() < thread_ratio:
+            recorded = threads[index % len(threads)]["messages"]
+            messages = rewrite_thread(recorded, channel, thread_ts)
+            if messages[-1].get("user") == BOT_USER_ID or messages[-1].get("bot_id"):
+                messages.append(dict(messages[0], text=f"<@{BOT_USER_ID}> 이어서 질문 {index}",
+                                     ts=f"{thread_ts.split('.')[0]}.{int(thread_ts.split('.')[1]) + len(messages):06d}"))
+            mention = dict(messages[-1], type="app_mention")
+            body = {}
+        else:
+            mention = {"type": "app_mention", "user": "U0BENCHUSER", "text": f"<@{BOT_USER_ID}> 부하 테스트 질문 {index}",
+                       "channel": channel, "ts": thread_ts}
+            messages = [mention]
+            body = {}
+        body.update({
+            "type": "event_callback",
+            "team_id": "TBENCH",
+            "api_app_id": "ABENCH",
+            "event_id": f"Ev{run_id}{index:06d}",
+            "event_time": int(time.time()),
+            "authorizations": [{"team_id": "TBENCH", "user_id": BOT_USER_ID, "is_bot": True}],
+            "event": mention,
+        })
+        thread_key = (channel, mention.get("thread_ts") or mention["ts"])
+        events.append((thread_key, slack.register_thread(thread_key, messages), body))
+    return events
+
+
+class LambdaTarget:
+    """같은 프로세스에서 slackbot.lambda_handler 를 직접 호출합니다."""
+    name = "lambda"
+
+    def __init__(self, slackbot_module):
+        self.slackbot = slackbot_module
+
+    def send(self, body: dict):
+        response = self.slackbot.lambda_handler(signed_lambda_event(body, BENCH_ENV["SLACK_SIGNING_SECRET"]), BenchContext())
+        if response.get("statusCode") != 200:
+            raise RuntimeError(f"예상치 못한 응답: {response}")
+
+    def close(self):
+        pass
+
+
+class ServerTarget:
+    """python slackbot.py (로컬 서버, LocalSlackRequestHandler) 를 하위 프로세스로 띄우고 HTTP 로 이벤트를 보냅니다."""
+    name = "server"
+
+    def __init__(self, env: dict, verbose: bool, startup_timeout_sec: float = 30):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_ROOT, "slackbot.py")], cwd=REPO_ROOT,
+            env=dict(os.environ, **env, PORT=str(self.port)),
+            stdout=None if verbose else subprocess.DEVNULL, stderr=None if verbose else subprocess.DEVNULL,
+        )
+        deadline = time.time() + startup_timeout_sec
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"로컬 서버가 시작 중 종료되었습니다 (exit code {self.process.returncode})")
+            try:
+                socket.create_connection(("localhost", self.port), timeout=0.2).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    self.close()
+                    raise RuntimeError("로컬 서버 시작 대기 시간 초과")
+                time.sleep(0.05)
+
+    def send(self, body: dict):
+        event = signed_lambda_event(body, BENCH_ENV["SLACK_SIGNING_SECRET"])
+        request = urllib.request.Request(f"http://localhost:{self.port}/slack/events", data=event["body"].encode("utf-8"),
+                                         headers=event["headers"], method="POST")
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def run_load(target, slack: FakeSlackServer, bedrock: FakeBedrockServer, events: list, concurrency: int, timeout_sec: float) -> dict:
+    """
+    closed-loop 부하: concurrency 개의 작업자가 이벤트를 보내고 최종 답변이 게시될 때까지 기다린 뒤 다음 이벤트를 보냅니다.
+    """
+    slack.reset_counters()
+    bedrock.reset_counters()
+    sent_at = {}
+    ack_ms = []
+    failures = []
+
+    def send_one(item):
+        thread_key, completion, body = item
+        sent_at[thread_key] = time.perf_counter()
+        try:
+            target.send(body)
+        except Exception as e:
+            failures.append(f"{body['event_id']}: {e}")
+            return
+        ack_ms.append((time.perf_counter() - sent_at[thread_key]) * 1000)
+        if not completion.wait(timeout_sec):
+            failures.append(f"{body['event_id']}: {timeout_sec}초 안에 최종 답변이 게시되지 않음")
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send_one, events))
+    elapsed_sec = time.perf_counter() - start_time
+
+    e2e_ms = [(slack.completed_at[key] - sent_at[key]) * 1000 for key, _, _ in events if key in slack.completed_at]
+    slack_calls = sum(slack.calls.values())
+    return {
+        "events": len(events),
+        "completed": len(e2e_ms),
+        "failed": len(failures),
+        "failure_examples": failures[:3],
+        "elapsed_sec": round(elapsed_sec, 3),
+        "events_per_sec": round(len(e2e_ms) / elapsed_sec, 2) if elapsed_sec else 0.0,
+        "e2e_p50_ms": round(percentile(e2e_ms, 50), 1),
+        "e2e_p99_ms": round(percentile(e2e_ms, 99), 1),
+        "ack_p50_ms": round(percentile(ack_ms, 50), 1),
+        "slack_calls_per_event": round(slack_calls / len(events), 3),
+        "slack_calls_by_method": dict(sorted(slack.calls.items())),
+        "slack_throttled": slack.throttled,
+        "bedrock_calls_per_event": round(sum(bedrock.calls.values()) / len(events), 3),
+        "bedrock_throttled": bedrock.throttled,
+    }
+
+
+def compare_with_baseline(target_name: str, result: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+        if metric not in baseline:
+            continue
+        expected, actual = baseline[metric], result[metric]
+        if metric == "slack_calls_per_event":
+            # 호출 수는 거의 결정적이므로 비율 대신 작은 절대 오차(첫 요청들의 동시 auth.test 등)만 허용합니다.
+            regressed = actual > expected + SLACK_CALLS_TOLERANCE
+        elif metric in HIGHER_IS_BETTER:
+            regressed = actual < expected * (1 - tolerance)
+        else:
+            regressed = actual > expected * (1 + tolerance)
+        if regressed:
+            regressions.append(f"{target_name}.{metric}: {actual} (기준 {expected}, 허용 오차 {tolerance:.0%})")
+    return regressions
+
+
+def print_result(target_name: str, result: dict):
+    print(f"== {target_name} ==")
+    print(f"  완료 {result['completed']}/{result['events']}  실패 {result['failed']}  경과 {result['elapsed_sec']}s")
+    print(f"  처리량           {result['events_per_sec']:8.2f} events/sec")
+    print(f"  종단 간 p50/p99  {result['e2e_p50_ms']:8.1f} / {result['e2e_p99_ms']:.1f} ms   (ack p50 {result['ack_p50_ms']:.1f} ms)")
+    print(f"  Slack 호출/이벤트 {result['slack_calls_per_event']:8.3f}  {result['slack_calls_by_method']}  (429 주입 {result['slack_throttled']})")
+    print(f"  Bedrock 호출/이벤트 {result['bedrock_calls_per_event']:6.3f}  (429 주입 {result['bedrock_throttled']})")
+    for failure in result["failure_examples"]:
+        print(f"  실패 예: {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="가짜 Slack/Bedrock 서버를 사용한 slackbot 부하 테스트")
+    parser.add_argument("--target", choices=("lambda", "server", "all"), default="all", help="측정 대상")
+    parser.add_argument("--events", type=int, default=200, help="대상별 이벤트 수")
+    parser.add_argument("--concurrency", type=int, default=8, help="동시에 처리 중인 이벤트 수 (closed-loop)")
+    parser.add_argument("--thread-ratio", type=float, default=0.5, help="스레드 내 멘션(대화 기록 조회) 비율")
+    parser.add_argument("--threads", default=os.path.join(BENCH_DIR, "recorded_threads.json"), help="스레드 내 멘션에 사용할 녹화 스레드")
+    parser.add_argument("--payloads", help="재생할 app_mention event_callback body 의 JSON 배열 (지정 시 합성 이벤트 대신 사용)")
+    parser.add_argument("--slack-latency-ms", type=float, default=20, help="가짜 Slack API 평균 응답 지연")
+    parser.add_argument("--slack-throttle-rate", type=float, default=0.0, help="Slack API 429 응답 비율")
+    parser.add_argument("--slack-throttle-methods", default="chat.postMessage,chat.update,chat.delete,conversations.replies",
+                        help="429 를 주입할 Slack 메서드 (쉼표 구분, Bolt 인증 미들웨어의 auth.test 는 429 시 요청을 버리므로 기본 제외)")
+    parser.add_argument("--slack-retry-after-sec", type=int, default=1, help="Slack 429 응답의 Retry-After")
+    parser.add_argument("--bedrock-latency-ms", type=float, default=300, help="가짜 Bedrock InvokeModel 평균 응답 지연")
+    parser.add_argument("--bedrock-throttle-rate", type=float, default=0.0, help="Bedrock ThrottlingException 비율")
+    parser.add_argument("--output-tokens", type=int, default=50, help="가짜 Bedrock 응답의 usage.output_tokens")
+    parser.add_argument("--real-rate-limits", action="store_true", help="slackbot 의 Slack 메서드별 분당 한도를 그대로 적용")
+    parser.add_argument("--timeout-sec", type=float, default=60, help="이벤트당 최종 답변 대기 시간")
+    parser.add_argument("--seed", type=int, default=1, help="지연 시간/스로틀 주입 및 이벤트 구성 난수 시드")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--check-baseline", action="store_true", help="기준값 대비 회귀가 있으면 실패 (exit 1)")
+    parser.add_argument("--update-baseline", action="store_true", help="이번 결과로 기준값 파일을 갱신")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="처리량/지연 시간 회귀 허용 오차 (비율)")
+    parser.add_argument("--verbose", action="store_true", help="slackbot 로그 출력")
+    args = parser.parse_args()
+
+    threads = []
+    if args.threads and os.path.exists(args.threads):
+        with open(args.threads, 'r', encoding='utf-8') as f:
+            threads = [thread for thread in json.load(f) if thread.get("bot_user_id") == BOT_USER_ID]
+    payloads = None
+    if args.payloads:
+        with open(args.payloads, 'r', encoding='utf-8') as f:
+            payloads = json.load(f)
+
+    slack = FakeSlackServer(args.slack_latency_ms, args.slack_throttle_rate, args.slack_retry_after_sec,
+                            set(args.slack_throttle_methods.split(",")), args.seed)
+    bedrock = FakeBedrockServer(args.bedrock_latency_ms, args.bedrock_throttle_rate, args.output_tokens, args.seed)
+    env = bench_environment(slack, bedrock, args.real_rate_limits)
+
+    # 가짜 서버 주소를 환경 변수로 지정한 뒤 slackbot 을 import 합니다 (lambda 대상은 같은 프로세스에서 호출).
+    os.environ.update(env)
+    sys.path.insert(0, REPO_ROOT)
+    import logging
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    import slackbot
+    # slackbot 의 LLM 오류/스로틀 안내 문구도 최종 답변으로 취급합니다 (실패 경로의 지연 시간도 측정).
+    slack.final_texts = set(slackbot.LLM_FALLBACK_RESPONSES)
+    scenario = {name: getattr(args, name) for name in (
+        "events", "concurrency", "thread_ratio", "slack_latency_ms", "slack_throttle_rate",
+        "bedrock_latency_ms", "bedrock_throttle_rate", "real_rate_limits")}
+    scenario["payloads"] = os.path.basename(args.payloads) if args.payloads else None
+
+    target_classes = [LambdaTarget, ServerTarget] if args.target == "all" else \
+        [LambdaTarget] if args.target == "lambda" else [ServerTarget]
+    results = {}
+    run_id = os.urandom(3).hex().upper()
+    for target_class in target_classes:
+        target = target_class(slackbot) if target_class is LambdaTarget else target_class(env, args.verbose)
+        try:
+            events = build_events(slack, args.events, args.thread_ratio, threads, payloads, f"{run_id}{target.name[0].upper()}", args.seed)
+            results[target.name] = run_load(target, slack, bedrock, events, args.concurrency, args.timeout_sec)
+        finally:
+            target.close()
+        print_result(target.name, results[target.name])
+    slack.shutdown()
+    bedrock.shutdown()
+
+    failed = any(result["failed"] for result in results.values())
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline["scenario"] = scenario
+        for target_name, result in results.items():
+            baseline[target_name] = {metric: result[metric] for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"기준값 갱신: {args.baseline}")
+
+    if args.check_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("scenario") != scenario:
+            print(f"경고: 기준값의 시나리오가 이번 실행과 다릅니다 (기준: {baseline.get('scenario')})")
+        regressions = []
+        for target_name, result in results.items():
+            regressions.extend(compare_with_baseline(target_name, result, baseline.get(target_name, {}), args.tolerance))
+        if regressions:
+            print("회귀 감지:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("기준값 대비 회귀 없음")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
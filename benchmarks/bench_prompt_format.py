@@ -0,0 +1,125 @@
+"""
+# 프롬프트 형식 벤치마크: 기존 JSON 타임라인(단일 user 메시지) vs Messages API(system + user/assistant 턴)
+
+# 오프라인 (추정 토큰 수 + 프롬프트 생성 시간)
+python benchmarks/bench_prompt_format.py
+
+# 실제 Bedrock 호출 (usage.input_tokens + 호출 지연 시간, AWS 자격 증명 및 BEDROCK_MODEL_ID 필요)
+python benchmarks/bench_prompt_format.py --invoke --repeat 3
+
+# 다른 녹화 스레드 파일 사용 (conversations.replies 의 messages 를 담은 JSON)
+python benchmarks/bench_prompt_format.py --threads path/to/threads.json
+"""
+
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+# slackbot 모듈 import 시 Slack 연결 없이 초기화되도록 기본값을 지정합니다.
+os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-benchmark")
+os.environ.setdefault("SLACK_SIGNING_SECRET", "benchmark-signing-secret")
+os.environ.setdefault("BEDROCK_MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
+os.environ.setdefault("SLACK_TOKEN_VERIFICATION_ENABLED", "false")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import slackbot # noqa: E402
+
+
+def load_system_prompt(bot_user_id: str) -> str:
+    prompt_path = os.path.join(REPO_ROOT, f"system_prompt_{bot_user_id}.txt")
+    try:
+        with open(prompt_path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return "당신은 친절한 Slack 어시스턴트입니다. 한국어로 명확하게 답변해주세요."
+
+
+PROMPT_BUILDERS = {
+    "json_timeline": lambda system_prompt_text, turns, latest_query: slackbot.create_llm_prompt(
+        system_prompt_text, slackbot.timeline_to_json(turns), latest_query),
+    "messages": lambda system_prompt_text, turns, latest_query: slackbot.create_llm_messages(
+        system_prompt_text, turns, latest_query),
+}
+
+
+def thread_turns(thread: dict) -> list:
+    return slackbot.format_conversation_to_timeline(thread["messages"], thread["bot_user_id"])[-slackbot.THREAD_HISTORY_PROMPT_TURNS:]
+
+
+def estimated_input_tokens(prompt) -> int:
+    if isinstance(prompt, dict):
+        texts = [prompt["system"]] + [message["content"] for message in prompt["messages"]]
+    else:
+        texts = [prompt]
+    return sum(slackbot.estimate_token_count(text) for text in texts)
+
+
+def measure_build_time_ms(builder, system_prompt_text: str, turns: list, latest_query: str, iterations: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        builder(system_prompt_text, turns, latest_query)
+    return (time.perf_counter() - start_time) * 1000 / iterations
+
+
+def invoke_and_measure(prompt, repeat: int) -> dict:
+    """Bedrock 을 직접 호출하여 usage.input_tokens 와 호출 지연 시간(ms)을 측정합니다."""
+    llm_settings = dict(slackbot.DEFAULT_LLM_SETTINGS, max_tokens=64)
+    body = slackbot.build_bedrock_request_body(prompt, llm_settings)
+    latencies_ms = []
+    input_tokens = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        response = slackbot.bedrock_runtime.invoke_model(
+            body=body,
+            modelId=llm_settings["model_id"],
+            accept='application/json',
+            contentType='application/json'
+        )
+        response_body = json.loads(response.get('body').read())
+        latencies_ms.append((time.perf_counter() - start_time) * 1000)
+        input_tokens = response_body.get("usage", {}).get("input_tokens")
+    return {"input_tokens": input_tokens, "latency_ms": statistics.median(latencies_ms)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON 타임라인 vs Messages API 프롬프트 형식 비교")
+    parser.add_argument("--threads", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "recorded_threads.json"))
+    parser.add_argument("--iterations", type=int, default=200, help="프롬프트 생성 시간 측정 반복 횟수")
+    parser.add_argument("--invoke", action="store_true", help="실제 Bedrock 을 호출하여 usage 토큰 수와 지연 시간을 측정")
+    parser.add_argument("--repeat", type=int, default=1, help="--invoke 시 형식별 호출 횟수 (중앙값 사용)")
+    args = parser.parse_args()
+
+    with open(args.threads, 'r', encoding='utf-8') as f:
+        threads = json.load(f)
+
+    print(f"{'thread':<10} {'msgs':>5} {'format':<14} {'est_tokens':>10} {'bytes':>8} {'build_ms':>9}"
+          + (f" {'usage_in':>9} {'latency_ms':>11}" if args.invoke else ""))
+    for thread in threads:
+        system_prompt_text = load_system_prompt(thread["bot_user_id"])
+        turns = thread_turns(thread)
+        latest_query = turns[-1]["message"] if turns else ""
+        baseline_tokens = None
+        for prompt_format, builder in PROMPT_BUILDERS.items():
+            prompt = builder(system_prompt_text, turns, latest_query)
+            build_ms = measure_build_time_ms(builder, system_prompt_text, turns, latest_query, args.iterations)
+            tokens = estimated_input_tokens(prompt)
+            body_bytes = len(slackbot.build_bedrock_request_body(prompt).encode("utf-8"))
+            line = f"{thread['name']:<10} {len(thread['messages']):>5} {prompt_format:<14} {tokens:>10} {body_bytes:>8} {build_ms:>9.3f}"
+            if args.invoke:
+                measured = invoke_and_measure(prompt, args.repeat)
+                line += f" {measured['input_tokens']!s:>9} {measured['latency_ms']:>11.1f}"
+            if baseline_tokens is None:
+                baseline_tokens = tokens
+            elif baseline_tokens:
+                line += f"  ({(tokens - baseline_tokens) / baseline_tokens:+.1%} tokens)"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
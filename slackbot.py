@@ -18,30 +18,102 @@ import os
 import logging
 import json
 import time # 시간 측정을 위해 추가
+import hashlib # 응답 캐시 키 생성을 위해 추가
+import random # Bedrock 재시도 jitter
+import math
+import unicodedata
+import re
 import boto3 # AWS SDK for Python
+from botocore.config import Config as BotocoreConfig
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, ReadTimeoutError
 from slack_bolt import App
 from slack_bolt.adapter.aws_lambda import SlackRequestHandler
+from slack_bolt.adapter.aws_lambda.handler import to_aws_response
+from slack_bolt.context.say import Say
+from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError # Slack API 에러 처리를 위해 추가
 import threading # 로컬 서버 비동기 처리를 위해 추가
-from collections import deque # 이벤트 ID 중복 제거를 위해 추가
+import contextlib
+import functools
+import contextvars # 멘션별 Slack API 호출 수 집계를 위해 추가
+import asyncio # SLACK_APP_MODE=async 실행을 위해 추가
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import sqlite3 # warm Lambda 컨테이너/로컬 서버 재시작 간 캐시 유지를 위해 추가
+from collections import deque, OrderedDict # 이벤트 ID 중복 제거 및 LRU 캐시를 위해 추가
+from dataclasses import dataclass, field
+from typing import Union
 
 # --- 로깅 설정 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
 logger = logging.getLogger(__name__)
 
 # --- 이벤트 ID 중복 처리 설정 ---
-MAX_EVENT_ID_MEMORY = 200 # 최근 N개의 이벤트 ID만 기억 (메모리 관리)
-PROCESSED_EVENT_IDS = deque(maxlen=MAX_EVENT_ID_MEMORY)
+MAX_EVENT_ID_MEMORY = int(os.environ.get("MAX_EVENT_ID_MEMORY", "10000")) # 메모리 저장소에서 기억할 최대 이벤트 ID 수
+EVENT_ID_TTL_SEC = float(os.environ.get("EVENT_ID_TTL_SEC", "3600")) # Slack 재시도는 수 분 안에 끝나므로 1시간이면 충분
+EVENT_DEDUP_TABLE = os.environ.get("EVENT_DEDUP_TABLE") # DynamoDB 테이블 (파티션 키: event_id) - 컨테이너 간 공유
+EVENT_DEDUP_DB = os.environ.get("EVENT_DEDUP_DB") # sqlite 파일 경로 - 같은 호스트의 프로세스 간 공유 (로컬/테스트용)
+SLACK_DROP_ALL_RETRIES = os.environ.get("SLACK_DROP_ALL_RETRIES", "false").lower() == "true" # true 면 X-Slack-Retry-Num 요청을 모두 즉시 무시
+
+# --- 시작(cold start) 최적화 설정 ---
+# STARTUP_OPTIMIZED=true 이면 아래 항목들의 기본값이 시작 시간 단축 쪽으로 바뀝니다 (개별 환경 변수로 다시 지정 가능).
+# - AWS 클라이언트(Bedrock/SQS/DynamoDB) 생성을 첫 사용 시점으로 미룸: ack 만 하는 호출이나 재시도 응답은 생성 비용을 내지 않음
+# - Slack App 초기화 시 auth.test 호출 생략: cold start 마다 발생하는 Slack 왕복 1회 제거
+STARTUP_OPTIMIZED = os.environ.get("STARTUP_OPTIMIZED", "false").lower() == "true"
+LAZY_CLIENT_INIT = os.environ.get("LAZY_CLIENT_INIT", str(STARTUP_OPTIMIZED)).lower() == "true"
+SLACK_TOKEN_VERIFICATION_ENABLED = os.environ.get("SLACK_TOKEN_VERIFICATION_ENABLED", str(not STARTUP_OPTIMIZED)).lower() == "true"
+
+# 외부 API 엔드포인트 재지정 (로컬 부하 테스트의 가짜 Slack/Bedrock 서버 등, 비워두면 실제 서비스 사용)
+SLACK_API_BASE_URL = os.environ.get("SLACK_API_BASE_URL") # 예: http://127.0.0.1:8901/api/
+BEDROCK_ENDPOINT_URL = os.environ.get("BEDROCK_ENDPOINT_URL") # 예: http://127.0.0.1:8902
+
+# Bedrock 호출용 botocore 설정: 연결 재사용(keep-alive, 풀 크기)과 타임아웃/재시도 정책
+BEDROCK_CLIENT_CONFIG = BotocoreConfig(
+    max_pool_connections=int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "50")), # 비동기 모드/작업 큐의 동시 호출 수 이상
+    connect_timeout=float(os.environ.get("BEDROCK_CONNECT_TIMEOUT_SEC", "3")),
+    read_timeout=float(os.environ.get("BEDROCK_READ_TIMEOUT_SEC", "120")), # 긴 답변 생성/스트리밍 고려
+    tcp_keepalive=True,
+    retries={
+        "mode": os.environ.get("BEDROCK_RETRY_MODE", "standard"),
+        # 재시도는 BedrockInvoker 가 스로틀 신호를 보고 직접 수행하므로 botocore 자체 재시도는 기본 1회(재시도 없음)입니다.
+        "max_attempts": int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "1")),
+    },
+)
+
+class LazyAwsClient:
+    """
+    처음 속성에 접근할 때 boto3 클라이언트를 생성하는 프록시입니다.
+    warm 컨테이너에서는 한 번 생성된 클라이언트(와 연결 풀)를 계속 재사용합니다.
+    """
+    def __init__(self, service_name: str, config: BotocoreConfig = None, endpoint_url: str = None):
+        self._service_name = service_name
+        self._config = config
+        self._endpoint_url = endpoint_url
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = boto3.client(service_name=self._service_name, region_name=aws_region,
+                                                config=self._config, endpoint_url=self._endpoint_url)
+                    logger.info(f"AWS 클라이언트 생성 (지연 초기화): {self._service_name}")
+                client = self._client
+        return getattr(client, name)
+
+def create_aws_client(service_name: str, config: BotocoreConfig = None, endpoint_url: str = None):
+    """LAZY_CLIENT_INIT 이면 LazyAwsClient 를, 아니면 즉시 생성한 boto3 클라이언트를 반환합니다."""
+    if LAZY_CLIENT_INIT:
+        return LazyAwsClient(service_name, config, endpoint_url)
+    return boto3.client(service_name=service_name, region_name=aws_region, config=config, endpoint_url=endpoint_url)
 
 # --- AWS 및 Bedrock 설정 ---
 try:
     bedrock_model_id = os.environ['BEDROCK_MODEL_ID']
     aws_region = os.environ.get('AWS_REGION', 'ap-northeast-2') 
-    bedrock_runtime = boto3.client(
-        service_name='bedrock-runtime',
-        region_name=aws_region
-    )
-    logger.info(f"Bedrock Runtime 클라이언트 생성 완료 (모델: {bedrock_model_id}, 리전: {aws_region})")
+    bedrock_runtime = create_aws_client('bedrock-runtime', BEDROCK_CLIENT_CONFIG, BEDROCK_ENDPOINT_URL)
+    logger.info(f"Bedrock Runtime 클라이언트 {'준비(지연 생성)' if LAZY_CLIENT_INIT else '생성'} 완료 (모델: {bedrock_model_id}, 리전: {aws_region})")
 except KeyError as e:
     logger.error(f"필수 환경 변수 누락: {e}. BEDROCK_MODEL_ID를 확인하세요.")
     raise e
@@ -55,85 +127,2524 @@ try:
     app = App(
         token=os.environ["SLACK_BOT_TOKEN"],
         signing_secret=os.environ["SLACK_SIGNING_SECRET"],
-        process_before_response=True # 실제 Lambda 환경 및 로컬 비동기 처리와 일관성 유지
+        process_before_response=True, # 실제 Lambda 환경 및 로컬 비동기 처리와 일관성 유지
+        # 초기화 시 auth.test 호출 여부 (cold start 단축 또는 오프라인 벤치마크 시 false)
+        token_verification_enabled=SLACK_TOKEN_VERIFICATION_ENABLED,
+        client=WebClient(token=os.environ["SLACK_BOT_TOKEN"], base_url=SLACK_API_BASE_URL) if SLACK_API_BASE_URL else None
     )
     logger.info("Slack App 초기화 완료.")
 except KeyError as e:
     logger.error(f"필수 환경 변수 누락: {e}. SLACK_BOT_TOKEN 또는 SLACK_SIGNING_SECRET을 확인하세요.")
     raise e
 
-# --- Helper 함수: Bedrock LLM 호출 ---
-def invoke_llm(prompt: str) -> str:
+# --- 공용 캐시 저장소 (in-memory / sqlite) ---
+class MemoryTTLStore:
+    """
+    스레드 안전한 in-process 키-값 저장소입니다.
+    최대 max_entries 개까지 LRU 로 유지하며, ttl_sec 가 지난 항목은 조회 시 만료됩니다.
+    """
+    def __init__(self, max_entries: int, ttl_sec: float):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._entries = OrderedDict() # key -> (저장 시각, 값)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if time.time() - stored_at > self.ttl_sec:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+class SqliteTTLStore:
+    """
+    sqlite 파일 기반 키-값 저장소입니다. 값은 JSON 으로 직렬화됩니다.
+    Lambda 의 /tmp 나 로컬 디스크에 두면 warm 컨테이너의 다음 호출이나 로컬 서버 재시작 후에도 재사용됩니다.
+    MemoryTTLStore 와 동일하게 LRU(마지막 접근 시각) + TTL 로 크기를 제한합니다.
+    """
+    def __init__(self, path: str, table: str, max_entries: int, ttl_sec: float):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            f"stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_sec:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value):
+        now = time.time()
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, serialized, now, now)
+            )
+            self._conn.execute(f"DELETE FROM {self.table} WHERE stored_at < ?", (now - self.ttl_sec,))
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+def create_ttl_store(name: str, max_entries: int, ttl_sec: float, sqlite_path: str = None):
+    """sqlite_path 가 지정되면 SqliteTTLStore(테이블명=name), 아니면 MemoryTTLStore 를 생성합니다."""
+    if sqlite_path:
+        try:
+            store = SqliteTTLStore(sqlite_path, name, max_entries, ttl_sec)
+            logger.info(f"캐시 저장소 '{name}': sqlite ({sqlite_path})")
+            return store
+        except sqlite3.Error as e:
+            logger.error(f"sqlite 캐시 저장소 생성 실패, 메모리 저장소로 대체합니다 ({sqlite_path}): {e}")
+    return MemoryTTLStore(max_entries, ttl_sec)
+
+# --- 이벤트 ID 중복 처리 저장소 ---
+class MemoryEventDeduplicator:
+    """
+    set(O(1) 조회) + 링 버퍼(deque, 오래된 순)로 최근 이벤트 ID 를 기억합니다.
+    max_entries 개를 넘거나 ttl_sec 가 지난 ID 는 링 버퍼 앞에서부터 제거됩니다. 스레드 안전합니다.
+    """
+    def __init__(self, max_entries: int = MAX_EVENT_ID_MEMORY, ttl_sec: float = EVENT_ID_TTL_SEC):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._event_ids = set()
+        self._ring = deque() # (기록 시각, event_id)
+        self._lock = threading.Lock()
+
+    def claim(self, event_id: str) -> bool:
+        """처음 보는 ID 면 기록하고 True, 이미 기록된 ID 면 False 를 반환합니다."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if event_id in self._event_ids:
+                return False
+            self._event_ids.add(event_id)
+            self._ring.append((now, event_id))
+            self._expire(now)
+            return True
+
+    def seen(self, event_id: str) -> bool:
+        with self._lock:
+            self._expire(time.time())
+            return event_id in self._event_ids
+
+    def _expire(self, now: float):
+        while self._ring and (len(self._ring) > self.max_entries or now - self._ring[0][0] > self.ttl_sec):
+            _, expired_event_id = self._ring.popleft()
+            self._event_ids.discard(expired_event_id)
+
+    def __len__(self):
+        return len(self._event_ids)
+
+class SqliteEventDeduplicator:
+    """
+    sqlite 의 PRIMARY KEY 조건부 삽입(INSERT OR IGNORE)으로 이벤트 ID 를 선점합니다.
+    같은 파일을 사용하는 여러 프로세스 간에도 한 번만 처리되며, 공유 저장소(DynamoDB) 동작의 로컬 대용입니다.
+    """
+    def __init__(self, path: str, ttl_sec: float = EVENT_ID_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS processed_events (event_id TEXT PRIMARY KEY, claimed_at REAL NOT NULL)")
+
+    def claim(self, event_id: str) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM processed_events WHERE claimed_at < ?", (now - self.ttl_sec,))
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO processed_events (event_id, claimed_at) VALUES (?, ?)", (event_id, now)
+            )
+            return cursor.rowcount == 1
+
+    def seen(self, event_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM processed_events WHERE event_id = ? AND claimed_at >= ?", (event_id, time.time() - self.ttl_sec)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM processed_events").fetchone()[0]
+
+class DynamoDbEventDeduplicator:
+    """
+    DynamoDB 조건부 쓰기(attribute_not_exists)로 이벤트 ID 를 선점하여 모든 Lambda 컨테이너 간 중복을 막습니다.
+    테이블의 TTL 속성을 expires_at 으로 설정하면 오래된 항목이 자동 삭제됩니다.
+    """
+    def __init__(self, table_name: str, ttl_sec: float = EVENT_ID_TTL_SEC):
+        self.table_name = table_name
+        self.ttl_sec = ttl_sec
+        self.dynamodb = create_aws_client('dynamodb')
+
+    def claim(self, event_id: str) -> bool:
+        now = int(time.time())
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={"event_id": {"S": event_id}, "expires_at": {"N": str(now + int(self.ttl_sec))}},
+                # TTL 삭제는 지연될 수 있으므로 만료된 항목은 덮어쓸 수 있게 합니다.
+                ConditionExpression="attribute_not_exists(event_id) OR expires_at < :now",
+                ExpressionAttributeValues={":now": {"N": str(now)}},
+            )
+            return True
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def seen(self, event_id: str) -> bool:
+        item = self.dynamodb.get_item(
+            TableName=self.table_name, Key={"event_id": {"S": event_id}}, ConsistentRead=True
+        ).get("Item")
+        return bool(item) and int(item["expires_at"]["N"]) >= int(time.time())
+
+def create_event_deduplicator():
+    if EVENT_DEDUP_TABLE:
+        logger.info(f"이벤트 중복 처리 저장소: DynamoDB ({EVENT_DEDUP_TABLE})")
+        return DynamoDbEventDeduplicator(EVENT_DEDUP_TABLE)
+    if EVENT_DEDUP_DB:
+        logger.info(f"이벤트 중복 처리 저장소: sqlite ({EVENT_DEDUP_DB})")
+        return SqliteEventDeduplicator(EVENT_DEDUP_DB)
+    return MemoryEventDeduplicator()
+
+event_deduplicator = create_event_deduplicator()
+
+# --- 스레드 대화 기록 캐시 설정 ---
+THREAD_HISTORY_CACHE_DB = os.environ.get("THREAD_HISTORY_CACHE_DB") # 예: /tmp/thread_history.sqlite3 (미설정 시 메모리)
+THREAD_HISTORY_CACHE_MAX_THREADS = int(os.environ.get("THREAD_HISTORY_CACHE_MAX_THREADS", "500"))
+THREAD_HISTORY_CACHE_TTL_SEC = float(os.environ.get("THREAD_HISTORY_CACHE_TTL_SEC", "3600"))
+THREAD_HISTORY_MAX_CACHED_TURNS = int(os.environ.get("THREAD_HISTORY_MAX_CACHED_TURNS", "200")) # 스레드별로 보관할 최대 대화 턴 수
+THREAD_HISTORY_PROMPT_TURNS = int(os.environ.get("THREAD_HISTORY_PROMPT_TURNS", "20")) # 프롬프트에 포함할 최근 대화 턴 수
+# 봇 메시지는 게시 후 이 시간 동안 대기 메시지 -> 스트리밍 -> 최종 답변으로 chat_update 될 수 있으므로 캐시에 확정하지 않고 매번 다시 조회합니다.
+THREAD_HISTORY_BOT_SETTLE_SEC = float(os.environ.get("THREAD_HISTORY_BOT_SETTLE_SEC", "900")) # 기본: Lambda 최대 실행 시간
+THREAD_HISTORY_PAGE_SIZE = 200 # conversations.replies 한 페이지 크기
+THREAD_HISTORY_MAX_PAGES = 20 # 한 번의 조회에서 따라갈 최대 페이지 수
+
+# --- 스레드 요약 설정 ---
+# 긴 스레드에서는 오래된 대화 턴을 요약 하나로 접어 두고, 프롬프트에는 요약 + 최근 턴만 넣어 입력 토큰 수를 일정하게 유지합니다.
+# 요약은 스레드별로 캐시되며, 답변을 보낸 뒤(응답 경로 밖에서) 새로 쌓인 턴만 기존 요약에 합쳐 갱신합니다.
+THREAD_SUMMARY_ENABLED = os.environ.get("THREAD_SUMMARY_ENABLED", "false").lower() == "true"
+THREAD_SUMMARY_TRIGGER_TOKENS = int(os.environ.get("THREAD_SUMMARY_TRIGGER_TOKENS", "2000")) # 스레드 대화 추정 토큰 수가 이를 넘으면 요약 사용
+THREAD_SUMMARY_RECENT_TURNS = int(os.environ.get("THREAD_SUMMARY_RECENT_TURNS", "6")) # 요약하지 않고 그대로 넣을 최근 턴 수
+THREAD_SUMMARY_REFRESH_TOKENS = int(os.environ.get("THREAD_SUMMARY_REFRESH_TOKENS", "800")) # 요약 이후 쌓인 (최근 턴 제외) 대화가 이보다 크면 요약 갱신
+THREAD_SUMMARY_MAX_TOKENS = int(os.environ.get("THREAD_SUMMARY_MAX_TOKENS", "512")) # 요약 생성 max_tokens
+THREAD_SUMMARY_MODEL_ID = os.environ.get("THREAD_SUMMARY_MODEL_ID") # 요약용 모델 (미설정 시 봇의 모델 사용, 예: Claude 3 Haiku)
+THREAD_SUMMARY_DB = os.environ.get("THREAD_SUMMARY_DB") # 예: /tmp/thread_summary.sqlite3 (미설정 시 메모리)
+THREAD_SUMMARY_MAX_THREADS = int(os.environ.get("THREAD_SUMMARY_MAX_THREADS", "1000"))
+THREAD_SUMMARY_TTL_SEC = float(os.environ.get("THREAD_SUMMARY_TTL_SEC", "604800")) # 7일
+# Lambda 는 응답 후 실행 환경이 멈추므로, 기본적으로 답변을 보낸 뒤 같은 호출 안에서 요약 갱신이 끝나길 기다립니다.
+THREAD_SUMMARY_REFRESH_SYNC = os.environ.get("THREAD_SUMMARY_REFRESH_SYNC", str(bool(os.environ.get("AWS_LAMBDA_FUNCTION_NAME")))).lower() == "true"
+THREAD_SUMMARY_SPEAKER = "이전 대화 요약" # 프롬프트 타임라인에서 요약 턴의 "from" 값
+
+# --- 스레드별 연속 멘션 조정 설정 ---
+# 같은 스레드에 짧은 간격으로 이어진 멘션은 가장 최근 멘션 하나만 답변을 생성합니다 (스레드 기록에 앞선 질문이 포함됨).
+# 스레드별 "최신 멘션" 임대(lease)를 저장소에 기록하고, 더 새로운 멘션이 임대를 가져가면 이전 멘션은
+# Bedrock 호출 전이면 호출을 생략하고, 생성 중이면 스트리밍을 중단하거나 완성된 답변을 버립니다.
+MENTION_COALESCE_ENABLED = os.environ.get("MENTION_COALESCE_ENABLED", "false").lower() == "true"
+MENTION_DEBOUNCE_SEC = float(os.environ.get("MENTION_DEBOUNCE_SEC", "1.0")) # 멘션 수신 후 Bedrock 호출 전까지 후속 멘션을 기다리는 최소 시간
+MENTION_LEASE_TTL_SEC = float(os.environ.get("MENTION_LEASE_TTL_SEC", "300")) # 임대 유효 시간 (처리 중 컨테이너가 사라져도 만료됨)
+MENTION_LEASE_TABLE = os.environ.get("MENTION_LEASE_TABLE") # DynamoDB 테이블 (파티션 키: thread_key) - 컨테이너 간 공유
+MENTION_LEASE_DB = os.environ.get("MENTION_LEASE_DB") # sqlite 파일 경로 - 같은 호스트의 프로세스 간 공유 (로컬/테스트용)
+SUPERSEDED_MENTION_MESSAGE = "_(이어진 질문과 함께 아래 답변에서 다룹니다.)_"
+PLACEHOLDER_MESSAGE = "잠시만 기다려주세요, 답변을 생성하고 있습니다... ⏳"
+# 봇이 답변 대신 남기는 상태 메시지 - 대화 기록(프롬프트)에는 넣지 않습니다.
+# (합쳐진 멘션의 답변에서 앞선 질문이 대기 메시지로 "답변된" 것처럼 보이지 않도록)
+BOT_STATUS_MESSAGES = (PLACEHOLDER_MESSAGE, SUPERSEDED_MENTION_MESSAGE)
+
+# --- 응답 캐시 설정 ---
+# 새 멘션(스레드가 아닌 단일 질문)에 대한 LLM 응답을 캐시하여 반복되는 FAQ 성 질문의 Bedrock 호출을 생략합니다.
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_DB = os.environ.get("RESPONSE_CACHE_DB") # 예: /tmp/response_cache.sqlite3 (미설정 시 메모리)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_TTL_SEC = float(os.environ.get("RESPONSE_CACHE_TTL_SEC", "86400"))
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.environ.get("RESPONSE_CACHE_MAX_TEMPERATURE", "0.7")) # 이보다 높은 temperature 는 캐시하지 않음
+
+# --- 프롬프트 구성 설정 ---
+# "json_timeline": 시스템 프롬프트 + JSON 타임라인을 하나의 user 메시지로 전달 (기존 방식)
+# "messages": Messages API 의 system 필드와 user/assistant 교대 턴으로 전달 (입력 토큰 절감)
+PROMPT_FORMAT = os.environ.get("PROMPT_FORMAT", "json_timeline")
+PROMPT_INPUT_TOKEN_BUDGET = int(os.environ.get("PROMPT_INPUT_TOKEN_BUDGET", "6000")) # "messages" 형식의 입력 토큰 예산 (추정치 기준)
+
+# --- Bedrock 프롬프트 캐싱 설정 ---
+# "messages" 형식에서 시스템 프롬프트와 스레드의 앞부분(마지막 질문 전까지)에 cache_control 체크포인트를 붙여
+# 같은 봇/스레드의 다음 호출이 캐시된 입력을 읽도록 합니다. 지원 모델이 아니면 체크포인트 없이 기존과 같이 호출합니다.
+PROMPT_CACHING_ENABLED = os.environ.get("PROMPT_CACHING_ENABLED", "false").lower() == "true"
+# 프롬프트 캐싱을 지원하는 모델 ID 에 포함된 문자열 (쉼표 구분, 교차 리전 추론 프로필 접두사 us./apac. 등도 일치)
+PROMPT_CACHING_MODELS = [pattern.strip() for pattern in os.environ.get(
+    "PROMPT_CACHING_MODELS",
+    "anthropic.claude-3-5-haiku,anthropic.claude-3-7-sonnet,anthropic.claude-sonnet-4,anthropic.claude-opus-4,anthropic.claude-haiku-4"
+).split(",") if pattern.strip()]
+PROMPT_CACHE_MIN_TOKENS = int(os.environ.get("PROMPT_CACHE_MIN_TOKENS", "1024")) # 체크포인트까지의 추정 토큰 수가 이보다 적으면 표시하지 않음 (모델 최소 캐시 크기)
+
+# --- 스트리밍 응답 설정 ---
+# LLM_STREAMING_ENABLED=true 이면 invoke_model_with_response_stream 으로 토큰을 받아
+# 임시 대기 메시지를 chat_update 로 점진적으로 갱신합니다.
+LLM_STREAMING_ENABLED = os.environ.get("LLM_STREAMING_ENABLED", "false").lower() == "true"
+STREAMING_UPDATE_INTERVAL_SEC = float(os.environ.get("STREAMING_UPDATE_INTERVAL_SEC", "1.0")) # chat.update 최소 간격 (Slack Tier 3 rate limit 고려)
+SLACK_MAX_MESSAGE_CHARS = int(os.environ.get("SLACK_MAX_MESSAGE_CHARS", "3900")) # 메시지 하나에 담을 최대 글자 수 (초과 시 다음 메시지로 분할)
+STREAMING_CURSOR = " ⏳" # 생성 중임을 표시하는 꼬리 문자열
+
+# --- Slack Web API 호출 계층 설정 ---
+# 모든 Slack Web API 호출은 slack_api(SlackApiLayer)를 거칩니다. (워크스페이스, 메서드)별 토큰 버킷으로 호출 속도를 맞추고,
+# 429 응답을 받으면 Retry-After 동안 같은 워크스페이스의 같은 메서드 호출을 모두 멈춘 뒤 재시도합니다.
+# 한도 대기와 Retry-After 는 SLACK_RATE_LIMIT_MAX_WAIT_SEC 와 Lambda 남은 시간을 넘기지 않으며, 넘으면 기다리지 않고 오류로 처리합니다.
+SLACK_REPLACE_PLACEHOLDER = os.environ.get("SLACK_REPLACE_PLACEHOLDER", "true").lower() == "true" # 최종 답변을 대기 메시지 chat_update 로 전달 (false 면 새 메시지 게시 후 대기 메시지 삭제)
+SLACK_RATE_LIMIT_MAX_RETRIES = int(os.environ.get("SLACK_RATE_LIMIT_MAX_RETRIES", "3")) # 429 응답 시 재시도 횟수
+SLACK_RATE_LIMIT_MAX_WAIT_SEC = float(os.environ.get("SLACK_RATE_LIMIT_MAX_WAIT_SEC", "30")) # 한도 대기/Retry-After 가 이보다 길면 기다리지 않음
+SLACK_RATE_LIMIT_BURST_SEC = float(os.environ.get("SLACK_RATE_LIMIT_BURST_SEC", "10")) # 버킷 크기 (분당 한도 기준 몇 초 분량까지 몰아서 호출할지)
+# 메서드별 분당 호출 한도 (Slack rate limit tier 기준). SLACK_METHOD_RATE_LIMITS='{"chat.update": 30}' 처럼 덮어쓸 수 있습니다.
+SLACK_METHOD_RATE_LIMITS = {
+    "auth.test": 100, # Tier 4
+    "chat.postMessage": 60, # 채널당 초당 1회 (special, 채널별 버킷)
+    "chat.update": 50, # Tier 3
+    "chat.delete": 50, # Tier 3
+    "conversations.replies": 50, # Tier 3
+}
+SLACK_METHOD_RATE_LIMITS.update(json.loads(os.environ.get("SLACK_METHOD_RATE_LIMITS", "{}")))
+SLACK_DEFAULT_RATE_LIMIT = 20 # 목록에 없는 메서드 (Tier 2)
+SLACK_CHANNEL_RATE_LIMITED_METHODS = {"chat.postMessage"} # 워크스페이스가 아니라 채널 단위로 한도가 적용되는 메서드
+BOT_IDENTITY_CACHE_TTL_SEC = float(os.environ.get("BOT_IDENTITY_CACHE_TTL_SEC", "86400")) # auth.test 로 얻은 봇 ID 를 기억할 시간
+
+# --- Bedrock 호출 안정화 설정 (동시성 제한 / 재시도 / 대체 모델) ---
+# 기본 모델이 스로틀링 등으로 실패하면 순서대로 시도할 대체 모델 ID 또는 교차 리전 추론 프로필 (쉼표 구분, Anthropic Messages API 모델)
+BEDROCK_FALLBACK_MODEL_IDS = [model_id.strip() for model_id in os.environ.get("BEDROCK_FALLBACK_MODEL_IDS", "").split(",") if model_id.strip()]
+BEDROCK_MAX_RETRIES = int(os.environ.get("BEDROCK_MAX_RETRIES", "4")) # 모델별 재시도 횟수 (재시도 가능한 오류만)
+BEDROCK_RETRY_BASE_DELAY_SEC = float(os.environ.get("BEDROCK_RETRY_BASE_DELAY_SEC", "0.25")) # 지수 백오프 시작 값 (full jitter)
+BEDROCK_RETRY_MAX_DELAY_SEC = float(os.environ.get("BEDROCK_RETRY_MAX_DELAY_SEC", "8"))
+BEDROCK_DEADLINE_MARGIN_SEC = float(os.environ.get("BEDROCK_DEADLINE_MARGIN_SEC", "5")) # Lambda 남은 시간 중 Slack 응답 전송용으로 남겨둘 시간
+BEDROCK_MIN_ATTEMPT_SEC = float(os.environ.get("BEDROCK_MIN_ATTEMPT_SEC", "5")) # 남은 시간이 이보다 적으면 새로 시도하지 않음
+BEDROCK_CONCURRENCY_INITIAL = int(os.environ.get("BEDROCK_CONCURRENCY_INITIAL", "8")) # 모델별 동시 호출 한도 초기값 (AIMD 로 조절)
+BEDROCK_CONCURRENCY_MIN = int(os.environ.get("BEDROCK_CONCURRENCY_MIN", "1"))
+BEDROCK_CONCURRENCY_MAX = int(os.environ.get("BEDROCK_CONCURRENCY_MAX", "32")) # BEDROCK_MAX_POOL_CONNECTIONS 이하로 설정
+BEDROCK_CONCURRENCY_DECREASE_FACTOR = float(os.environ.get("BEDROCK_CONCURRENCY_DECREASE_FACTOR", "0.5")) # 스로틀링 시 한도에 곱할 값
+
+# --- 단계별 지연 시간 / 토큰 사용량 계측 설정 ---
+# 멘션 처리와 Lambda 호출마다 단계별 소요 시간(span)과 Bedrock usage 토큰 수를 모아
+# CloudWatch Embedded Metric Format(EMF) JSON 한 줄로 stdout 에 출력합니다 (Lambda 에서는 CloudWatch 지표로 자동 추출).
+METRICS_EMF_ENABLED = os.environ.get("METRICS_EMF_ENABLED", str(bool(os.environ.get("AWS_LAMBDA_FUNCTION_NAME")))).lower() == "true"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "SlackBedrockBot")
+METRICS_SERVICE_NAME = os.environ.get("METRICS_SERVICE_NAME") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME") or "slack-bedrock-bot"
+METRICS_LOCAL_WINDOW = int(os.environ.get("METRICS_LOCAL_WINDOW", "1000")) # 로컬 집계에서 단계별로 유지할 최근 측정값 수
+METRICS_LOCAL_SUMMARY_INTERVAL_SEC = float(os.environ.get("METRICS_LOCAL_SUMMARY_INTERVAL_SEC", "60")) # 로컬 서버 p50/p95/p99 출력 주기
+
+# --- 시스템 프롬프트 레지스트리 설정 ---
+# 원래 구현은 함수 안에서 `"__file__" in locals()` 를 검사하여 항상 현재 작업 디렉토리를 사용했으므로 기본값도 이를 따릅니다.
+# (Lambda 환경에서는 /var/task/ 가 현재 작업 디렉토리)
+PROMPT_BASE_PATH = os.environ.get("PROMPT_BASE_PATH") or os.getcwd()
+PROMPT_REGISTRY_MAX_BOTS = int(os.environ.get("PROMPT_REGISTRY_MAX_BOTS", "64")) # 메모리에 유지할 최대 봇 수 (LRU)
+PROMPT_RELOAD_CHECK_INTERVAL_SEC = float(os.environ.get("PROMPT_RELOAD_CHECK_INTERVAL_SEC", "30")) # 파일 변경 여부(mtime/size) 확인 주기
+
+# --- 참고 문서 검색(retrieval) 설정 ---
+# 봇별 참고 문서 폴더(docs_{봇ID}/)를 미리 청크로 나누어 임베딩 인덱스를 만들어 두고(build_index.py),
+# 요청마다 질문과 가장 관련 있는 청크 top-k 만 프롬프트에 넣습니다. 인덱스가 없는 봇은 기존과 같이 동작합니다.
+# 추가 라이브러리 필요: pip install numpy
+RETRIEVAL_ENABLED = os.environ.get("RETRIEVAL_ENABLED", "false").lower() == "true"
+RETRIEVAL_DOCS_PATH = os.environ.get("RETRIEVAL_DOCS_PATH") or PROMPT_BASE_PATH # docs_{봇ID}/ 폴더가 있는 위치 (인덱스 생성 시 사용)
+RETRIEVAL_INDEX_PATH = os.environ.get("RETRIEVAL_INDEX_PATH") or os.path.join(PROMPT_BASE_PATH, "retrieval_index") # {봇ID}/ 인덱스 위치
+RETRIEVAL_EMBEDDER = os.environ.get("RETRIEVAL_EMBEDDER", "hashing") # "hashing": 로컬 결정적 임베딩, "bedrock": Bedrock 임베딩 모델, "모듈:팩토리": 직접 구현
+RETRIEVAL_EMBEDDING_MODEL_ID = os.environ.get("RETRIEVAL_EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v2:0") # "bedrock" 임베딩 모델
+RETRIEVAL_EMBEDDING_DIM = int(os.environ.get("RETRIEVAL_EMBEDDING_DIM", "512")) # 임베딩 차원 (Titan v2: 256 / 512 / 1024)
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "4")) # 프롬프트에 넣을 최대 청크 수
+RETRIEVAL_MIN_SCORE = float(os.environ.get("RETRIEVAL_MIN_SCORE", "0.1")) # 코사인 유사도가 이보다 낮은 청크는 제외
+RETRIEVAL_CHUNK_CHARS = int(os.environ.get("RETRIEVAL_CHUNK_CHARS", "800")) # 청크 최대 글자 수 (문단 단위로 채움)
+RETRIEVAL_CHUNK_OVERLAP_CHARS = int(os.environ.get("RETRIEVAL_CHUNK_OVERLAP_CHARS", "100")) # 긴 문단을 자를 때 겹치는 글자 수
+RETRIEVAL_FILE_EXTENSIONS = (".txt", ".md")
+
+# --- 질문 난이도 라우팅 설정 ---
+# 봇 설정의 "routing" 에 routes 가 있으면 질문 길이/스레드 깊이/키워드 규칙(+ 선택적 소형 모델 분류기)으로
+# 질문을 simple / standard / complex 로 분류하고, 경로별 모델과 max_tokens 를 적용합니다.
+# QUERY_ROUTING 환경 변수(JSON)는 모든 봇의 기본값이며, 봇 설정 파일의 "routing" 이 있으면 그것으로 대체됩니다.
+QUERY_ROUTING = json.loads(os.environ.get("QUERY_ROUTING", "{}"))
+QUERY_ROUTES = ("simple", "standard", "complex")
+DEFAULT_ROUTING_RULES = {
+    "simple_max_chars": 40, # 이 길이 이하이고 스레드가 짧으면 simple
+    "simple_max_turns": 2,
+    "complex_min_chars": 400, # 이 길이 이상이거나 스레드가 complex_min_turns 턴 이상이면 complex
+    "complex_min_turns": 12,
+    "simple_keywords": ["안녕", "고마워", "감사", "thanks", "thank you", "hello", "hi"],
+    "complex_keywords": ["분석", "비교", "설계", "아키텍처", "리팩터", "디버그", "최적화", "단계별", "장단점", "트레이드오프", "```"],
+    "classifier_model_id": None, # 규칙으로 정해지지 않는 질문을 분류할 소형 모델 (예: Claude 3 Haiku, 미설정 시 standard)
+}
+
+# 봇별 설정 파일(bot_settings_{봇ID}.json)에서 덮어쓸 수 있는 LLM 호출 기본값
+DEFAULT_LLM_SETTINGS = {
+    "model_id": bedrock_model_id,
+    "max_tokens": 1024,
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "fallback_model_ids": BEDROCK_FALLBACK_MODEL_IDS,
+    "routing": QUERY_ROUTING, # {"routes": {"simple": {"model_id": ..., "max_tokens": 300}, ...}, 규칙 덮어쓰기...}
+}
+
+@dataclass
+class BotPromptProfile:
+    bot_user_id: str
+    system_prompt: str
+    llm_settings: dict
+    prompt_path: str
+    signature: tuple # (프롬프트 파일 mtime/size, 설정 파일 mtime/size)
+    checked_at: float = field(default_factory=time.time)
+
+class SystemPromptRegistry:
+    """
+    봇별 시스템 프롬프트와 LLM 설정(모델 ID, max_tokens, temperature 등)을 메모리에 캐시합니다.
+    - 처음 요청될 때 한 번만 파일을 읽고(lazy), 최대 max_entries 개의 봇까지 LRU 로 유지합니다.
+    - reload_check_interval 초가 지난 항목만 파일 mtime/size 를 확인(stat)하여 변경된 경우에만 다시 읽습니다.
+      그 사이의 warm 호출은 디스크 접근 없이 메모리에서 바로 반환됩니다.
+    - invalidate() 로 즉시 다시 읽도록 할 수 있습니다 (로컬 서버에서는 SIGHUP 으로 호출).
+    """
+    def __init__(self, base_path: str, max_entries: int = PROMPT_REGISTRY_MAX_BOTS,
+                 reload_check_interval: float = PROMPT_RELOAD_CHECK_INTERVAL_SEC):
+        self.base_path = base_path
+        self.max_entries = max_entries
+        self.reload_check_interval = reload_check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock() # 로컬 서버의 요청별 스레드에서 동시에 접근할 수 있음
+        self.load_count = 0
+
+    def prompt_path(self, bot_user_id: str) -> str:
+        return os.path.join(self.base_path, f"system_prompt_{bot_user_id}.txt")
+
+    def settings_path(self, bot_user_id: str) -> str:
+        return os.path.join(self.base_path, f"bot_settings_{bot_user_id}.json")
+
+    def get(self, bot_user_id: str) -> BotPromptProfile:
+        """
+        봇의 프롬프트 프로필을 반환합니다.
+        프롬프트 파일이 없으면 FileNotFoundError 가, 설정 파일 형식이 잘못되었으면 ValueError 가 발생합니다.
+        """
+        now = time.time()
+        with self._lock:
+            profile = self._entries.get(bot_user_id)
+            if profile is not None:
+                self._entries.move_to_end(bot_user_id)
+                if now - profile.checked_at < self.reload_check_interval:
+                    return profile
+
+        signature = self._file_signature(bot_user_id)
+        if profile is not None and profile.signature == signature:
+            profile.checked_at = now
+            return profile
+
+        profile = self._load(bot_user_id, signature)
+        with self._lock:
+            self._entries[bot_user_id] = profile
+            self._entries.move_to_end(bot_user_id)
+            while len(self._entries) > self.max_entries:
+                evicted_bot_user_id, _ = self._entries.popitem(last=False)
+                logger.info(f"시스템 프롬프트 캐시에서 제거 (LRU): {evicted_bot_user_id}")
+        return profile
+
+    def invalidate(self, bot_user_id: str = None):
+        """지정한 봇(또는 전체)의 캐시를 비워 다음 요청 시 파일을 다시 읽도록 합니다."""
+        with self._lock:
+            if bot_user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(bot_user_id, None)
+        logger.info(f"시스템 프롬프트 캐시 무효화: {bot_user_id or '전체'}")
+
+    def _file_signature(self, bot_user_id: str) -> tuple:
+        prompt_stat = os.stat(self.prompt_path(bot_user_id)) # 없으면 FileNotFoundError
+        try:
+            settings_stat = os.stat(self.settings_path(bot_user_id))
+            settings_signature = (settings_stat.st_mtime_ns, settings_stat.st_size)
+        except FileNotFoundError:
+            settings_signature = None
+        return ((prompt_stat.st_mtime_ns, prompt_stat.st_size), settings_signature)
+
+    def _load(self, bot_user_id: str, signature: tuple) -> BotPromptProfile:
+        prompt_path = self.prompt_path(bot_user_id)
+        with open(prompt_path, 'r', encoding='utf-8') as f:
+            system_prompt_text = f.read().strip()
+
+        llm_settings = dict(DEFAULT_LLM_SETTINGS)
+        if signature[1] is not None:
+            settings_path = self.settings_path(bot_user_id)
+            with open(settings_path, 'r', encoding='utf-8') as f:
+                try:
+                    overrides = json.load(f)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"봇 설정 파일 '{settings_path}' 의 JSON 형식이 잘못되었습니다: {e}") from e
+            if not isinstance(overrides, dict):
+                raise ValueError(f"봇 설정 파일 '{settings_path}' 은 JSON 객체여야 합니다.")
+            unknown_keys = set(overrides) - set(DEFAULT_LLM_SETTINGS)
+            if unknown_keys:
+                logger.warning(f"봇 설정 파일 '{settings_path}' 의 알 수 없는 키 무시: {sorted(unknown_keys)}")
+            llm_settings.update({key: value for key, value in overrides.items() if key in DEFAULT_LLM_SETTINGS})
+            validate_routing_settings(llm_settings["routing"], settings_path)
+
+        self.load_count += 1
+        logger.info(f"시스템 프롬프트 로드 완료: {prompt_path} (모델: {llm_settings['model_id']})")
+        return BotPromptProfile(
+            bot_user_id=bot_user_id,
+            system_prompt=system_prompt_text,
+            llm_settings=llm_settings,
+            prompt_path=prompt_path,
+            signature=signature,
+        )
+
+prompt_registry = SystemPromptRegistry(PROMPT_BASE_PATH)
+
+# --- 단계별 계측 (span / EMF) ---
+class RequestTrace:
+    """
+    요청 하나(kind: "mention" 멘션 처리, "invocation" Lambda 호출)의 단계별 소요 시간과 수치 지표를 모읍니다.
+    같은 단계가 여러 번 기록되면(재시도, 여러 페이지 조회 등) 시간을 합산합니다.
+    비동기 모드에서는 여러 스레드/태스크가 같은 trace 에 기록하므로 잠금을 사용합니다.
+    """
+    def __init__(self, kind: str, properties: dict = None):
+        self.kind = kind
+        self.started_at = time.perf_counter()
+        self.spans_ms = {} # 단계 -> 소요 시간(ms)
+        self.values = {} # 지표 이름 -> [값, 단위]
+        self.dimensions = {}
+        self.properties = dict(properties or {}) # 지표가 아닌 검색용 필드 (이벤트 ID 등)
+        self._lock = threading.Lock()
+
+    def add_span(self, stage: str, duration_ms: float):
+        with self._lock:
+            self.spans_ms[stage] = self.spans_ms.get(stage, 0.0) + duration_ms
+
+    def add_value(self, name: str, value: float, unit: str = "Count"):
+        with self._lock:
+            if name in self.values:
+                self.values[name][0] += value
+            else:
+                self.values[name] = [value, unit]
+
+    def finish(self):
+        self.spans_ms["total"] = (time.perf_counter() - self.started_at) * 1000
+
+    def to_emf(self) -> dict:
+        """CloudWatch Embedded Metric Format 문서를 반환합니다 (단계별 시간은 <단계>_ms 지표)."""
+        metrics = {f"{stage}_ms": (round(duration_ms, 1), "Milliseconds") for stage, duration_ms in self.spans_ms.items()}
+        metrics.update({name: (value, unit) for name, (value, unit) in self.values.items()})
+        dimension_sets = [["Service", "Kind"]]
+        if self.dimensions:
+            dimension_sets.append(["Service", "Kind"] + sorted(self.dimensions))
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": dimension_sets,
+                    "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()],
+                }],
+            },
+            "Service": METRICS_SERVICE_NAME,
+            "Kind": self.kind,
+        }
+        document.update(self.dimensions)
+        document.update(self.properties)
+        document.update({name: value for name, (value, _) in metrics.items()})
+        return document
+
+class StageLatencyAggregator:
+    """로컬 서버용 집계기입니다. (kind, 단계)별 최근 window 개의 소요 시간으로 p50/p95/p99 를 계산합니다."""
+    def __init__(self, window: int = METRICS_LOCAL_WINDOW):
+        self.window = window
+        self._samples = {} # "kind.단계" -> deque[ms]
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def record(self, trace: RequestTrace):
+        with self._lock:
+            for stage, duration_ms in trace.spans_ms.items():
+                self._samples.setdefault(f"{trace.kind}.{stage}", deque(maxlen=self.window)).append(duration_ms)
+            self.recorded += 1
+
+    @staticmethod
+    def percentile(sorted_values: list, percent: float) -> float:
+        # nearest-rank 방식
+        return sorted_values[max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)]
+
+    def summary(self) -> dict:
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+        return {
+            stage: {"count": len(values), "p50": self.percentile(values, 50), "p95": self.percentile(values, 95), "p99": self.percentile(values, 99)}
+            for stage, values in sorted(samples.items())
+        }
+
+    def format_summary(self) -> str:
+        lines = [f"{'stage':<32} {'count':>6} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}"]
+        for stage, row in self.summary().items():
+            lines.append(f"{stage:<32} {row['count']:>6} {row['p50']:>9.1f} {row['p95']:>9.1f} {row['p99']:>9.1f}")
+        return "\n".join(lines)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+stage_latency_aggregator = None # 로컬 서버(__main__)에서 설정
+
+def start_trace(kind: str, **properties):
+    """새 RequestTrace 를 현재 컨텍스트에 설정하고, finish_trace 에 넘길 토큰을 반환합니다."""
+    return _current_trace.set(RequestTrace(kind, properties))
+
+def finish_trace(token) -> RequestTrace:
+    """현재 trace 를 마무리하여 EMF 로 출력하고 로컬 집계기에 기록한 뒤, 이전 trace 로 되돌립니다."""
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is None:
+        return None
+    trace.finish()
+    if METRICS_EMF_ENABLED:
+        try:
+            # EMF 는 로그 포맷(시각/레벨 접두어) 없이 JSON 한 줄이어야 하므로 logger 대신 stdout 에 직접 씁니다.
+            print(json.dumps(trace.to_emf(), ensure_ascii=False), flush=True)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"EMF 지표 직렬화 실패: {e}")
+    if stage_latency_aggregator is not None:
+        stage_latency_aggregator.record(trace)
+    return trace
+
+@contextlib.contextmanager
+def trace_span(stage: str):
+    """with 블록의 소요 시간을 현재 trace 의 stage 단계로 기록합니다 (trace 가 없으면 아무것도 하지 않음)."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(stage, (time.perf_counter() - start_time) * 1000)
+
+async def async_trace_span(stage: str, awaitable):
+    """awaitable 을 기다린 시간을 stage 단계로 기록하고 결과를 반환합니다 (asyncio.gather 의 각 작업용)."""
+    with trace_span(stage):
+        return await awaitable
+
+def trace_duration(stage: str, duration_ms: float):
+    """이미 측정한 소요 시간을 stage 단계로 기록합니다 (예: 스트리밍 첫 토큰까지의 시간)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(stage, duration_ms)
+
+def trace_value(name: str, value: float, unit: str = "Count"):
+    trace = _current_trace.get()
+    if trace is not None and value is not None:
+        trace.add_value(name, value, unit)
+
+def trace_dimension(name: str, value: str):
+    trace = _current_trace.get()
+    if trace is not None and value:
+        trace.dimensions[name] = value
+
+# --- 질문 난이도 라우팅 ---
+def validate_routing_settings(routing: dict, source: str):
+    """봇 설정의 "routing" 형식을 확인합니다. 잘못되었으면 ValueError 가 발생합니다."""
+    if not isinstance(routing, dict) or not isinstance(routing.get("routes", {}), dict):
+        raise ValueError(f"'{source}' 의 routing 은 {{\"routes\": {{경로: 설정}}}} 형식의 JSON 객체여야 합니다.")
+    for route_name, route_settings in routing.get("routes", {}).items():
+        if route_name not in QUERY_ROUTES or not isinstance(route_settings, dict):
+            raise ValueError(f"'{source}' 의 routing.routes.{route_name} 이(가) 잘못되었습니다 (경로: {QUERY_ROUTES}, 값: JSON 객체).")
+        unknown_keys = set(route_settings) - (set(DEFAULT_LLM_SETTINGS) - {"routing"})
+        if unknown_keys:
+            raise ValueError(f"'{source}' 의 routing.routes.{route_name} 에 알 수 없는 키가 있습니다: {sorted(unknown_keys)}")
+
+class QueryRouter:
+    """
+    질문을 simple / standard / complex 경로로 분류하고 경로별 LLM 설정을 적용합니다.
+    - 규칙: complex 키워드(코드 블록 포함), 질문 길이, 스레드 깊이(요약이 있으면 긴 스레드로 간주), simple 키워드 순으로 판단합니다.
+    - 규칙으로 정해지지 않는 질문은 classifier_model_id 가 있으면 소형 모델로 분류하고, 없으면 standard 로 둡니다.
+    - record 로 경로별 호출 수, Bedrock 지연 시간, 입력/출력 토큰 수를 모아 stats 로 임계값 조정 근거를 제공합니다.
+      (CloudWatch 에서는 EMF 의 Route 차원으로 같은 지표를 경로별로 볼 수 있습니다.)
+    """
+    CLASSIFIER_SYSTEM_PROMPT = (
+        "Slack 질문의 난이도를 분류하세요. simple: 인사, 짧은 사실 확인, 간단한 조회. "
+        "standard: 일반적인 설명이나 질문. complex: 여러 단계의 분석, 비교, 설계, 코드 작성/디버깅, 긴 맥락이 필요한 질문. "
+        "simple, standard, complex 중 한 단어로만 답하세요."
+    )
+
+    def __init__(self, window: int = METRICS_LOCAL_WINDOW):
+        self.window = window
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def route(self, user_query: str, conversation_turns: list, llm_settings: dict) -> tuple:
+        """(경로 이름 또는 None, 경로 설정을 적용한 llm_settings) 를 반환합니다. 봇에 routes 가 없으면 (None, llm_settings) 입니다."""
+        routing = llm_settings.get("routing") or {}
+        routes = routing.get("routes")
+        if not routes:
+            return None, llm_settings
+        rules = dict(DEFAULT_ROUTING_RULES, **{key: value for key, value in routing.items() if key != "routes"})
+        route_name, reason = self.classify(user_query, conversation_turns, rules, llm_settings)
+        routed_settings = dict(llm_settings, **routes.get(route_name, {}))
+        trace_dimension("Route", route_name)
+        logger.info(f"질문 라우팅: {route_name} ({reason}) -> 모델 {routed_settings['model_id']}, max_tokens {routed_settings['max_tokens']}")
+        return route_name, routed_settings
+
+    def classify(self, user_query: str, conversation_turns: list, rules: dict, llm_settings: dict) -> tuple:
+        """(경로 이름, 판단 근거) 를 반환합니다."""
+        query = user_query.lower()
+        query_chars = len(user_query)
+        thread_turns = len(conversation_turns)
+        if any(turn["from"] == THREAD_SUMMARY_SPEAKER for turn in conversation_turns):
+            thread_turns = max(thread_turns, rules["complex_min_turns"]) # 요약된 긴 스레드
+
+        complex_keyword = next((keyword for keyword in rules["complex_keywords"] if keyword.lower() in query), None)
+        if complex_keyword:
+            return "complex", f"키워드 '{complex_keyword}'"
+        if query_chars >= rules["complex_min_chars"]:
+            return "complex", f"질문 {query_chars}자"
+        if thread_turns >= rules["complex_min_turns"]:
+            return "complex", f"스레드 {thread_turns}턴"
+        if query_chars <= rules["simple_max_chars"] and thread_turns <= rules["simple_max_turns"]:
+            return "simple", f"짧은 질문 {query_chars}자"
+        simple_keyword = next((keyword for keyword in rules["simple_keywords"] if keyword.lower() in query), None)
+        if simple_keyword and query_chars <= rules["simple_max_chars"] * 2:
+            return "simple", f"키워드 '{simple_keyword}'"
+        if rules.get("classifier_model_id"):
+            return self.classify_with_model(user_query, thread_turns, rules["classifier_model_id"], llm_settings)
+        return "standard", "규칙 해당 없음"
+
+    def classify_with_model(self, user_query: str, thread_turns: int, classifier_model_id: str, llm_settings: dict) -> tuple:
+        # 분류기 호출의 지연 시간/토큰은 멘션 지표와 섞이지 않도록 별도 trace(kind: route_classifier)로 기록합니다.
+        classifier_settings = dict(llm_settings, model_id=classifier_model_id, max_tokens=5, temperature=0.0, fallback_model_ids=[])
+        prompt = {"system": self.CLASSIFIER_SYSTEM_PROMPT,
+                  "messages": [{"role": "user", "content": f"(스레드 {thread_turns}턴째 질문)\n{user_query}"}]}
+        trace_token = start_trace("route_classifier")
+        try:
+            answer = invoke_llm(prompt, classifier_settings).lower()
+        finally:
+            finish_trace(trace_token)
+        route_name = next((name for name in QUERY_ROUTES if name in answer), None)
+        with self._lock:
+            self._route_stats("classifier")["count"] += 1
+        if route_name is None:
+            return "standard", f"분류기 응답 해석 불가: {answer[:30]!r}"
+        return route_name, f"분류기 ({classifier_model_id})"
+
+    def _route_stats(self, route_name: str) -> dict:
+        return self._stats.setdefault(route_name, {
+            "count": 0, "latency_ms": deque(maxlen=self.window), "input_tokens": 0, "output_tokens": 0,
+        })
+
+    def record(self, route_name: str, trace: RequestTrace):
+        """멘션 처리가 끝난 trace 에서 경로별 Bedrock 지연 시간과 토큰 수를 모읍니다."""
+        if trace is None:
+            return
+        latency_ms = trace.spans_ms.get("bedrock_invoke", trace.spans_ms.get("llm_stream"))
+        with self._lock:
+            stats = self._route_stats(route_name)
+            stats["count"] += 1
+            if latency_ms is not None:
+                stats["latency_ms"].append(latency_ms)
+            stats["input_tokens"] += trace.values.get("input_tokens", [0])[0]
+            stats["output_tokens"] += trace.values.get("output_tokens", [0])[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = {name: dict(stats, latency_ms=sorted(stats["latency_ms"])) for name, stats in self._stats.items()}
+        result = {}
+        for route_name, stats in sorted(snapshot.items()):
+            count, latencies = stats["count"], stats["latency_ms"]
+            result[route_name] = {
+                "count": count,
+                "p50_ms": round(StageLatencyAggregator.percentile(latencies, 50), 1) if latencies else None,
+                "p95_ms": round(StageLatencyAggregator.percentile(latencies, 95), 1) if latencies else None,
+                "avg_input_tokens": round(stats["input_tokens"] / count, 1) if count else 0,
+                "avg_output_tokens": round(stats["output_tokens"] / count, 1) if count else 0,
+            }
+        return result
+
+validate_routing_settings(QUERY_ROUTING, "QUERY_ROUTING")
+query_router = QueryRouter()
+
+# --- Helper 함수: Bedrock 요청 바디 생성 ---
+class PromptCachePolicy:
+    """
+    모델별 프롬프트 캐싱 사용 여부를 정하고 요청에 cache_control 체크포인트를 붙입니다.
+    - 시스템 프롬프트: 봇별로 항상 같으므로 첫 번째 체크포인트입니다.
+    - 대화 앞부분: create_llm_messages 가 다음 후속 멘션에서도 바이트 단위로 같을 경계만 cache_boundaries 로 알려줍니다.
+      스레드 요약 턴(다음 갱신까지 고정)과, 앞에서 잘린 턴이 없을 때의 직전 봇 답변까지가 해당됩니다.
+      최근 N턴/토큰 예산으로 잘려 앞부분이 매번 바뀌는 대화에는 쓰기 비용만 드는 체크포인트를 붙이지 않습니다.
+      검색된 참고 문서는 마지막 user 메시지에 들어가므로 캐시 범위 밖입니다.
+    - 지원 목록의 모델이 체크포인트가 있는 요청을 캐싱 관련 ValidationException 으로 거부하면 그 모델은 이후 캐싱 없이 호출합니다 (모델당 한 번).
+      입력 길이 초과 등 캐싱과 무관한 요청 오류는 다시 보내지 않고 그대로 전달합니다.
+    """
+    CHECKPOINT = {"type": "ephemeral"}
+
+    def __init__(self, enabled: bool = PROMPT_CACHING_ENABLED, model_patterns: list = PROMPT_CACHING_MODELS,
+                 min_tokens: int = PROMPT_CACHE_MIN_TOKENS):
+        self.enabled = enabled
+        self.model_patterns = model_patterns
+        self.min_tokens = min_tokens
+        self._rejected_models = set()
+        self._lock = threading.Lock()
+        self.usage = {"requests": 0, "input_tokens": 0, "cache_read_input_tokens": 0, "cache_write_input_tokens": 0}
+
+    def supports(self, model_id: str) -> bool:
+        return (self.enabled and model_id not in self._rejected_models
+                and any(pattern in model_id for pattern in self.model_patterns))
+
+    def reject(self, model_id: str, error: Exception, request_body: str) -> bool:
+        """
+        체크포인트가 있는 request_body 가 캐싱 때문에 거부된 오류이면 해당 모델의 캐싱을 끄고 True 를 반환합니다 (호출자는 캐싱 없이 다시 호출).
+        """
+        if (not self.supports(model_id) or '"cache_control"' not in request_body
+                or BedrockInvoker.error_code(error) != "ValidationException"):
+            return False
+        error_message = error.response.get("Error", {}).get("Message", "").lower()
+        if "cache_control" not in error_message and "caching" not in error_message:
+            return False
+        with self._lock:
+            self._rejected_models.add(model_id)
+        logger.warning(f"모델 {model_id} 이(가) 프롬프트 캐싱을 지원하지 않아 캐싱 없이 다시 호출합니다: {error}")
+        return True
+
+    @staticmethod
+    def _cached_text(text: str, stable_chars: int = None) -> list:
+        """text 앞의 stable_chars 글자까지를 체크포인트 블록으로, 나머지는 일반 텍스트 블록으로 나눕니다."""
+        stable_chars = len(text) if stable_chars is None else stable_chars
+        blocks = [{"type": "text", "text": text[:stable_chars], "cache_control": PromptCachePolicy.CHECKPOINT}]
+        if text[stable_chars:].strip():
+            blocks.append({"type": "text", "text": text[stable_chars:]})
+        return blocks
+
+    def add_checkpoints(self, system_text: str, messages: list, cache_boundaries: list = ()) -> tuple:
+        """
+        (system, messages) 에 체크포인트를 붙인 사본을 반환합니다. cache_boundaries 는 [메시지 번호, 고정된 앞부분 글자 수] 목록입니다.
+        체크포인트까지의 추정 토큰 수가 최소 캐시 크기보다 작으면 붙이지 않습니다.
+        """
+        system_tokens = estimate_token_count(system_text or "")
+        if system_text and system_tokens >= self.min_tokens:
+            system_text = self._cached_text(system_text)
+        messages = list(messages)
+        for message_index, stable_chars in sorted(cache_boundaries):
+            content = messages[message_index]["content"]
+            prefix_tokens = (system_tokens + sum(estimate_token_count(message["content"]) for message in messages[:message_index] if isinstance(message["content"], str))
+                             + estimate_token_count(content[:stable_chars]))
+            if prefix_tokens >= self.min_tokens:
+                messages[message_index] = dict(messages[message_index], content=self._cached_text(content, stable_chars))
+        return system_text, messages
+
+    def record(self, usage: dict):
+        with self._lock:
+            self.usage["requests"] += 1
+            self.usage["input_tokens"] += usage.get("input_tokens") or 0
+            self.usage["cache_read_input_tokens"] += usage.get("cache_read_input_tokens") or 0
+            self.usage["cache_write_input_tokens"] += usage.get("cache_creation_input_tokens") or 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            usage = dict(self.usage, rejected_models=sorted(self._rejected_models))
+        total_input_tokens = usage["input_tokens"] + usage["cache_read_input_tokens"] + usage["cache_write_input_tokens"]
+        usage["cache_read_ratio"] = round(usage["cache_read_input_tokens"] / total_input_tokens, 3) if total_input_tokens else 0.0
+        return usage
+
+prompt_cache_policy = PromptCachePolicy()
+
+def build_bedrock_request_body(prompt: Union[str, dict], llm_settings: dict = None, model_id: str = None) -> str:
+    """
+    Claude 3 (Messages API) 형식의 Bedrock 요청 바디(JSON 문자열)를 생성합니다.
+    invoke_llm 과 invoke_llm_stream 이 동일한 파라미터를 사용하도록 공통화합니다.
+    prompt 가 문자열이면 단일 user 메시지로, create_llm_messages 의 결과(dict)이면 system + messages 로 전달합니다.
+    model_id(기본: llm_settings 의 model_id)가 프롬프트 캐싱을 지원하면 dict 프롬프트에 cache_control 체크포인트를 붙입니다.
+    """
+    llm_settings = llm_settings or DEFAULT_LLM_SETTINGS
+    system_text = None
+    if isinstance(prompt, dict):
+        messages = prompt["messages"]
+        system_text = prompt.get("system")
+        if prompt_cache_policy.supports(model_id or llm_settings["model_id"]):
+            system_text, messages = prompt_cache_policy.add_checkpoints(system_text, messages, prompt.get("cache_boundaries", ()))
+    else:
+        messages = [
+            {"role": "user", "content": prompt} 
+        ]
+
+    request_body = {
+        "anthropic_version": "bedrock-2023-05-31", 
+        "max_tokens": llm_settings["max_tokens"], 
+        "messages": messages,
+        "temperature": llm_settings["temperature"], 
+        "top_p": llm_settings["top_p"],       
+    }
+    if system_text:
+        request_body["system"] = system_text
+    return json.dumps(request_body, ensure_ascii=False)
+
+# invoke_llm 이 오류 시 반환하는 안내 문구 (응답 캐시에 저장하지 않음)
+LLM_EMPTY_RESPONSE = '죄송합니다, 답변 내용이 비어있습니다.'
+LLM_UNEXPECTED_FORMAT_RESPONSE = '죄송합니다, 예상치 못한 응답 형식입니다.'
+LLM_ERROR_RESPONSE = "죄송합니다, 답변을 생성하는 중 오류가 발생했습니다. 😥"
+LLM_THROTTLED_RESPONSE = "죄송합니다, 지금은 요청이 많아 답변을 생성하지 못했습니다. 잠시 후 다시 시도해주세요. 🙏"
+LLM_FALLBACK_RESPONSES = (LLM_EMPTY_RESPONSE, LLM_UNEXPECTED_FORMAT_RESPONSE, LLM_ERROR_RESPONSE, LLM_THROTTLED_RESPONSE)
+
+# --- Bedrock 호출 래퍼 (동시성 제한 / 재시도 / 대체 모델) ---
+# 현재 Lambda 호출의 마감 시각 (time.monotonic 기준). lambda_handler 가 context 로부터 설정합니다.
+_invocation_deadline = contextvars.ContextVar("invocation_deadline", default=None)
+
+def set_invocation_deadline(context):
+    """context.get_remaining_time_in_millis() 로 마감 시각을 설정하고, 원래대로 되돌릴 때 쓸 토큰을 반환합니다."""
+    deadline = None
+    get_remaining_time_in_millis = getattr(context, "get_remaining_time_in_millis", None)
+    if callable(get_remaining_time_in_millis):
+        deadline = time.monotonic() + get_remaining_time_in_millis() / 1000.0
+    return _invocation_deadline.set(deadline)
+
+def remaining_invocation_sec():
+    """마감 시각까지 남은 시간(초), 마감 시각이 없으면(로컬 큐 작업 등) None 을 반환합니다."""
+    deadline = _invocation_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+# 스로틀링 신호 (동시 호출 한도를 줄임)
+BEDROCK_THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException"}
+# 잠시 후 같은 모델로 다시 시도할 오류
+BEDROCK_RETRYABLE_ERROR_CODES = BEDROCK_THROTTLING_ERROR_CODES | {
+    "ModelNotReadyException", "ServiceUnavailableException", "InternalServerException", "ModelTimeoutException", "ConnectionError",
+}
+# 재시도 없이 바로 다음 대체 모델로 넘어갈 오류 (이 모델/리전을 지금 쓸 수 없음)
+BEDROCK_MODEL_UNAVAILABLE_ERROR_CODES = {"AccessDeniedException", "ResourceNotFoundException", "ServiceQuotaExceededException"}
+
+class BedrockUnavailableError(Exception):
+    """재시도와 대체 모델을 모두 시도했거나 남은 시간이 부족하여 Bedrock 응답을 받지 못했습니다 (마지막 오류는 __cause__)."""
+
+class AdaptiveConcurrencyLimiter:
+    """
+    동시 호출 수 한도를 AIMD 로 조절합니다.
+    성공할 때마다 한도를 1/한도 씩 늘리고(한도만큼 성공하면 약 +1), 스로틀링 신호를 받으면 decrease_factor 배로 줄입니다.
+    동시에 진행 중이던 호출들이 한꺼번에 스로틀링되어도 한 번만 줄도록, 줄인 뒤 cooldown_sec 동안은 다시 줄이지 않습니다.
+    """
+    def __init__(self, initial_limit: int = BEDROCK_CONCURRENCY_INITIAL, min_limit: int = BEDROCK_CONCURRENCY_MIN,
+                 max_limit: int = BEDROCK_CONCURRENCY_MAX, decrease_factor: float = BEDROCK_CONCURRENCY_DECREASE_FACTOR,
+                 cooldown_sec: float = 1.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.cooldown_sec = cooldown_sec
+        self.in_flight = 0
+        self._last_decrease_at = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float = None) -> bool:
+        """슬롯을 얻으면 True, timeout 안에 얻지 못하면 False 를 반환합니다."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout=timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled: bool = False, succeeded: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease_at >= self.cooldown_sec:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease_at = now
+            elif succeeded:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+class BedrockInvoker:
+    """
+    Bedrock Runtime 호출 래퍼입니다.
+    - 모델별 AdaptiveConcurrencyLimiter 로 동시 호출 수를 조절합니다 (스로틀링 시 감소, 성공 시 증가).
+    - 재시도 가능한 오류는 지수 백오프 + full jitter 로 재시도하되, Lambda 의 남은 시간 안에서만 시도합니다.
+    - 재시도를 모두 실패했거나 모델을 쓸 수 없으면 llm_settings["fallback_model_ids"] 의 다음 모델로 넘어갑니다.
+    - 모델별 호출/스로틀/재시도/대체 횟수는 stats() 로 확인할 수 있습니다.
+    """
+    def __init__(self, client, max_retries: int = BEDROCK_MAX_RETRIES,
+                 base_delay_sec: float = BEDROCK_RETRY_BASE_DELAY_SEC, max_delay_sec: float = BEDROCK_RETRY_MAX_DELAY_SEC,
+                 deadline_margin_sec: float = BEDROCK_DEADLINE_MARGIN_SEC, min_attempt_sec: float = BEDROCK_MIN_ATTEMPT_SEC):
+        self.client = client
+        self.max_retries = max_retries
+        self.base_delay_sec = base_delay_sec
+        self.max_delay_sec = max_delay_sec
+        self.deadline_margin_sec = deadline_margin_sec
+        self.min_attempt_sec = min_attempt_sec
+        self._limiters = {} # 모델 ID -> AdaptiveConcurrencyLimiter
+        self._stats = {} # 모델 ID -> 호출/스로틀/재시도/대체/오류 횟수
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def error_code(e: Exception) -> str:
+        if isinstance(e, ClientError):
+            # 스트림 이벤트 오류(EventStreamError)는 throttlingException 처럼 첫 글자가 소문자입니다.
+            error_code = e.response.get("Error", {}).get("Code", "")
+            return error_code[:1].upper() + error_code[1:]
+        if isinstance(e, (BotocoreConnectionError, ReadTimeoutError)):
+            return "ConnectionError"
+        return ""
+
+    @staticmethod
+    def model_candidates(llm_settings: dict) -> list:
+        fallback_model_ids = llm_settings.get("fallback_model_ids") or []
+        if isinstance(fallback_model_ids, str):
+            fallback_model_ids = fallback_model_ids.split(",")
+        model_ids = [llm_settings["model_id"]]
+        for model_id in fallback_model_ids:
+            if model_id.strip() and model_id.strip() not in model_ids:
+                model_ids.append(model_id.strip())
+        return model_ids
+
+    def limiter(self, model_id: str) -> AdaptiveConcurrencyLimiter:
+        with self._lock:
+            if model_id not in self._limiters:
+                self._limiters[model_id] = AdaptiveConcurrencyLimiter()
+                self._stats[model_id] = {"calls": 0, "throttles": 0, "retries": 0, "fallbacks": 0, "errors": 0}
+            return self._limiters[model_id]
+
+    def _count(self, model_id: str, name: str):
+        with self._lock:
+            self._stats[model_id][name] += 1
+
+    def _time_budget_sec(self):
+        remaining_sec = remaining_invocation_sec()
+        return None if remaining_sec is None else remaining_sec - self.deadline_margin_sec
+
+    def call(self, operation: str, body, llm_settings: dict, hold_slot: bool = False) -> tuple:
+        """
+        llm_settings 의 model_id, fallback_model_ids 순서로 Bedrock 을 호출하여 (사용한 모델 ID, 응답) 을 반환합니다.
+        body 는 요청 바디 문자열 또는 모델 ID 를 받아 바디를 만드는 함수입니다.
+        hold_slot 이면 성공 시 동시성 슬롯을 바로 반환하지 않으므로, 스트림을 다 읽은 뒤 release(model_id, ...) 를 호출해야 합니다.
+        모든 모델이 실패했거나 시간이 부족하면 BedrockUnavailableError, 재시도해도 소용없는 요청 오류(ValidationException 등)는 그대로 전달됩니다.
+        """
+        model_ids = self.model_candidates(llm_settings)
+        last_error = None
+        for index, model_id in enumerate(model_ids):
+            if index > 0:
+                self._count(model_ids[index - 1], "fallbacks")
+                trace_value("bedrock_fallbacks", 1)
+                logger.warning(f"Bedrock 대체 모델로 전환: {model_ids[index - 1]} -> {model_id} (사유: {self.error_code(last_error)})")
+            try:
+                return model_id, self._call_model_body(operation, body, model_id, hold_slot, is_first_model=(index == 0))
+            except (ClientError, BotocoreConnectionError, ReadTimeoutError) as e:
+                self._count(model_id, "errors")
+                error_code = self.error_code(e)
+                if error_code not in BEDROCK_RETRYABLE_ERROR_CODES and error_code not in BEDROCK_MODEL_UNAVAILABLE_ERROR_CODES:
+                    raise
+                last_error = e
+        raise BedrockUnavailableError(f"모든 모델 호출 실패 ({', '.join(model_ids)})") from last_error
+
+    def _call_model_body(self, operation: str, body, model_id: str, hold_slot: bool, is_first_model: bool):
+        """body 가 모델 ID 를 받아 바디를 만드는 함수이면 모델별로 만듭니다 (프롬프트 캐싱 지원 여부가 모델마다 다름)."""
+        if not callable(body):
+            return self._call_model(operation, body, model_id, hold_slot, is_first_model)
+        request_body = body(model_id)
+        try:
+            return self._call_model(operation, request_body, model_id, hold_slot, is_first_model)
+        except ClientError as e:
+            if not prompt_cache_policy.reject(model_id, e, request_body):
+                raise
+        return self._call_model(operation, body(model_id), model_id, hold_slot, is_first_model=False)
+
+    def _call_model(self, operation: str, body: str, model_id: str, hold_slot: bool, is_first_model: bool = True):
+        limiter = self.limiter(model_id)
+        for attempt in range(self.max_retries + 1):
+            # 첫 시도는 남은 시간이 있으면 항상 하고, 재시도/대체 모델은 min_attempt_sec 이상 남았을 때만 합니다.
+            min_budget_sec = 0.0 if (is_first_model and attempt == 0) else self.min_attempt_sec
+            time_budget_sec = self._time_budget_sec()
+            if time_budget_sec is not None and time_budget_sec < min_budget_sec:
+                raise BedrockUnavailableError(f"Lambda 남은 시간 부족으로 Bedrock 호출 중단 (모델: {model_id}, 시도: {attempt + 1})")
+            with trace_span("bedrock_queue"):
+                acquired = limiter.acquire(timeout=time_budget_sec)
+            if not acquired:
+                raise BedrockUnavailableError(f"동시 호출 한도 대기 중 시간 초과 (모델: {model_id}, 한도: {int(limiter.limit)})")
+            self._count(model_id, "calls")
+            throttled = succeeded = False
+            try:
+                response = getattr(self.client, operation)(
+                    body=body,
+                    modelId=model_id,
+                    accept='application/json',
+                    contentType='application/json'
+                )
+                succeeded = True
+                return response
+            except (ClientError, BotocoreConnectionError, ReadTimeoutError) as e:
+                error_code = self.error_code(e)
+                throttled = error_code in BEDROCK_THROTTLING_ERROR_CODES
+                if throttled:
+                    self._count(model_id, "throttles")
+                    trace_value("bedrock_throttles", 1)
+                if error_code not in BEDROCK_RETRYABLE_ERROR_CODES or attempt >= self.max_retries:
+                    raise
+                delay_sec = random.uniform(0, min(self.max_delay_sec, self.base_delay_sec * (2 ** attempt)))
+                time_budget_sec = self._time_budget_sec()
+                if time_budget_sec is not None and time_budget_sec - delay_sec < self.min_attempt_sec:
+                    raise
+                self._count(model_id, "retries")
+                trace_value("bedrock_retries", 1)
+                logger.warning(
+                    f"Bedrock 재시도 예정 (모델: {model_id}, 오류: {error_code}, {delay_sec:.2f}초 후, "
+                    f"시도: {attempt + 1}/{self.max_retries + 1}, 동시 호출 한도: {limiter.limit:.1f})"
+                )
+            finally:
+                if not (succeeded and hold_slot):
+                    limiter.release(throttled=throttled, succeeded=succeeded)
+            time.sleep(delay_sec)
+
+    def release(self, model_id: str, throttled: bool = False, succeeded: bool = False):
+        """hold_slot=True 로 얻은 슬롯을 반환합니다."""
+        self.limiter(model_id).release(throttled=throttled, succeeded=succeeded)
+        if throttled:
+            self._count(model_id, "throttles")
+            trace_value("bedrock_throttles", 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                model_id: dict(counts, concurrency_limit=round(self._limiters[model_id].limit, 1), in_flight=self._limiters[model_id].in_flight)
+                for model_id, counts in self._stats.items()
+            }
+
+bedrock_invoker = BedrockInvoker(bedrock_runtime)
+
+# --- Helper 함수: Bedrock usage 기록 ---
+def record_bedrock_usage(model_id: str, usage: dict):
+    """응답 바디(또는 스트림의 message_start/message_delta)의 usage 토큰 수를 현재 trace 에 기록합니다."""
+    trace_dimension("ModelId", model_id)
+    if not usage:
+        return
+    trace_value("input_tokens", usage.get("input_tokens"))
+    trace_value("output_tokens", usage.get("output_tokens"))
+    cache_usage = ""
+    if "cache_read_input_tokens" in usage or "cache_creation_input_tokens" in usage:
+        # 프롬프트 캐싱 사용 시 input_tokens 는 캐시 밖의 입력만 셉니다.
+        trace_value("cache_read_input_tokens", usage.get("cache_read_input_tokens") or 0)
+        trace_value("cache_write_input_tokens", usage.get("cache_creation_input_tokens") or 0)
+        prompt_cache_policy.record(usage)
+        cache_usage = f", 캐시 읽기 {usage.get('cache_read_input_tokens') or 0}, 캐시 쓰기 {usage.get('cache_creation_input_tokens') or 0}"
+    logger.info(f"Bedrock 토큰 사용량 (모델: {model_id}): 입력 {usage.get('input_tokens')}, 출력 {usage.get('output_tokens')}{cache_usage}")
+
+# --- Helper 함수: Bedrock LLM 호출 ---
+def invoke_llm(prompt: Union[str, dict], llm_settings: dict = None) -> str:
+    """
+    주어진 프롬프트를 사용하여 Bedrock LLM을 호출하고 응답 텍스트를 반환합니다.
+    Claude 3 Sonnet (Messages API) 기준입니다. llm_settings 가 없으면 DEFAULT_LLM_SETTINGS 를 사용합니다.
+    """
+    llm_settings = llm_settings or DEFAULT_LLM_SETTINGS
+    model_id = llm_settings["model_id"]
+    body = functools.partial(build_bedrock_request_body, prompt, llm_settings) # 모델 ID 별 바디 (프롬프트 캐싱 지원 여부)
+
+    try:
+        logger.info(f"Bedrock 모델 ({model_id}) 호출 시작")
+        logger.debug(f"Bedrock 호출 프롬프트 (일부): {str(prompt)[:250]}...") 
+        with trace_span("bedrock_invoke"): # 동시 호출 한도 대기(bedrock_queue)와 재시도 포함
+            used_model_id, response = bedrock_invoker.call("invoke_model", body, llm_settings)
+            response_body = json.loads(response.get('body').read())
+        logger.info(f"Bedrock 모델 호출 성공{'' if used_model_id == model_id else f' (대체 모델: {used_model_id})'}")
+        record_bedrock_usage(used_model_id, response_body.get("usage"))
+        
+        if response_body.get("content") and isinstance(response_body["content"], list) and len(response_body["content"]) > 0:
+            llm_response = response_body['content'][0].get('text', LLM_EMPTY_RESPONSE)
+        else:
+            llm_response = LLM_UNEXPECTED_FORMAT_RESPONSE
+            logger.error(f"Bedrock 예상치 못한 응답 형식: {response_body}")
+
+        logger.info(f"Bedrock 응답 수신 (일부): {llm_response[:100]}...")
+        return llm_response.strip()
+    except BedrockUnavailableError as e:
+        logger.error(f"Bedrock 호출 실패: {e} (원인: {e.__cause__}, 모델별 통계: {bedrock_invoker.stats()})")
+        return LLM_THROTTLED_RESPONSE
+    except Exception as e:
+        logger.error(f"Bedrock 모델 호출 중 오류 발생: {e}", exc_info=True)
+        return LLM_ERROR_RESPONSE
+
+# --- Helper 함수: Bedrock LLM 스트리밍 호출 ---
+def invoke_llm_stream(prompt: Union[str, dict], llm_settings: dict = None):
+    """
+    invoke_model_with_response_stream 으로 Bedrock LLM을 호출하고,
+    생성되는 텍스트 조각(delta)을 순서대로 yield 합니다.
+    스트림 시작 전까지의 재시도/대체 모델 전환은 bedrock_invoker 가 처리하며, 그 밖의 호출/스트림 오류는 호출자에게 그대로 전달됩니다.
+    스트림을 끝까지 읽을 때까지 해당 모델의 동시 호출 슬롯을 점유합니다.
+    """
+    llm_settings = llm_settings or DEFAULT_LLM_SETTINGS
+    model_id = llm_settings["model_id"]
+    body = functools.partial(build_bedrock_request_body, prompt, llm_settings) # 모델 ID 별 바디 (프롬프트 캐싱 지원 여부)
+
+    logger.info(f"Bedrock 모델 ({model_id}) 스트리밍 호출 시작")
+    used_model_id, response = bedrock_invoker.call("invoke_model_with_response_stream", body, llm_settings, hold_slot=True)
+    if used_model_id != model_id:
+        logger.info(f"Bedrock 스트리밍 대체 모델 사용: {used_model_id}")
+    usage = {}
+    throttled = succeeded = False
+    try:
+        for stream_event in response.get('body'):
+            chunk = stream_event.get('chunk')
+            if not chunk:
+                continue
+            chunk_data = json.loads(chunk.get('bytes'))
+            chunk_type = chunk_data.get('type')
+            if chunk_type == 'content_block_delta':
+                delta_text = chunk_data.get('delta', {}).get('text')
+                if delta_text:
+                    yield delta_text
+            elif chunk_type == 'message_start':
+                usage.update(chunk_data.get('message', {}).get('usage') or {})
+            elif chunk_type == 'message_delta':
+                usage.update(chunk_data.get('usage') or {})
+            elif chunk_type == 'message_stop':
+                break
+        succeeded = True
+        record_bedrock_usage(used_model_id, usage)
+    except ClientError as e:
+        # 스트림 도중의 오류(throttlingException 등)는 EventStreamError(ClientError)로 전달됩니다.
+        throttled = bedrock_invoker.error_code(e) in BEDROCK_THROTTLING_ERROR_CODES
+        raise
+    finally:
+        if not succeeded:
+            # 호출자가 스트림을 중간에 닫은 경우(GeneratorExit) 등: 연결을 닫아 남은 생성을 받지 않습니다.
+            response.get('body').close()
+        bedrock_invoker.release(used_model_id, throttled=throttled, succeeded=succeeded)
+
+# --- Slack Web API 호출 계층 ---
+def slack_workspace_key(token: str) -> str:
+    """토큰 원문 대신 해시를 워크스페이스 식별 키로 사용합니다."""
+    return hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+
+class SlackMethodRateLimiter:
+    """
+    (워크스페이스, API 메서드)별 토큰 버킷입니다. 프로세스 안의 모든 스레드와 이벤트 루프가 같은 버킷을 공유합니다.
+    SLACK_CHANNEL_RATE_LIMITED_METHODS 의 메서드(chat.postMessage)는 채널별로 버킷을 나눕니다.
+    reserve() 는 토큰 하나를 예약하고 호출 전에 기다려야 할 시간을 돌려주며 (대기는 호출자가 sleep),
+    429 응답을 받으면 penalize() 로 Retry-After 가 끝날 때까지 해당 버킷의 모든 호출을 멈춥니다.
+    """
+    def __init__(self, limits_per_minute: dict, default_per_minute: float = SLACK_DEFAULT_RATE_LIMIT,
+                 burst_sec: float = SLACK_RATE_LIMIT_BURST_SEC):
+        self.limits_per_minute = limits_per_minute
+        self.default_per_minute = default_per_minute
+        self.burst_sec = burst_sec
+        self._buckets = {} # (워크스페이스 키, API 메서드, 채널 또는 None) -> {"tokens", "updated_at", "blocked_until"}
+        self._lock = threading.Lock()
+
+    def _refill(self, key: tuple, now: float) -> tuple:
+        rate = self.limits_per_minute.get(key[1], self.default_per_minute) / 60.0
+        capacity = max(1.0, rate * self.burst_sec)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = {"tokens": capacity, "updated_at": now, "blocked_until": 0.0}
+        else:
+            bucket["tokens"] = min(capacity, bucket["tokens"] + (now - bucket["updated_at"]) * rate)
+            bucket["updated_at"] = now
+        return bucket, rate
+
+    @staticmethod
+    def bucket_key(workspace_key: str, api_method: str, channel: str = None) -> tuple:
+        return (workspace_key, api_method, channel if api_method in SLACK_CHANNEL_RATE_LIMITED_METHODS else None)
+
+    def reserve(self, workspace_key: str, api_method: str, max_wait_sec: float = None, channel: str = None):
+        """
+        토큰 하나를 예약하고 기다려야 할 시간(초)을 반환합니다. 토큰이 모자라면 빚(음수)으로 예약하므로
+        동시에 기다리는 호출들은 차례대로 간격을 두고 실행됩니다. max_wait_sec 보다 오래 기다려야 하면 예약하지 않고 None 을 반환합니다.
+        """
+        with self._lock:
+            now = time.monotonic()
+            bucket, rate = self._refill(self.bucket_key(workspace_key, api_method, channel), now)
+            wait_sec = max(bucket["blocked_until"] - now, (1.0 - bucket["tokens"]) / rate, 0.0)
+            if max_wait_sec is not None and wait_sec > max_wait_sec:
+                return None
+            bucket["tokens"] -= 1.0
+            return wait_sec
+
+    def penalize(self, workspace_key: str, api_method: str, retry_after_sec: float, channel: str = None):
+        with self._lock:
+            now = time.monotonic()
+            bucket, _ = self._refill(self.bucket_key(workspace_key, api_method, channel), now)
+            bucket["blocked_until"] = max(bucket["blocked_until"], now + retry_after_sec)
+            bucket["tokens"] = min(bucket["tokens"], 0.0)
+
+# 현재 처리 중인 멘션의 메서드별 Slack API 호출 수 (SlackApiLayer.start_mention 으로 설정)
+_mention_slack_call_counts = contextvars.ContextVar("mention_slack_call_counts", default=None)
+
+class SlackApiLayer:
+    """
+    Slack Web API 호출 계층입니다. client 는 WebClient(call) 와 AsyncWebClient(async_call) 모두 사용할 수 있습니다.
+    - 호출 전 SlackMethodRateLimiter 로 속도를 맞추고, 429 응답은 Retry-After 만큼 기다린 뒤 재시도합니다.
+    - 기다릴 시간이 max_wait_sec 이나 Lambda 남은 시간보다 길면 기다리지 않고 SlackApiError 를 발생시킵니다
+      (deliver_thread_reply 는 이때 대기 메시지 갱신 대신 새 메시지 게시로 넘어갑니다).
+    - start_mention / finish_mention 사이의 호출 수를 메서드별로 세어 멘션당 호출 수 지표로 남깁니다.
+    """
+    def __init__(self, rate_limiter: SlackMethodRateLimiter, max_retries: int = SLACK_RATE_LIMIT_MAX_RETRIES,
+                 max_wait_sec: float = SLACK_RATE_LIMIT_MAX_WAIT_SEC):
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.max_wait_sec = max_wait_sec
+        self._lock = threading.Lock()
+        self.calls_by_method = {}
+        self.rate_limited = 0
+        self.skipped = 0
+        self.throttled_wait_sec = 0.0
+        self.mentions = 0
+        self.mention_calls = 0
+
+    @staticmethod
+    def api_method(method: str) -> str:
+        # WebClient 메서드 이름(chat_postMessage) -> Slack API 메서드 이름(chat.postMessage)
+        return method.replace("_", ".", 1)
+
+    def _wait_limit_sec(self) -> float:
+        remaining_sec = remaining_invocation_sec()
+        return self.max_wait_sec if remaining_sec is None else max(0.0, min(self.max_wait_sec, remaining_sec))
+
+    def _reserve(self, client, api_method: str, allow_skip: bool, channel: str = None):
+        """기다릴 시간(초)을 반환합니다. allow_skip 호출은 기다려야 하면 None, 그 외 호출은 대기 한도를 넘으면 SlackApiError 입니다."""
+        max_wait_sec = 0.0 if allow_skip else self._wait_limit_sec()
+        wait_sec = self.rate_limiter.reserve(slack_workspace_key(client.token), api_method, max_wait_sec, channel)
+        if wait_sec is None:
+            with self._lock:
+                self.skipped += 1
+            if not allow_skip:
+                raise SlackApiError(f"{api_method} 호출 한도 대기가 {max_wait_sec:.1f}초를 넘어 호출하지 않았습니다.",
+                                    {"ok": False, "error": "ratelimited"})
+        return wait_sec
+
+    def _record_call(self, api_method: str, wait_sec: float):
+        with self._lock:
+            self.calls_by_method[api_method] = self.calls_by_method.get(api_method, 0) + 1
+            self.throttled_wait_sec += wait_sec
+        mention_counts = _mention_slack_call_counts.get()
+        if mention_counts is not None:
+            mention_counts[api_method] = mention_counts.get(api_method, 0) + 1
+
+    def _retry_after_sec(self, client, api_method: str, e: SlackApiError, attempt: int, channel: str = None):
+        """429 응답이면 버킷을 멈추고 재시도까지 기다릴 시간을, 재시도하지 않을 오류면 None 을 반환합니다."""
+        response = e.response
+        if response is None or response.status_code != 429 or attempt >= self.max_retries:
+            return None
+        retry_after_sec = float(response.headers.get("Retry-After") or response.headers.get("retry-after") or 1)
+        self.rate_limiter.penalize(slack_workspace_key(client.token), api_method, retry_after_sec, channel)
+        if retry_after_sec > self._wait_limit_sec():
+            return None
+        with self._lock:
+            self.rate_limited += 1
+        logger.warning(f"Slack API rate limit ({api_method}), {retry_after_sec:.0f}초 후 재시도합니다 ({attempt + 1}/{self.max_retries})")
+        return retry_after_sec
+
+    def call(self, client, method: str, allow_skip: bool = False, **kwargs):
+        """
+        client.<method>(**kwargs) 를 호출합니다. allow_skip 이면 속도 제한으로 기다려야 할 때 호출하지 않고 None 을 반환합니다
+        (스트리밍 중간 갱신처럼 다음 호출이 최신 내용으로 덮어쓰는 경우).
+        """
+        api_method = self.api_method(method)
+        channel = kwargs.get("channel")
+        for attempt in range(self.max_retries + 1):
+            wait_sec = self._reserve(client, api_method, allow_skip, channel)
+            if wait_sec is None:
+                return None
+            if wait_sec > 0:
+                time.sleep(wait_sec)
+            self._record_call(api_method, wait_sec)
+            try:
+                return getattr(client, method)(**kwargs)
+            except SlackApiError as e:
+                if self._retry_after_sec(client, api_method, e, attempt, channel) is None:
+                    raise
+
+    async def async_call(self, client, method: str, allow_skip: bool = False, **kwargs):
+        """call 의 비동기 버전입니다 (client 는 AsyncWebClient)."""
+        api_method = self.api_method(method)
+        channel = kwargs.get("channel")
+        for attempt in range(self.max_retries + 1):
+            wait_sec = self._reserve(client, api_method, allow_skip, channel)
+            if wait_sec is None:
+                return None
+            if wait_sec > 0:
+                await asyncio.sleep(wait_sec)
+            self._record_call(api_method, wait_sec)
+            try:
+                return await getattr(client, method)(**kwargs)
+            except SlackApiError as e:
+                if self._retry_after_sec(client, api_method, e, attempt, channel) is None:
+                    raise
+
+    def start_mention(self):
+        """현재 컨텍스트에서 멘션 하나의 호출 수 집계를 시작하고, finish_mention 에 넘길 토큰을 반환합니다."""
+        return _mention_slack_call_counts.set({})
+
+    def finish_mention(self, token, event_id: str, logger):
+        mention_counts = _mention_slack_call_counts.get() or {}
+        _mention_slack_call_counts.reset(token)
+        total_calls = sum(mention_counts.values())
+        with self._lock:
+            self.mentions += 1
+            self.mention_calls += total_calls
+            average_calls = self.mention_calls / self.mentions
+        logger.info(f"멘션당 Slack API 호출 수 (이벤트 ID: {event_id}): {total_calls}회 {mention_counts} (평균 {average_calls:.2f}회/멘션)")
+        return total_calls
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mentions": self.mentions,
+                "calls_per_mention": round(self.mention_calls / self.mentions, 2) if self.mentions else 0.0,
+                "calls_by_method": dict(self.calls_by_method),
+                "rate_limited": self.rate_limited,
+                "skipped": self.skipped,
+                "throttled_wait_sec": round(self.throttled_wait_sec, 2),
+            }
+
+slack_api = SlackApiLayer(SlackMethodRateLimiter(SLACK_METHOD_RATE_LIMITS))
+
+class BotIdentityCache:
+    """
+    워크스페이스 토큰별 봇 사용자 ID 캐시입니다. 이벤트의 authorizations 블록에 봇 ID 가 없을 때만
+    auth.test 를 호출하고, 그 결과를 토큰별로 기억하여 이후 멘션에서는 다시 호출하지 않습니다.
+    auth.test 오류(SlackApiError 등)는 호출자에게 그대로 전달됩니다.
+    """
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def from_authorizations(body: dict) -> str:
+        auth_info_list = body.get("authorizations")
+        if auth_info_list and isinstance(auth_info_list, list) and len(auth_info_list) > 0:
+            return auth_info_list[0].get("user_id", "")
+        return ""
+
+    def resolve(self, body: dict, client) -> str:
+        bot_user_id = self.from_authorizations(body)
+        if bot_user_id:
+            return bot_user_id
+        key = slack_workspace_key(client.token)
+        bot_user_id = self.store.get(key)
+        if not bot_user_id:
+            bot_user_id = slack_api.call(client, "auth_test").get("user_id")
+            self._remember(key, bot_user_id)
+        return bot_user_id
+
+    async def async_resolve(self, body: dict, client) -> str:
+        """resolve 의 비동기 버전입니다 (client 는 AsyncWebClient)."""
+        bot_user_id = self.from_authorizations(body)
+        if bot_user_id:
+            return bot_user_id
+        key = slack_workspace_key(client.token)
+        bot_user_id = self.store.get(key)
+        if not bot_user_id:
+            bot_user_id = (await slack_api.async_call(client, "auth_test")).get("user_id")
+            self._remember(key, bot_user_id)
+        return bot_user_id
+
+    def _remember(self, key: str, bot_user_id: str):
+        if bot_user_id:
+            self.store.set(key, bot_user_id)
+            logger.info(f"auth.test 로 봇 ID 획득 및 캐시: {bot_user_id}")
+
+bot_identity_cache = BotIdentityCache(create_ttl_store("bot_identity", 1000, BOT_IDENTITY_CACHE_TTL_SEC))
+
+def find_slack_split_point(text: str, max_chars: int) -> int:
+    # 줄바꿈 > 공백 순으로 자연스러운 분할 지점을 찾고, 없으면 max_chars 에서 자릅니다.
+    for separator in ("\n", " "):
+        index = text.rfind(separator, 0, max_chars)
+        if index > max_chars // 2:
+            return index
+    return max_chars
+
+def split_slack_message(text: str, max_chars: int = SLACK_MAX_MESSAGE_CHARS) -> list:
+    chunks = []
+    while len(text) > max_chars:
+        split_at = find_slack_split_point(text, max_chars)
+        chunks.append(text[:split_at].rstrip())
+        text = text[split_at:].lstrip()
+    chunks.append(text)
+    return chunks
+
+def post_thread_message(client, channel_id: str, thread_ts: str, text: str):
+    return slack_api.call(client, "chat_postMessage", channel=channel_id, thread_ts=thread_ts, text=text)
+
+def deliver_thread_reply(client, channel_id: str, thread_ts: str, waiting_message_ts: str, text: str, logger):
+    """
+    최종 답변(또는 오류 안내)을 스레드에 전달합니다.
+    대기 메시지가 있으면 chat_update 로 답변으로 바꾸어 게시 + 삭제 두 번의 호출을 한 번으로 줄이고,
+    대기 메시지가 없거나 갱신에 실패하면 새 메시지로 게시한 뒤 대기 메시지를 삭제합니다.
+    """
+    chunks = split_slack_message(text)
+    if waiting_message_ts and SLACK_REPLACE_PLACEHOLDER:
+        try:
+            slack_api.call(client, "chat_update", channel=channel_id, ts=waiting_message_ts, text=chunks[0])
+        except SlackApiError as e:
+            logger.warning(f"대기 메시지(ts: {waiting_message_ts}) 갱신 실패, 새 메시지로 게시합니다: {e}")
+        else:
+            logger.info(f"대기 메시지(ts: {waiting_message_ts})를 답변으로 갱신")
+            try:
+                for chunk in chunks[1:]:
+                    post_thread_message(client, channel_id, thread_ts, chunk)
+            except SlackApiError as e:
+                # 대기 메시지는 이미 답변의 앞부분이 되었으므로 오류 안내로 덮어쓰지 않도록 여기서 처리합니다.
+                logger.error(f"긴 답변의 이어지는 메시지 게시 실패: {e}")
+            return
+    for chunk in chunks:
+        post_thread_message(client, channel_id, thread_ts, chunk)
+    if waiting_message_ts:
+        try:
+            slack_api.call(client, "chat_delete", channel=channel_id, ts=waiting_message_ts)
+            logger.info(f"임시 메시지(ts: {waiting_message_ts}) 삭제 완료")
+        except SlackApiError as e:
+            logger.error(f"임시 메시지 삭제 실패: {e}")
+
+async def async_post_thread_message(client, channel_id: str, thread_ts: str, text: str):
+    return await slack_api.async_call(client, "chat_postMessage", channel=channel_id, thread_ts=thread_ts, text=text)
+
+async def async_deliver_thread_reply(client, channel_id: str, thread_ts: str, waiting_message_ts: str, text: str, logger):
+    """deliver_thread_reply 의 비동기 버전입니다 (client 는 AsyncWebClient)."""
+    chunks = split_slack_message(text)
+    if waiting_message_ts and SLACK_REPLACE_PLACEHOLDER:
+        try:
+            await slack_api.async_call(client, "chat_update", channel=channel_id, ts=waiting_message_ts, text=chunks[0])
+        except SlackApiError as e:
+            logger.warning(f"대기 메시지(ts: {waiting_message_ts}) 갱신 실패, 새 메시지로 게시합니다: {e}")
+        else:
+            logger.info(f"대기 메시지(ts: {waiting_message_ts})를 답변으로 갱신")
+            try:
+                for chunk in chunks[1:]:
+                    await async_post_thread_message(client, channel_id, thread_ts, chunk)
+            except SlackApiError as e:
+                # 대기 메시지는 이미 답변의 앞부분이 되었으므로 오류 안내로 덮어쓰지 않도록 여기서 처리합니다.
+                logger.error(f"긴 답변의 이어지는 메시지 게시 실패: {e}")
+            return
+    for chunk in chunks:
+        await async_post_thread_message(client, channel_id, thread_ts, chunk)
+    if waiting_message_ts:
+        try:
+            await slack_api.async_call(client, "chat_delete", channel=channel_id, ts=waiting_message_ts)
+            logger.info(f"임시 메시지(ts: {waiting_message_ts}) 삭제 완료")
+        except SlackApiError as e:
+            logger.error(f"임시 메시지 삭제 실패: {e}")
+
+# --- Helper 클래스: Slack 메시지 스트리밍 갱신 ---
+class SlackStreamingMessage:
+    """
+    임시 대기 메시지를 LLM 출력으로 점진적으로 갱신합니다.
+    - 도착한 토큰은 버퍼에 모아 두었다가 최소 간격(min_update_interval)마다 한 번만 chat_update 합니다.
+    - 버퍼가 max_chars 를 넘으면 현재 메시지를 확정하고 스레드에 새 메시지를 이어서 게시합니다.
+    - Slack 호출이 실패하면(재시도 후에도 rate limit, msg_too_long 등) delivery_failed 를 표시하고 이후 Slack 호출 없이
+      텍스트만 모읍니다. 호출자는 스트림을 끝까지 받은 뒤 redeliver 로 전체 답변을 다시 전달합니다.
+    """
+    def __init__(self, client, channel_id: str, thread_ts: str, message_ts: str,
+                 min_update_interval: float = STREAMING_UPDATE_INTERVAL_SEC,
+                 max_chars: int = SLACK_MAX_MESSAGE_CHARS):
+        self.client = client
+        self.channel_id = channel_id
+        self.thread_ts = thread_ts
+        self.message_ts = message_ts
+        self.min_update_interval = min_update_interval
+        self.max_chars = max_chars
+        self.buffer = "" # 현재 편집 중인 메시지의 텍스트
+        self.full_text = "" # 지금까지 받은 전체 텍스트
+        self.message_ts_list = [message_ts]
+        self.update_count = 0
+        self.delivery_failed = False
+        self._last_update_time = 0.0
+        self._dirty = False
+
+    def append(self, delta_text: str):
+        self.buffer += delta_text
+        self.full_text += delta_text
+        self._dirty = True
+        if self.delivery_failed:
+            return
+
+        while len(self.buffer) > self.max_chars:
+            split_at = self._find_split_point(self.buffer)
+            head, rest = self.buffer[:split_at].rstrip(), self.buffer[split_at:].lstrip()
+            self._update_message(head) # 현재 메시지 확정
+            self.buffer = rest
+            if self.delivery_failed:
+                # 확정하지 못한 메시지 아래에 이어서 게시하지 않고, 끝난 뒤 redeliver 가 전체 답변을 전달합니다.
+                return
+            self._post_continuation_message()
+            if self.delivery_failed:
+                return
+
+        if time.time() - self._last_update_time >= self.min_update_interval:
+            self.flush()
+
+    def flush(self, final: bool = False):
+        if self.delivery_failed or (not self._dirty and not final):
+            return
+        text = self.buffer.strip()
+        if not final:
+            text = f"{text}{STREAMING_CURSOR}" if text else STREAMING_CURSOR.strip()
+        elif not text:
+            # 분할 직후 남은 내용이 없으면 빈 메시지 대신 이어진 메시지를 정리합니다.
+            text = "…"
+        # 중간 갱신은 rate limit 으로 기다려야 하면 건너뛰고 다음 flush 때 최신 내용으로 갱신합니다.
+        if self._update_message(text, allow_skip=not final):
+            self._dirty = False
+
+    def _find_split_point(self, text: str) -> int:
+        return find_slack_split_point(text, self.max_chars)
+
+    def _update_message(self, text: str, allow_skip: bool = False) -> bool:
+        updated = False
+        try:
+            updated = slack_api.call(self.client, "chat_update", allow_skip=allow_skip,
+                                     channel=self.channel_id, ts=self.message_ts, text=text) is not None
+            if updated:
+                self.update_count += 1
+        except Exception as e:
+            # Slack 쪽 실패는 Bedrock 스트림 오류와 구분합니다 (스트림은 계속 받고 끝난 뒤 다시 전달).
+            self._mark_delivery_failed("chat_update", e)
+        self._last_update_time = time.time()
+        return updated
+
+    def _post_continuation_message(self):
+        try:
+            response = post_thread_message(self.client, self.channel_id, self.thread_ts, STREAMING_CURSOR.strip())
+        except Exception as e:
+            self._mark_delivery_failed("chat_postMessage", e)
+            return
+        self.message_ts = response.get("ts")
+        self.message_ts_list.append(self.message_ts)
+        self._last_update_time = time.time()
+        logger.info(f"메시지 길이 제한으로 이어지는 메시지 게시 (ts: {self.message_ts})")
+
+    def _mark_delivery_failed(self, method: str, e: Exception):
+        error = e.response.get('error') if isinstance(e, SlackApiError) and e.response else e
+        logger.warning(f"스트리밍 메시지 {method} 실패 (ts: {self.message_ts}), 생성이 끝난 뒤 전체 답변을 다시 전달합니다: {error}")
+        trace_value("streaming_slack_failures", 1)
+        self.delivery_failed = True
+
+    def redeliver(self, text: str, logger):
+        """
+        스트리밍 중 Slack 갱신이 실패했을 때 전체 답변을 다시 전달합니다.
+        이어서 게시했던 메시지는 지우고, 첫 메시지(대기 메시지)부터 deliver_thread_reply 로 나누어 전달합니다.
+        """
+        for message_ts in self.message_ts_list[1:]:
+            try:
+                slack_api.call(self.client, "chat_delete", channel=self.channel_id, ts=message_ts)
+            except SlackApiError as e:
+                logger.error(f"이어진 스트리밍 메시지(ts: {message_ts}) 삭제 실패: {e}")
+        deliver_thread_reply(self.client, self.channel_id, self.thread_ts, self.message_ts_list[0], text, logger)
+
+# --- Helper 함수: LLM 응답을 Slack 메시지로 스트리밍 ---
+def stream_llm_response_to_slack(client, channel_id: str, thread_ts: str, waiting_message_ts: str, prompt: Union[str, dict],
+                                 llm_settings: dict = None, should_cancel=None) -> tuple:
+    """
+    LLM 응답을 스트리밍하며 임시 대기 메시지를 갱신합니다.
+    첫 토큰까지의 시간(TTFT)과 전체 생성 시간을 분리하여 로그로 남깁니다.
+    (게시 여부, 완성된 응답 텍스트) 를 반환합니다.
+    토큰을 하나도 받지 못하고 실패했으면 (False, None), 도중에 중단되었으면 (True, None) 입니다.
+    should_cancel 이 주어지면 STREAMING_UPDATE_INTERVAL_SEC 마다 호출하여, True 이면 스트림을 닫고 생성을 중단합니다.
+    """
+    streaming_message = SlackStreamingMessage(client, channel_id, thread_ts, waiting_message_ts)
+    start_time = time.time()
+    first_token_time = None
+    interrupted = False
+    last_cancel_check_time = start_time
+    stream = invoke_llm_stream(prompt, llm_settings)
+
+    try:
+        for delta_text in stream:
+            if first_token_time is None:
+                first_token_time = time.time()
+                logger.info(f"LLM 첫 토큰 수신 시간(TTFT): {first_token_time - start_time:.2f}초")
+            streaming_message.append(delta_text)
+            if should_cancel and time.time() - last_cancel_check_time >= STREAMING_UPDATE_INTERVAL_SEC:
+                last_cancel_check_time = time.time()
+                if should_cancel():
+                    interrupted = True
+                    streaming_message.append(f"\n\n{SUPERSEDED_MENTION_MESSAGE}")
+                    break
+    except Exception as e:
+        logger.error(f"Bedrock 스트리밍 호출 중 오류 발생: {e}", exc_info=True)
+        if first_token_time is None:
+            return False, None
+        interrupted = True
+        streaming_message.append("\n\n_(답변 생성 중 오류가 발생하여 응답이 중단되었습니다. 😥)_")
+    finally:
+        stream.close()
+
+    if first_token_time is None:
+        logger.error("Bedrock 스트리밍 응답에 텍스트가 없습니다.")
+        return False, None
+
+    streaming_message.flush(final=True)
+    end_time = time.time()
+    if streaming_message.delivery_failed:
+        with trace_span("final_post"):
+            streaming_message.redeliver(streaming_message.full_text.strip(), logger)
+    trace_duration("llm_ttft", (first_token_time - start_time) * 1000)
+    trace_duration("llm_stream", (end_time - start_time) * 1000)
+    logger.info(
+        f"LLM 답변 생성 시간: {end_time - start_time:.2f}초 "
+        f"(TTFT: {first_token_time - start_time:.2f}초, 메시지 수: {len(streaming_message.message_ts_list)}, "
+        f"chat_update 횟수: {streaming_message.update_count})"
+    )
+    logger.info(f"Bedrock 스트리밍 응답 수신 (일부): {streaming_message.full_text[:100]}...")
+    return True, (None if interrupted else streaming_message.full_text.strip())
+
+# --- Helper 함수: 스레드 대화 내용 JSON 타임라인 포맷팅 ---
+def format_conversation_to_timeline(messages: list, bot_user_id: str) -> list:
+    """
+    Slack 메시지 목록을 [{"from": ..., "message": ..., "ts": ...}] 형식의 대화 턴 목록으로 변환합니다.
+    `ts` 는 캐시의 증분 조회 기준으로만 사용되며, 프롬프트에는 timeline_to_json 을 통해 제외됩니다.
+    봇의 대기 메시지/생략 안내(BOT_STATUS_MESSAGES)는 대화가 아니므로 건너뜁니다.
+    """
+    timeline = []
+    for msg in messages:
+        text = msg.get("text", "").strip()
+        user_id_from_msg = msg.get("user")
+        bot_id_from_msg = msg.get("bot_id") 
+
+        if user_id_from_msg == bot_user_id or bot_id_from_msg:
+            speaker_from = "bot"
+        elif user_id_from_msg:
+            speaker_from = f"<@{user_id_from_msg}>" 
+        else:
+            logger.debug(f"발신자 정보 없는 메시지 건너뜀: {msg.get('ts')}")
+            continue
+
+        if bot_user_id and f"<@{bot_user_id}>" in text:
+             text = text.replace(f"<@{bot_user_id}>", "").strip()
+
+        if speaker_from == "bot" and text in BOT_STATUS_MESSAGES:
+             logger.debug(f"봇 상태 메시지 건너뜀: {msg.get('ts')}")
+        elif text: 
+             timeline.append({"from": speaker_from, "message": text, "ts": msg.get("ts")})
+        else:
+             logger.debug(f"내용 없는 메시지 건너뜀: {msg.get('ts')}")
+
+    return timeline
+
+def timeline_to_json(timeline: list) -> str:
+    return json.dumps([{"from": turn["from"], "message": turn["message"]} for turn in timeline], ensure_ascii=False, indent=2)
+
+def format_conversation_to_json_timeline(messages: list, bot_user_id: str) -> str:
+    return timeline_to_json(format_conversation_to_timeline(messages, bot_user_id))
+
+# --- Helper 클래스: 스레드 대화 기록 증분 캐시 ---
+class ThreadHistoryCache:
+    """
+    (봇, 채널, thread_ts) 별로 이미 포맷팅된 대화 턴을 캐시합니다.
+    다음 멘션에서는 마지막으로 캐시한 메시지의 ts 를 `oldest` 로 넘겨 그 이후의 새 메시지만 가져오고,
+    긴 스레드는 cursor 로 페이지를 넘기며 끝까지 가져옵니다 (conversations.replies 는 오래된 순으로 반환).
+    아직 수정될 수 있는 봇 메시지(게시 후 THREAD_HISTORY_BOT_SETTLE_SEC 이내: 처리 중인 멘션의 대기 메시지, 스트리밍 중인 답변 등)와
+    그 이후의 메시지는 캐시에 확정하지 않으므로, last_ts 가 그 앞에 머물러 다음 조회에서 수정된 내용을 다시 가져옵니다.
+    """
+    def __init__(self, store, max_cached_turns: int = THREAD_HISTORY_MAX_CACHED_TURNS):
+        self.store = store
+        self.max_cached_turns = max_cached_turns
+
+    @staticmethod
+    def cache_key(bot_user_id: str, channel_id: str, thread_ts: str) -> str:
+        return f"{bot_user_id}:{channel_id}:{thread_ts}"
+
+    def get_turns(self, client, channel_id: str, thread_ts: str, bot_user_id: str, latest_ts: str = None) -> list:
+        """
+        스레드의 대화 턴 목록을 반환합니다. latest_ts(보통 멘션 메시지의 ts)가 주어지면 그 이후의 메시지
+        (예: 방금 게시한 임시 대기 메시지)는 제외하므로, 대기 메시지 게시와 동시에 호출해도 안전합니다.
+        Slack API 오류(SlackApiError)는 호출자에게 그대로 전달됩니다.
+        """
+        key = self.cache_key(bot_user_id, channel_id, thread_ts)
+        cached = self.store.get(key)
+        last_ts = cached["last_ts"] if cached else None
+        fetched_messages = []
+        for request_kwargs in self._replies_requests(channel_id, thread_ts, last_ts, latest_ts):
+            result = slack_api.call(client, "conversations_replies", **request_kwargs)
+            fetched_messages.extend(result.get("messages", []))
+            if not self._set_next_cursor(request_kwargs, result):
+                break
+        return self._merge(key, cached, fetched_messages, bot_user_id, latest_ts)
+
+    async def async_get_turns(self, client, channel_id: str, thread_ts: str, bot_user_id: str, latest_ts: str = None) -> list:
+        """get_turns 의 비동기 버전입니다 (client 는 AsyncWebClient). 저장소(sqlite/DynamoDB) 접근은 작업 스레드에서 실행합니다."""
+        key = self.cache_key(bot_user_id, channel_id, thread_ts)
+        cached = await run_in_bedrock_executor(self.store.get, key)
+        last_ts = cached["last_ts"] if cached else None
+        fetched_messages = []
+        for request_kwargs in self._replies_requests(channel_id, thread_ts, last_ts, latest_ts):
+            result = await slack_api.async_call(client, "conversations_replies", **request_kwargs)
+            fetched_messages.extend(result.get("messages", []))
+            if not self._set_next_cursor(request_kwargs, result):
+                break
+        return await run_in_bedrock_executor(self._merge, key, cached, fetched_messages, bot_user_id, latest_ts)
+
+    def _replies_requests(self, channel_id: str, thread_ts: str, oldest: str = None, latest: str = None):
+        # 같은 dict 를 페이지마다 갱신(cursor)하며 최대 THREAD_HISTORY_MAX_PAGES 번 yield 합니다.
+        request_kwargs = {"channel": channel_id, "ts": thread_ts, "limit": THREAD_HISTORY_PAGE_SIZE}
+        if oldest:
+            request_kwargs["oldest"] = oldest
+        if latest:
+            request_kwargs["latest"] = latest
+            request_kwargs["inclusive"] = True
+        for _ in range(THREAD_HISTORY_MAX_PAGES):
+            yield request_kwargs
+        logger.warning(f"스레드({thread_ts}) 페이지 수 제한({THREAD_HISTORY_MAX_PAGES})에 도달하여 일부 메시지를 가져오지 못했을 수 있습니다.")
+
+    @staticmethod
+    def _set_next_cursor(request_kwargs: dict, result) -> bool:
+        next_cursor = (result.get("response_metadata") or {}).get("next_cursor")
+        if not next_cursor:
+            return False
+        request_kwargs["cursor"] = next_cursor
+        return True
+
+    def _merge(self, key: str, cached, fetched_messages: list, bot_user_id: str, latest_ts: str = None) -> list:
+        cached_turns = cached["turns"] if cached else []
+        last_ts = cached["last_ts"] if cached else None
+
+        new_messages = []
+        seen_ts = set() # 스레드 부모 메시지는 페이지마다 반복해서 포함될 수 있음
+        for msg in fetched_messages:
+            msg_ts = msg.get("ts")
+            if not msg_ts or msg_ts in seen_ts:
+                continue
+            seen_ts.add(msg_ts)
+            if last_ts is not None and float(msg_ts) <= float(last_ts):
+                continue
+            if latest_ts is not None and float(msg_ts) > float(latest_ts):
+                continue
+            new_messages.append(msg)
+
+        new_messages.sort(key=lambda msg: float(msg["ts"]))
+        settle_before = time.time() - THREAD_HISTORY_BOT_SETTLE_SEC
+        pending_index = next((index for index, msg in enumerate(new_messages)
+                              if self.is_bot_message(msg, bot_user_id) and float(msg["ts"]) > settle_before), len(new_messages))
+        settled_messages, pending_messages = new_messages[:pending_index], new_messages[pending_index:]
+
+        logger.info(f"스레드 대화 기록({key}): 캐시 {len(cached_turns)}턴, 새 메시지 {len(new_messages)}개 (미확정 {len(pending_messages)}개)")
+        if not new_messages and cached:
+            return cached_turns
+
+        turns = (cached_turns + format_conversation_to_timeline(settled_messages, bot_user_id))[-self.max_cached_turns:]
+        if settled_messages:
+            last_ts = settled_messages[-1]["ts"]
+        if settled_messages or not cached:
+            self.store.set(key, {"turns": turns, "last_ts": last_ts})
+        return (turns + format_conversation_to_timeline(pending_messages, bot_user_id))[-self.max_cached_turns:]
+
+    @staticmethod
+    def is_bot_message(msg: dict, bot_user_id: str) -> bool:
+        return msg.get("user") == bot_user_id or bool(msg.get("bot_id"))
+
+thread_history_cache = ThreadHistoryCache(create_ttl_store(
+    "thread_history", THREAD_HISTORY_CACHE_MAX_THREADS, THREAD_HISTORY_CACHE_TTL_SEC, THREAD_HISTORY_CACHE_DB
+))
+
+# --- Helper 클래스: 스레드 롤링 요약 ---
+@dataclass
+class ThreadSummaryJob:
+    """응답을 보낸 뒤 실행할 요약 갱신 작업입니다 (summary 는 기존 요약, turns 는 새로 합칠 턴)."""
+    key: str
+    summary: str
+    turns: list
+    llm_settings: dict
+
+class ThreadSummarizer:
+    """
+    스레드별 롤링 요약입니다. 저장소에는 (봇, 채널, thread_ts) 별로 {"summary", "last_ts"} 를 저장하며,
+    last_ts 는 요약에 포함된 마지막 대화 턴의 ts 입니다 (요약은 이 값으로 버전이 구분되고, 더 최신 요약만 덮어씁니다).
+    - compact: 스레드 대화가 trigger_tokens 를 넘으면 [요약 턴] + last_ts 이후의 턴을 프롬프트용으로 돌려줍니다.
+      아직 요약이 없으면 기존과 같이 최근 THREAD_HISTORY_PROMPT_TURNS 턴을 사용합니다.
+    - 요약 이후 쌓인 턴(최근 recent_turns 턴 제외)이 refresh_tokens 를 넘으면 갱신 작업을 함께 돌려주며,
+      호출자는 답변을 보낸 뒤 schedule_refresh 로 실행합니다 (새 턴만 기존 요약에 합치는 증분 요약).
+    """
+    SYSTEM_PROMPT = (
+        "당신은 Slack 스레드 대화를 요약하는 도우미입니다. 기존 요약과 새 대화를 합쳐 하나의 요약으로 갱신하세요. "
+        "누가 무엇을 질문했고 어떤 결론/결정/미해결 질문이 있었는지, 이후 답변에 필요한 사실(이름, 수치, 코드, 링크)을 빠짐없이 남기고 "
+        "인사말이나 반복은 생략하세요. 요약 본문만 한국어로 출력하세요."
+    )
+
+    def __init__(self, store, trigger_tokens: int = THREAD_SUMMARY_TRIGGER_TOKENS, recent_turns: int = THREAD_SUMMARY_RECENT_TURNS,
+                 refresh_tokens: int = THREAD_SUMMARY_REFRESH_TOKENS):
+        self.store = store
+        self.trigger_tokens = trigger_tokens
+        self.recent_turns = recent_turns
+        self.refresh_tokens = refresh_tokens
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thread-summary")
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self.refreshed = 0
+        self.failed = 0
+
+    @staticmethod
+    def turns_token_count(turns: list) -> int:
+        return sum(estimate_token_count(turn["message"]) for turn in turns)
+
+    def compact(self, bot_user_id: str, channel_id: str, thread_ts: str, thread_turns: list, llm_settings: dict) -> tuple:
+        """(프롬프트에 넣을 대화 턴 목록, 갱신 작업 또는 None) 을 반환합니다."""
+        if len(thread_turns) <= self.recent_turns or self.turns_token_count(thread_turns) <= self.trigger_tokens:
+            return thread_turns[-THREAD_HISTORY_PROMPT_TURNS:], None
+
+        key = ThreadHistoryCache.cache_key(bot_user_id, channel_id, thread_ts)
+        cached = self.store.get(key)
+        summary = cached["summary"] if cached else ""
+        last_ts = cached["last_ts"] if cached else None
+        unsummarized = [turn for turn in thread_turns if last_ts is None or float(turn["ts"]) > float(last_ts)]
+        older_unsummarized = unsummarized[:-self.recent_turns]
+
+        job = None
+        if older_unsummarized and (not cached or self.turns_token_count(older_unsummarized) > self.refresh_tokens):
+            job = ThreadSummaryJob(key, summary, older_unsummarized, llm_settings)
+
+        if not cached:
+            logger.info(f"스레드 요약({key}) 없음: 최근 {THREAD_HISTORY_PROMPT_TURNS}턴을 사용하고 응답 후 요약을 생성합니다.")
+            return thread_turns[-THREAD_HISTORY_PROMPT_TURNS:], job
+        prompt_turns = unsummarized[-THREAD_HISTORY_PROMPT_TURNS:]
+        trace_value("thread_summary_folded_turns", len(thread_turns) - len(prompt_turns))
+        logger.info(f"스레드 요약({key}) 사용: 전체 {len(thread_turns)}턴 중 요약 이후 {len(prompt_turns)}턴을 그대로 포함"
+                    f"{', 응답 후 요약 갱신' if job else ''}")
+        return [{"from": THREAD_SUMMARY_SPEAKER, "message": summary, "ts": last_ts}] + prompt_turns, job
+
+    def schedule_refresh(self, job: ThreadSummaryJob):
+        """
+        요약 갱신 작업을 작업 스레드에 넘기고 Future 를 반환합니다. 같은 스레드의 갱신이 진행 중이면 None 입니다.
+        현재 컨텍스트(Lambda 마감 시각)를 넘기므로 요약용 Bedrock 호출도 남은 시간 안에서만 시도합니다.
+        """
+        with self._lock:
+            if job.key in self._in_flight:
+                return None
+            self._in_flight.add(job.key)
+        return self._executor.submit(contextvars.copy_context().run, self._refresh, job)
+
+    def _refresh(self, job: ThreadSummaryJob):
+        trace_token = start_trace("thread_summary", thread=job.key)
+        try:
+            summary_settings = dict(job.llm_settings, max_tokens=THREAD_SUMMARY_MAX_TOKENS, temperature=0.2)
+            if THREAD_SUMMARY_MODEL_ID:
+                summary_settings["model_id"] = THREAD_SUMMARY_MODEL_ID
+            user_content = (
+                (f"기존 요약:\n{job.summary}\n\n" if job.summary else "")
+                + f"새 대화:\n```json\n{timeline_to_json(job.turns)}\n```\n\n위 내용을 합친 요약을 작성해주세요."
+            )
+            with trace_span("summarize"):
+                summary = invoke_llm({"system": self.SYSTEM_PROMPT, "messages": [{"role": "user", "content": user_content}]}, summary_settings)
+            if not summary or summary in LLM_FALLBACK_RESPONSES:
+                self.failed += 1
+                logger.warning(f"스레드 요약({job.key}) 생성 실패, 다음 멘션에서 다시 시도합니다.")
+                return
+            last_ts = job.turns[-1]["ts"]
+            current = self.store.get(job.key)
+            if current and float(current["last_ts"]) >= float(last_ts):
+                return # 다른 작업자가 더 최신 요약을 이미 저장함
+            self.store.set(job.key, {"summary": summary, "last_ts": last_ts})
+            self.refreshed += 1
+            logger.info(f"스레드 요약({job.key}) 갱신: 새 턴 {len(job.turns)}개 반영 "
+                        f"(요약 약 {estimate_token_count(summary)}토큰, 기준 ts: {last_ts})")
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"스레드 요약({job.key}) 갱신 중 오류: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._in_flight.discard(job.key)
+            finish_trace(trace_token)
+
+thread_summarizer = ThreadSummarizer(create_ttl_store(
+    "thread_summary", THREAD_SUMMARY_MAX_THREADS, THREAD_SUMMARY_TTL_SEC, THREAD_SUMMARY_DB
+)) if THREAD_SUMMARY_ENABLED else None
+
+def thread_summary_wait_sec():
+    """
+    THREAD_SUMMARY_REFRESH_SYNC 일 때 요약 갱신을 기다릴 수 있는 시간(초)입니다.
+    Lambda 마감까지 BEDROCK_DEADLINE_MARGIN_SEC 을 남기며, 기다리지 않거나 마감 시각이 없으면 None 입니다.
+    """
+    remaining_sec = remaining_invocation_sec() if THREAD_SUMMARY_REFRESH_SYNC else None
+    return None if remaining_sec is None else remaining_sec - BEDROCK_DEADLINE_MARGIN_SEC
+
+def _schedule_thread_summary_refresh(job: ThreadSummaryJob, wait_sec):
+    if wait_sec is not None and wait_sec < BEDROCK_MIN_ATTEMPT_SEC:
+        logger.info(f"남은 시간({wait_sec:.1f}초)이 부족하여 스레드 요약({job.key}) 갱신을 다음 멘션으로 미룹니다.")
+        return None
+    return thread_summarizer.schedule_refresh(job)
+
+def run_thread_summary_refresh(job: ThreadSummaryJob):
+    """
+    답변을 성공적으로 보낸 뒤에만 호출합니다. THREAD_SUMMARY_REFRESH_SYNC 이면 갱신이 끝날 때까지 기다리되,
+    thread_summary_wait_sec() 만큼만 기다리고 그 시간이 BEDROCK_MIN_ATTEMPT_SEC 보다 짧으면 갱신하지 않습니다.
+    """
+    wait_sec = thread_summary_wait_sec()
+    future = _schedule_thread_summary_refresh(job, wait_sec)
+    if future is not None and THREAD_SUMMARY_REFRESH_SYNC:
+        try:
+            future.result(timeout=wait_sec)
+        except FutureTimeoutError:
+            logger.warning(f"스레드 요약({job.key}) 갱신이 남은 시간 안에 끝나지 않아 기다리지 않고 응답합니다.")
+
+async def async_run_thread_summary_refresh(job: ThreadSummaryJob):
+    """run_thread_summary_refresh 의 비동기 버전입니다."""
+    wait_sec = thread_summary_wait_sec()
+    future = _schedule_thread_summary_refresh(job, wait_sec)
+    if future is not None and THREAD_SUMMARY_REFRESH_SYNC:
+        try:
+            # 시간 초과 시에도 갱신 작업 자체는 취소하지 않습니다.
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), wait_sec)
+        except asyncio.TimeoutError:
+            logger.warning(f"스레드 요약({job.key}) 갱신이 남은 시간 안에 끝나지 않아 기다리지 않고 응답합니다.")
+
+# --- 스레드별 최신 멘션 임대 저장소 ---
+class MemoryThreadLeaseStore:
+    """
+    스레드 키별 최신 멘션 ts 와 만료 시각을 메모리에 보관합니다 (로컬 서버의 여러 처리 스레드 간 공유). 스레드 안전합니다.
+    """
+    def __init__(self, ttl_sec: float = MENTION_LEASE_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._leases = {} # thread_key -> (mention_ts, expires_at)
+        self._lock = threading.Lock()
+
+    def claim(self, thread_key: str, mention_ts: str) -> bool:
+        """mention_ts 가 현재 임대보다 새롭거나 임대가 만료되었으면 임대를 가져오고 True 를 반환합니다."""
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(thread_key)
+            if current and current[1] >= now and float(current[0]) > float(mention_ts):
+                return False
+            self._leases[thread_key] = (mention_ts, now + self.ttl_sec)
+            if len(self._leases) > 10000:
+                self._leases = {key: lease for key, lease in self._leases.items() if lease[1] >= now}
+            return True
+
+    def holder(self, thread_key: str):
+        with self._lock:
+            current = self._leases.get(thread_key)
+        return current[0] if current and current[1] >= time.time() else None
+
+class SqliteThreadLeaseStore:
+    """조건부 UPSERT 로 임대를 기록하는 sqlite 저장소입니다 (같은 파일을 쓰는 프로세스 간 공유, DynamoDB 의 로컬 대용)."""
+    def __init__(self, path: str, ttl_sec: float = MENTION_LEASE_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS thread_leases (thread_key TEXT PRIMARY KEY, mention_ts TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def claim(self, thread_key: str, mention_ts: str) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO thread_leases (thread_key, mention_ts, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(thread_key) DO UPDATE SET mention_ts = excluded.mention_ts, expires_at = excluded.expires_at "
+                "WHERE CAST(thread_leases.mention_ts AS REAL) <= CAST(excluded.mention_ts AS REAL) OR thread_leases.expires_at < ?",
+                (thread_key, mention_ts, now + self.ttl_sec, now)
+            )
+            return cursor.rowcount == 1
+
+    def holder(self, thread_key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mention_ts FROM thread_leases WHERE thread_key = ? AND expires_at >= ?", (thread_key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+class DynamoDbThreadLeaseStore:
+    """
+    DynamoDB 조건부 쓰기로 임대를 기록하여 모든 Lambda 컨테이너가 같은 스레드의 최신 멘션을 알 수 있게 합니다.
+    mention_ts 는 숫자(N)로 저장하여 비교하며, 테이블의 TTL 속성을 expires_at 으로 설정하면 오래된 항목이 자동 삭제됩니다.
+    """
+    def __init__(self, table_name: str, ttl_sec: float = MENTION_LEASE_TTL_SEC):
+        self.table_name = table_name
+        self.ttl_sec = ttl_sec
+        self.dynamodb = create_aws_client('dynamodb')
+
+    def claim(self, thread_key: str, mention_ts: str) -> bool:
+        now = int(time.time())
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={"thread_key": {"S": thread_key}, "mention_ts": {"N": mention_ts}, "expires_at": {"N": str(now + int(self.ttl_sec))}},
+                ConditionExpression="attribute_not_exists(thread_key) OR mention_ts <= :mention_ts OR expires_at < :now",
+                ExpressionAttributeValues={":mention_ts": {"N": mention_ts}, ":now": {"N": str(now)}},
+            )
+            return True
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def holder(self, thread_key: str):
+        item = self.dynamodb.get_item(
+            TableName=self.table_name, Key={"thread_key": {"S": thread_key}}, ConsistentRead=True
+        ).get("Item")
+        if not item or int(item["expires_at"]["N"]) < int(time.time()):
+            return None
+        return item["mention_ts"]["N"]
+
+# --- Helper 클래스: 스레드별 연속 멘션 조정 ---
+class ThreadMentionCoordinator:
+    """
+    같은 스레드의 연속 멘션을 하나의 답변 생성으로 합칩니다.
+    - register: 멘션 수신 시 스레드의 최신 멘션으로 임대를 기록합니다.
+    - wait_debounce: 수신 후 debounce_sec 이 지날 때까지 기다려 그 사이의 후속 멘션이 임대를 가져갈 기회를 줍니다.
+    - is_superseded: 더 새로운 멘션이 임대를 가져갔는지 확인합니다 (Bedrock 호출 전/스트리밍 중/답변 게시 전).
+    임대는 처리가 끝나도 해제하지 않고 만료를 기다립니다 (먼저 끝난 새 멘션이 해제하면 이전 멘션이 답변을 게시하게 되므로).
+    저장소 오류 시에는 조정 없이 각 멘션을 그대로 처리합니다.
+    """
+    def __init__(self, store, debounce_sec: float = MENTION_DEBOUNCE_SEC):
+        self.store = store
+        self.debounce_sec = debounce_sec
+        self._lock = threading.Lock()
+        self.coalesced = 0 # Bedrock 호출 전에 생략 (절약한 호출 수)
+        self.cancelled = 0 # 스트리밍 도중 중단
+        self.discarded = 0 # 생성은 끝났지만 게시하지 않음
+
+    @staticmethod
+    def thread_key(bot_user_id: str, channel_id: str, thread_ts: str) -> str:
+        return f"{bot_user_id}:{channel_id}:{thread_ts}"
+
+    def register(self, thread_key: str, mention_ts: str):
+        try:
+            if not self.store.claim(thread_key, mention_ts):
+                logger.info(f"스레드({thread_key})에 더 새로운 멘션이 이미 있습니다 (멘션 ts: {mention_ts}).")
+        except Exception as e:
+            logger.error(f"멘션 임대 기록 실패, 조정 없이 처리합니다: {e}")
+
+    def is_superseded(self, thread_key: str, mention_ts: str) -> bool:
+        try:
+            holder = self.store.holder(thread_key)
+        except Exception as e:
+            logger.error(f"멘션 임대 조회 실패, 조정 없이 처리합니다: {e}")
+            return False
+        return holder is not None and float(holder) > float(mention_ts)
+
+    def debounce_remaining_sec(self, started_at: float) -> float:
+        return max(0.0, started_at + self.debounce_sec - time.time())
+
+    def wait_debounce(self, started_at: float):
+        remaining_sec = self.debounce_remaining_sec(started_at)
+        if remaining_sec > 0:
+            with trace_span("debounce"):
+                time.sleep(remaining_sec)
+
+    async def async_wait_debounce(self, started_at: float):
+        remaining_sec = self.debounce_remaining_sec(started_at)
+        if remaining_sec > 0:
+            with trace_span("debounce"):
+                await asyncio.sleep(remaining_sec)
+
+    def record(self, outcome: str, thread_key: str, mention_ts: str):
+        """outcome: "coalesced" | "cancelled" | "discarded" """
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        trace_value(f"mention_{outcome}", 1)
+        if outcome == "coalesced":
+            trace_value("bedrock_calls_saved", 1)
+        logger.info(f"더 새로운 멘션이 있어 답변 생성을 건너뜀 ({outcome}, 스레드: {thread_key}, 멘션 ts: {mention_ts}, 통계: {self.stats()})")
+
+    def check_superseded(self, thread_key: str, mention_ts: str, outcome: str) -> bool:
+        """더 새로운 멘션이 있으면 outcome 으로 기록하고 True 를 반환합니다."""
+        if not self.is_superseded(thread_key, mention_ts):
+            return False
+        self.record(outcome, thread_key, mention_ts)
+        return True
+
+    def cancel_check(self, thread_key: str, mention_ts: str):
+        """스트리밍 중 주기적으로 호출할 함수를 반환합니다."""
+        return lambda: self.check_superseded(thread_key, mention_ts, "cancelled")
+
+    def stats(self) -> dict:
+        return {"bedrock_calls_saved": self.coalesced, "cancelled": self.cancelled, "discarded": self.discarded}
+
+def create_mention_coordinator():
+    if not MENTION_COALESCE_ENABLED:
+        return None
+    if MENTION_LEASE_TABLE:
+        logger.info(f"멘션 임대 저장소: DynamoDB ({MENTION_LEASE_TABLE})")
+        return ThreadMentionCoordinator(DynamoDbThreadLeaseStore(MENTION_LEASE_TABLE))
+    if MENTION_LEASE_DB:
+        logger.info(f"멘션 임대 저장소: sqlite ({MENTION_LEASE_DB})")
+        return ThreadMentionCoordinator(SqliteThreadLeaseStore(MENTION_LEASE_DB))
+    return ThreadMentionCoordinator(MemoryThreadLeaseStore())
+
+mention_coordinator = create_mention_coordinator()
+
+# --- Helper 클래스: LLM 응답 캐시 ---
+class ResponseCache:
+    """
+    단일 질문(대화 턴 1개)에 대한 LLM 응답을 캐시합니다.
+    키는 (라우팅 경로, 라우팅 후 모델 ID, 프롬프트 형식, 시스템 프롬프트, 검색된 참고 문서, 정규화된 대화 내용,
+    샘플링 파라미터) 의 SHA-256 해시이며, 저장소(MemoryTTLStore / SqliteTTLStore)가 LRU + TTL 로 크기를 제한합니다.
+    참고 문서는 청크 내용까지 키에 넣으므로 인덱스를 다시 만들면 이전 답변이 재사용되지 않습니다.
+    여러 턴으로 이어진 스레드나 temperature 가 max_temperature 를 넘는 요청은 캐시하지 않습니다.
+    """
+    def __init__(self, store, max_temperature: float = RESPONSE_CACHE_MAX_TEMPERATURE):
+        self.store = store
+        self.max_temperature = max_temperature
+        self._lock = threading.Lock() # 통계는 여러 작업 스레드에서 갱신됨
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def is_cacheable(self, conversation_turns: list, llm_settings: dict) -> bool:
+        if len(conversation_turns) > 1 or llm_settings["temperature"] > self.max_temperature:
+            with self._lock:
+                self.bypassed += 1
+            return False
+        return True
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        # 대소문자, 전각/반각, 연속 공백 차이는 같은 질문으로 취급합니다.
+        return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+    def make_key(self, system_prompt_text: str, conversation_turns: list, llm_settings: dict,
+                 query_route: str = None, reference_chunks: list = None) -> str:
+        key_material = json.dumps([
+            query_route,
+            llm_settings["model_id"],
+            PROMPT_FORMAT,
+            system_prompt_text,
+            [[chunk["source"], chunk["text"]] for chunk in reference_chunks or []],
+            [self.normalize_text(turn["message"]) for turn in conversation_turns],
+            llm_settings["max_tokens"],
+            llm_settings["temperature"],
+            llm_settings["top_p"],
+        ], ensure_ascii=False)
+        return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        cached = self.store.get(key)
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return cached["response"]
+
+    def set(self, key: str, llm_response: str):
+        if llm_response and llm_response not in LLM_FALLBACK_RESPONSES:
+            self.store.set(key, {"response": llm_response})
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses, bypassed = self.hits, self.misses, self.bypassed
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "bypassed": bypassed,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self.store),
+        }
+
+response_cache = ResponseCache(create_ttl_store(
+    "response_cache", RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SEC, RESPONSE_CACHE_DB
+)) if RESPONSE_CACHE_ENABLED else None
+
+# --- 참고 문서 검색(retrieval) ---
+class HashingEmbedder:
+    """
+    외부 호출 없이 단어와 글자 bigram 을 해시하여 고정 차원 벡터로 만드는 결정적 임베딩입니다 (feature hashing).
+    같은 입력은 항상 같은 벡터가 되므로 테스트와 네트워크 없는 인덱스 생성에 사용하며,
+    글자 bigram 덕분에 조사가 붙은 한국어 단어("설치하려면" / "설치")도 어느 정도 일치합니다.
+    """
+    name = "hashing"
+
+    def __init__(self, dim: int = RETRIEVAL_EMBEDDING_DIM):
+        self.dim = dim
+
+    @staticmethod
+    def features(text: str) -> list:
+        words = re.findall(r"\w+", unicodedata.normalize("NFKC", text).lower())
+        bigrams = [word[i:i + 2] for word in words for i in range(len(word) - 1)]
+        return [f"w:{word}" for word in words] + [f"b:{bigram}" for bigram in bigrams]
+
+    def embed(self, texts: list):
+        import numpy as np
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+class BedrockEmbedder:
+    """Bedrock 임베딩 모델(Titan Text Embeddings V2 형식)로 정규화된 벡터를 만듭니다. 요청마다 질문 1건을 호출합니다."""
+    name = "bedrock"
+
+    def __init__(self, dim: int = RETRIEVAL_EMBEDDING_DIM, model_id: str = RETRIEVAL_EMBEDDING_MODEL_ID):
+        self.dim = dim
+        self.model_id = model_id
+
+    def embed(self, texts: list):
+        import numpy as np
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            response = bedrock_runtime.invoke_model(
+                body=json.dumps({"inputText": text, "dimensions": self.dim, "normalize": True}),
+                modelId=self.model_id,
+                accept='application/json',
+                contentType='application/json'
+            )
+            response_body = json.loads(response.get('body').read())
+            vectors[row] = response_body["embedding"]
+            trace_value("embedding_input_tokens", response_body.get("inputTextTokenCount"))
+        return vectors
+
+# 임베딩 구현 목록. RETRIEVAL_EMBEDDER 에 "모듈:팩토리" 를 지정하면 dim 을 받아 embed(texts) -> (건수, dim) 행렬을
+# 반환하는 객체를 만드는 팩토리를 불러옵니다. 인덱스 생성과 검색에는 같은 임베딩(이름과 차원)을 사용해야 합니다.
+EMBEDDERS = {
+    HashingEmbedder.name: HashingEmbedder,
+    BedrockEmbedder.name: BedrockEmbedder,
+}
+
+def create_embedder(name: str = RETRIEVAL_EMBEDDER, dim: int = RETRIEVAL_EMBEDDING_DIM):
+    if ":" in name:
+        import importlib
+        module_name, factory_name = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), factory_name)(dim)
+    if name not in EMBEDDERS:
+        raise ValueError(f"알 수 없는 RETRIEVAL_EMBEDDER: {name} (사용 가능: {sorted(EMBEDDERS)} 또는 '모듈:팩토리')")
+    return EMBEDDERS[name](dim)
+
+def chunk_document(text: str, chunk_chars: int = RETRIEVAL_CHUNK_CHARS, overlap_chars: int = RETRIEVAL_CHUNK_OVERLAP_CHARS) -> list:
+    """빈 줄로 나눈 문단을 chunk_chars 까지 채워 청크를 만듭니다. 한 문단이 chunk_chars 보다 길면 겹치게 잘라 나눕니다."""
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > chunk_chars:
+            chunks.append(current)
+            current = ""
+        if len(paragraph) > chunk_chars:
+            step = max(1, chunk_chars - overlap_chars)
+            chunks.extend(paragraph[start:start + chunk_chars] for start in range(0, len(paragraph) - overlap_chars, step))
+            continue
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+def build_retrieval_index(bot_user_id: str, docs_path: str = None, index_path: str = None, embedder=None) -> dict:
+    """
+    docs_path(기본: RETRIEVAL_DOCS_PATH/docs_{봇ID}) 아래의 .txt/.md 파일로 index_path/{봇ID}/ 에 인덱스를 만듭니다.
+    - embeddings-{해시}.npy: 정규화된 float32 임베딩 행렬 (요청 시 np.load(mmap_mode="r") 로 메모리 매핑).
+      파일 이름에 행렬 내용의 해시를 넣어 빌드마다 새 파일로 쓰고, 기존 파일은 교체하지 않습니다.
+    - chunks.json: 임베딩 이름/차원, 행렬 파일 이름(matrix_file)과 행 순서대로의 청크 본문 및 출처 (메타데이터 sidecar)
+    chunks.json 하나만 원자적으로 교체(os.replace)하므로, 읽는 쪽은 항상 같은 빌드의 행렬과 청크를 함께 봅니다.
+    직전 빌드의 행렬 파일은 교체 직전에 chunks.json 을 읽은 요청을 위해 남겨두고 그보다 오래된 것만 지웁니다.
+    생성 결과 요약을 반환합니다.
+    """
+    import numpy as np
+    docs_path = docs_path or os.path.join(RETRIEVAL_DOCS_PATH, f"docs_{bot_user_id}")
+    bot_index_path = os.path.join(index_path or RETRIEVAL_INDEX_PATH, bot_user_id)
+    embedder = embedder or create_embedder()
+    if not os.path.isdir(docs_path):
+        raise FileNotFoundError(f"참고 문서 폴더 '{docs_path}' 가 없습니다.")
+
+    chunks = []
+    for directory, _, filenames in sorted(os.walk(docs_path)):
+        for filename in sorted(filenames):
+            if not filename.lower().endswith(RETRIEVAL_FILE_EXTENSIONS):
+                continue
+            file_path = os.path.join(directory, filename)
+            with open(file_path, 'r', encoding='utf-8') as f:
+                document_text = f.read()
+            source = os.path.relpath(file_path, docs_path)
+            chunks.extend({"source": source, "text": chunk} for chunk in chunk_document(document_text))
+    if not chunks:
+        raise ValueError(f"참고 문서 폴더 '{docs_path}' 에 {RETRIEVAL_FILE_EXTENSIONS} 문서가 없습니다.")
+
+    matrix = np.zeros((len(chunks), embedder.dim), dtype=np.float32)
+    batch_size = 64
+    for start in range(0, len(chunks), batch_size):
+        matrix[start:start + batch_size] = embedder.embed([chunk["text"] for chunk in chunks[start:start + batch_size]])
+
+    os.makedirs(bot_index_path, exist_ok=True)
+    metadata_path = os.path.join(bot_index_path, "chunks.json")
+    previous_matrix_file = None
+    if os.path.exists(metadata_path):
+        try:
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                previous_matrix_file = json.load(f).get("matrix_file", "embeddings.npy")
+        except (OSError, ValueError):
+            pass
+    matrix_file = f"embeddings-{hashlib.sha256(matrix.tobytes()).hexdigest()[:16]}.npy"
+    matrix_path = os.path.join(bot_index_path, matrix_file)
+    with open(matrix_path + ".tmp", 'wb') as f:
+        np.save(f, matrix)
+    os.replace(matrix_path + ".tmp", matrix_path)
+    metadata = {"embedder": embedder.name, "dim": embedder.dim, "built_at": int(time.time()), "matrix_file": matrix_file, "chunks": chunks}
+    with open(metadata_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False)
+    os.replace(metadata_path + ".tmp", metadata_path)
+    for filename in os.listdir(bot_index_path):
+        if filename.startswith("embeddings") and filename.endswith(".npy") and filename not in (matrix_file, previous_matrix_file):
+            os.remove(os.path.join(bot_index_path, filename))
+    return {
+        "index_path": bot_index_path,
+        "documents": len({chunk["source"] for chunk in chunks}),
+        "chunks": len(chunks),
+        "embedder": embedder.name,
+        "dim": embedder.dim,
+        "matrix_bytes": matrix.nbytes,
+    }
+
+@dataclass
+class RetrievalIndex:
+    bot_user_id: str
+    matrix: object # 메모리 매핑된 (청크 수, 차원) float32 행렬
+    chunks: list
+    signature: tuple # (chunks.json mtime, size)
+    checked_at: float = field(default_factory=time.time)
+
+    def search(self, query_vector, top_k: int = RETRIEVAL_TOP_K, min_score: float = RETRIEVAL_MIN_SCORE) -> list:
+        """코사인 유사도(정규화된 벡터의 내적) 상위 top_k 청크를 [(점수, 청크)] 로 반환합니다."""
+        import numpy as np
+        scores = self.matrix @ query_vector
+        if len(scores) > top_k:
+            candidates = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        ranked = candidates[np.argsort(-scores[candidates])]
+        return [(float(scores[row]), self.chunks[row]) for row in ranked if scores[row] >= min_score]
+
+class RetrievalIndexRegistry:
     """
-    주어진 프롬프트를 사용하여 Bedrock LLM을 호출하고 응답 텍스트를 반환합니다.
-    Claude 3 Sonnet (Messages API) 기준입니다.
+    봇별 검색 인덱스를 처음 요청될 때 불러와(lazy) 모듈 전역에 유지하므로 warm 호출은 디스크 읽기 없이 재사용합니다.
+    임베딩 행렬은 메모리 매핑되어 필요한 페이지만 읽히며, SystemPromptRegistry 와 같이
+    reload_check_interval 초마다 chunks.json 의 mtime/size 를 확인해 다시 생성된 인덱스를 반영합니다.
+    인덱스가 없는 봇은 None 으로 기억하여 매번 파일을 찾지 않습니다.
+    인덱스를 불러오지 못한 경우(파일 손상, 임베딩 설정 불일치)도 reload_check_interval 동안 None 으로 기억하여
+    멘션마다 다시 읽거나 오류 로그를 남기지 않고, 그 시간이 지나면 한 번 다시 시도합니다.
     """
-    messages = [
-        {"role": "user", "content": prompt} 
-    ]
+    def __init__(self, index_path: str, reload_check_interval: float = PROMPT_RELOAD_CHECK_INTERVAL_SEC):
+        self.index_path = index_path
+        self.reload_check_interval = reload_check_interval
+        self._entries = {} # 봇 ID -> RetrievalIndex 또는 (None, signature, checked_at)
+        self._lock = threading.Lock()
+        self._embedder = None
+        self.load_count = 0
 
-    body = json.dumps({
-        "anthropic_version": "bedrock-2023-05-31", 
-        "max_tokens": 1024, 
-        "messages": messages,
-        "temperature": 0.7, 
-        "top_p": 0.9,       
-    })
+    @property
+    def embedder(self):
+        with self._lock:
+            if self._embedder is None:
+                self._embedder = create_embedder()
+            return self._embedder
 
-    try:
-        logger.info(f"Bedrock 모델 ({bedrock_model_id}) 호출 시작")
-        logger.debug(f"Bedrock 호출 프롬프트 (일부): {prompt[:250]}...") 
-        response = bedrock_runtime.invoke_model(
-            body=body,
-            modelId=bedrock_model_id,
-            accept='application/json',
-            contentType='application/json'
-        )
-        logger.info("Bedrock 모델 호출 성공")
-        response_body = json.loads(response.get('body').read())
-        
-        if response_body.get("content") and isinstance(response_body["content"], list) and len(response_body["content"]) > 0:
-            llm_response = response_body['content'][0].get('text', '죄송합니다, 답변 내용이 비어있습니다.')
-        else:
-            llm_response = '죄송합니다, 예상치 못한 응답 형식입니다.'
-            logger.error(f"Bedrock 예상치 못한 응답 형식: {response_body}")
+    def _metadata_path(self, bot_user_id: str) -> str:
+        return os.path.join(self.index_path, bot_user_id, "chunks.json")
 
-        logger.info(f"Bedrock 응답 수신 (일부): {llm_response[:100]}...")
-        return llm_response.strip()
-    except Exception as e:
-        logger.error(f"Bedrock 모델 호출 중 오류 발생: {e}", exc_info=True)
-        return "죄송합니다, 답변을 생성하는 중 오류가 발생했습니다. 😥"
+    def _signature(self, bot_user_id: str):
+        try:
+            metadata_stat = os.stat(self._metadata_path(bot_user_id))
+        except FileNotFoundError:
+            return None
+        return (metadata_stat.st_mtime_ns, metadata_stat.st_size)
 
-# --- Helper 함수: 스레드 대화 내용 JSON 타임라인 포맷팅 ---
-def format_conversation_to_json_timeline(messages: list, bot_user_id: str) -> str:
-    timeline = []
-    for msg in messages:
-        text = msg.get("text", "").strip()
-        user_id_from_msg = msg.get("user")
-        bot_id_from_msg = msg.get("bot_id") 
+    def get(self, bot_user_id: str):
+        """봇의 RetrievalIndex 를 반환합니다. 인덱스가 없거나 불러오지 못했으면 None 입니다."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(bot_user_id)
+        if entry is not None:
+            index, signature, checked_at = entry
+            if now - checked_at < self.reload_check_interval:
+                return index
+        signature = self._signature(bot_user_id)
+        if entry is not None and entry[1] == signature:
+            with self._lock:
+                self._entries[bot_user_id] = (entry[0], signature, now)
+            return entry[0]
 
-        if user_id_from_msg == bot_user_id or bot_id_from_msg:
-            speaker_from = "bot"
-        elif user_id_from_msg:
-            speaker_from = f"<@{user_id_from_msg}>" 
-        else:
-            logger.debug(f"발신자 정보 없는 메시지 건너뜀: {msg.get('ts')}")
-            continue
+        index = None
+        if signature is not None:
+            try:
+                index = self._load(bot_user_id, signature)
+            except Exception as e:
+                logger.error(f"검색 인덱스 로드 실패, {self.reload_check_interval:g}초 동안 검색 없이 답변합니다 (봇: {bot_user_id}): {e}")
+                # signature 를 None 으로 기억하므로 reload_check_interval 이 지나면 파일이 그대로여도 다시 시도합니다.
+                signature = None
+        with self._lock:
+            self._entries[bot_user_id] = (index, signature, now)
+        return index
 
-        if bot_user_id and f"<@{bot_user_id}>" in text:
-             text = text.replace(f"<@{bot_user_id}>", "").strip()
+    def _load(self, bot_user_id: str, signature: tuple) -> RetrievalIndex:
+        import numpy as np
+        with open(self._metadata_path(bot_user_id), 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        embedder = self.embedder
+        if metadata["embedder"] != embedder.name or metadata["dim"] != embedder.dim:
+            raise ValueError(
+                f"봇 {bot_user_id} 의 검색 인덱스는 {metadata['embedder']}/{metadata['dim']} 임베딩으로 생성되었습니다 "
+                f"(현재 설정: {embedder.name}/{embedder.dim}). build_index.py 로 다시 생성해주세요."
+            )
+        # chunks.json 이 가리키는 행렬 파일만 읽으므로 다시 생성 중이어도 다른 빌드의 행렬과 섞이지 않습니다.
+        matrix_file = metadata.get("matrix_file", "embeddings.npy")
+        matrix = np.load(os.path.join(self.index_path, bot_user_id, matrix_file), mmap_mode="r")
+        if matrix.shape != (len(metadata["chunks"]), embedder.dim):
+            raise ValueError(f"봇 {bot_user_id} 의 검색 인덱스 행렬 크기 {matrix.shape} 가 청크 수와 맞지 않습니다.")
+        self.load_count += 1
+        logger.info(f"검색 인덱스 로드 완료: 봇 {bot_user_id}, 청크 {len(metadata['chunks'])}개 ({metadata['embedder']}/{metadata['dim']})")
+        return RetrievalIndex(bot_user_id, matrix, metadata["chunks"], signature)
 
-        if text: 
-             timeline.append({"from": speaker_from, "message": text})
-        else:
-             logger.debug(f"내용 없는 메시지 건너뜀: {msg.get('ts')}")
+    def invalidate(self, bot_user_id: str = None):
+        with self._lock:
+            if bot_user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(bot_user_id, None)
+
+retrieval_registry = RetrievalIndexRegistry(RETRIEVAL_INDEX_PATH) if RETRIEVAL_ENABLED else None
+
+def retrieve_reference_chunks(bot_user_id: str, user_query: str) -> list:
+    """질문과 관련된 참고 문서 청크 목록을 반환합니다. 검색을 사용하지 않거나 실패하면 빈 목록입니다 (답변은 계속 진행)."""
+    if retrieval_registry is None or not user_query:
+        return []
+    try:
+        index = retrieval_registry.get(bot_user_id)
+        if index is None:
+            return []
+        query_vector = retrieval_registry.embedder.embed([user_query])[0]
+        results = index.search(query_vector)
+    except Exception as e:
+        logger.error(f"참고 문서 검색 실패, 검색 없이 진행합니다 (봇: {bot_user_id}): {e}", exc_info=True)
+        return []
+    trace_value("retrieval_chunks", len(results))
+    if results:
+        trace_value("retrieval_top_score", round(results[0][0], 3), "None")
+        logger.info(f"참고 문서 {len(results)}개 검색 (유사도: {[round(score, 3) for score, _ in results]})")
+    return [chunk for _, chunk in results]
 
-    return json.dumps(timeline, ensure_ascii=False, indent=2) 
+def format_reference_chunks(reference_chunks: list) -> str:
+    sections = [f"[{number}] (출처: {chunk['source']})\n{chunk['text']}" for number, chunk in enumerate(reference_chunks, 1)]
+    return "다음은 질문과 관련된 참고 문서입니다. 답변에 필요한 경우에만 활용해주세요:\n\n" + "\n\n".join(sections)
 
 # --- Helper 함수: LLM 프롬프트 생성 ---
-def create_llm_prompt(system_prompt_text: str, conversation_json: str, latest_query_text_from_event: str) -> str:
+def create_llm_prompt(system_prompt_text: str, conversation_json: str, latest_query_text_from_event: str,
+                      reference_chunks: list = None) -> str:
     """
     시스템 프롬프트, JSON 타임라인, 최신 질문을 기반으로 LLM 프롬프트를 생성합니다.
+    reference_chunks(검색된 참고 문서 청크)가 있으면 시스템 프롬프트와 대화 내용 사이에 넣습니다.
     """
     try:
         timeline_data = json.loads(conversation_json)
@@ -149,25 +2660,179 @@ def create_llm_prompt(system_prompt_text: str, conversation_json: str, latest_qu
     else:
         user_interaction_part = f"다음은 대화 내용입니다:\n```json\n{conversation_json}\n```\n위 대화 타임라인의 마지막 메시지에 대해 답변해주세요."
     
+    if reference_chunks:
+        user_interaction_part = f"{format_reference_chunks(reference_chunks)}\n\n{user_interaction_part}"
     full_prompt = f"{system_prompt_text}\n\n{user_interaction_part}"
     logger.debug(f"생성된 전체 LLM 프롬프트 (일부): {full_prompt[:200]}...")
     return full_prompt
 
+# --- Helper 함수: 입력 토큰 수 추정 ---
+def estimate_token_count(text: str) -> int:
+    """
+    토크나이저 없이 입력 토큰 수를 근사합니다 (ASCII 약 4자당 1토큰, 한글 등 비 ASCII 문자는 1자당 1토큰).
+    예산 계산용의 보수적인 추정치이며, 실제 값은 Bedrock 응답의 usage 로 확인해야 합니다.
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
 
-# --- Slack 이벤트 핸들러 ---
-@app.event("app_mention")
-def handle_app_mention_events(body, say, logger, client):
-    # `body`는 SlackRequestHandler가 파싱한 Slack 이벤트 페이로드 자체입니다.
-    # `event_id`는 이 `body`의 최상위 레벨에 있습니다.
-    event_id = body.get("event_id")
+# --- Helper 함수: Messages API 형식 프롬프트 생성 ---
+def create_llm_messages(system_prompt_text: str, conversation_turns: list, latest_query_text_from_event: str,
+                        token_budget: int = PROMPT_INPUT_TOKEN_BUDGET, reference_chunks: list = None) -> dict:
+    """
+    대화 턴을 Messages API 의 system 필드와 user/assistant 교대 messages 로 변환합니다.
+    - 봇의 발언은 assistant 턴, 사람의 발언은 "<@사용자ID>: 내용" 형식의 user 턴이 됩니다.
+    - 연속된 같은 역할의 턴은 하나로 합칩니다 (Messages API 는 user 로 시작하는 역할 교대를 요구).
+    - 시스템 프롬프트와 메시지의 추정 토큰 수가 token_budget 을 넘으면 가장 오래된 턴부터 제외합니다.
+      단, 마지막 턴(최신 질문)은 항상 포함됩니다.
+    - reference_chunks(검색된 참고 문서 청크)는 마지막 user 메시지 앞에 붙이고 예산에서 먼저 뺍니다.
+      (요청마다 달라지는 내용을 system 이 아닌 마지막 메시지에 두어 앞부분이 매번 같게 유지됩니다.)
+    - cache_boundaries 에는 다음 후속 멘션에서도 그대로일 [메시지 번호, 앞부분 글자 수] 를 담습니다 (프롬프트 캐싱용).
+      스레드 요약 턴이 맨 앞에 남아 있으면 그 턴까지, 첫 턴이 history_start(select_prompt_turns 참고)이고
+      예산 때문에 제외한 턴이 없으면 직전 봇 답변까지가 고정된 앞부분입니다.
+    반환값은 {"system": ..., "messages": [...], "cache_boundaries": [...]} 이며 invoke_llm 에 그대로 전달할 수 있습니다.
+    """
+    role_turns = []
+    for turn in conversation_turns:
+        if turn["from"] == "bot":
+            role_turns.append(("assistant", turn["message"]))
+        else:
+            role_turns.append(("user", f"{turn['from']}: {turn['message']}"))
+    if not role_turns:
+        role_turns.append(("user", latest_query_text_from_event))
+
+    reference_text = format_reference_chunks(reference_chunks) if reference_chunks else ""
+    remaining_budget = token_budget - estimate_token_count(system_prompt_text) - estimate_token_count(reference_text)
+    kept_turns = []
+    for role, text in reversed(role_turns):
+        turn_tokens = estimate_token_count(text)
+        if kept_turns and turn_tokens > remaining_budget:
+            break
+        kept_turns.append((role, text))
+        remaining_budget -= turn_tokens
+    kept_turns.reverse()
+    if len(kept_turns) < len(role_turns):
+        logger.info(f"입력 토큰 예산({token_budget}) 초과로 오래된 대화 턴 {len(role_turns) - len(kept_turns)}개를 제외했습니다.")
+
+    history_complete = len(kept_turns) == len(role_turns) and bool(conversation_turns) and conversation_turns[0].get("history_start", False)
+    summary_kept = len(kept_turns) == len(role_turns) and bool(conversation_turns) and conversation_turns[0]["from"] == THREAD_SUMMARY_SPEAKER
+
+    while kept_turns and kept_turns[0][0] == "assistant":
+        kept_turns.pop(0)
+
+    messages = []
+    for role, text in kept_turns:
+        if messages and messages[-1]["role"] == role:
+            messages[-1]["content"] += f"\n\n{text}"
+        else:
+            messages.append({"role": role, "content": text})
+    if not messages or messages[-1]["role"] != "user":
+        messages.append({"role": "user", "content": latest_query_text_from_event})
+
+    cache_boundaries = []
+    if summary_kept and len(messages) >= 2:
+        cache_boundaries.append([0, len(role_turns[0][1])]) # 요약 턴은 첫 user 메시지의 맨 앞
+    if history_complete and len(messages) >= 3:
+        cache_boundaries.append([len(messages) - 2, len(messages[-2]["content"])])
+    if reference_text:
+        messages[-1]["content"] = f"{reference_text}\n\n{messages[-1]['content']}"
+
+    logger.debug(f"생성된 Messages API 프롬프트: system {len(system_prompt_text)}자, messages {len(messages)}개")
+    return {"system": system_prompt_text, "messages": messages, "cache_boundaries": cache_boundaries}
+
+
+# --- Helper 함수: 이벤트 ID 중복 확인 ---
+def register_event_id(event_id: str, logger) -> bool:
+    """처음 보는 이벤트면 기록하고 True, 이미 처리한 이벤트면 False 를 반환합니다."""
     if event_id:
-        if event_id in PROCESSED_EVENT_IDS:
+        try:
+            is_new_event = event_deduplicator.claim(event_id)
+        except Exception as e:
+            # 공유 저장소 장애 시에는 중복 처리 위험을 감수하고 처리를 계속합니다.
+            logger.error(f"이벤트 ID 중복 확인 실패, 처리를 계속합니다: {e}")
+            is_new_event = True
+        if not is_new_event:
             logger.warning(f"중복 이벤트 수신 및 무시: {event_id}")
-            return # 이미 처리된 이벤트이므로 여기서 중단
-        PROCESSED_EVENT_IDS.append(event_id) # 새 이벤트 ID 추가 (deque는 오래된 ID 자동 제거)
-        logger.info(f"새 이벤트 처리 시작: {event_id} (PROCESSED_EVENT_IDS 크기: {len(PROCESSED_EVENT_IDS)})")
+            return False # 이미 처리된 이벤트이므로 여기서 중단
+        logger.info(f"새 이벤트 처리 시작: {event_id}")
     else:
         logger.warning("요청에서 event_id를 찾을 수 없습니다. 중복 처리 방지가 작동하지 않을 수 있습니다.")
+    return True
+
+# --- Helper 함수: 봇 프로필(시스템 프롬프트 + LLM 설정) 로드 ---
+def load_bot_profile(bot_user_id: str, user_id: str, logger) -> tuple:
+    """
+    (BotPromptProfile, None) 또는 실패 시 (None, 사용자에게 보낼 안내 메시지) 를 반환합니다.
+    """
+    prompt_filename = f"system_prompt_{bot_user_id}.txt"
+    full_prompt_path = prompt_registry.prompt_path(bot_user_id)
+    try:
+        bot_profile = prompt_registry.get(bot_user_id)
+    except FileNotFoundError:
+        logger.error(f"시스템 프롬프트 파일 '{full_prompt_path}'을 찾을 수 없습니다.")
+        return None, f"죄송합니다, <@{user_id}>님. 봇의 시스템 프롬프트가 설정되어 있지 않습니다. 관리자에게 문의해주세요."
+    except Exception as e:
+        logger.error(f"시스템 프롬프트 파일 로딩 중 오류 발생 ({prompt_filename}): {e}", exc_info=True)
+        return None, f"죄송합니다, <@{user_id}>님. 봇 설정을 불러오는 중 오류가 발생했습니다. 관리자에게 문의해주세요."
+    if not bot_profile.system_prompt:
+        logger.error(f"시스템 프롬프트 파일 '{full_prompt_path}'이 비어있습니다.")
+        return None, f"죄송합니다, <@{user_id}>님. 봇의 설정에 문제가 있습니다 (프롬프트 내용 없음). 관리자에게 문의해주세요."
+    return bot_profile, None
+
+# --- Helper 함수: 멘션 텍스트에서 질문 추출 ---
+def extract_user_query(text: str, bot_user_id: str) -> str:
+    if bot_user_id and f"<@{bot_user_id}>" in text:
+         return text.replace(f"<@{bot_user_id}>", "").strip()
+    parts = text.split(" ", 1)
+    return parts[1].strip() if len(parts) > 1 else ""
+
+# --- Helper 함수: 스레드 기록 조회 오류 안내 메시지 ---
+def thread_history_error_message(e: Exception, user_id: str, logger) -> str:
+    if isinstance(e, SlackApiError):
+        if e.response and e.response.get("error") == "missing_scope":
+            logger.error(f"Slack API 권한 부족 오류: {e.response}. 'conversations:history' 권한이 필요합니다.")
+            return f"죄송합니다, <@{user_id}>님. 이전 대화 내용을 가져오려면 Slack 앱에 'conversations:history' 권한이 필요합니다. 앱 설정을 확인해주세요."
+        logger.error(f"Slack API 오류 (conversations.replies): {e.response['error'] if e.response else e}")
+        return f"죄송합니다, <@{user_id}>님. 이전 대화 내용을 가져오는 중 오류가 발생했습니다."
+    logger.error(f"스레드 기록 처리 중 예외 발생: {e}", exc_info=True)
+    return f"죄송합니다, <@{user_id}>님. 이전 대화 내용을 처리하는 중 오류가 발생했습니다."
+
+# --- Helper 함수: 프롬프트에 넣을 스레드 대화 턴 선택 ---
+def select_prompt_turns(bot_user_id: str, channel_id: str, thread_ts: str, thread_turns: list, llm_settings: dict) -> tuple:
+    """
+    (대화 턴 목록, 응답 후 실행할 요약 갱신 작업 또는 None) 을 반환합니다. 요약을 사용하지 않으면 최근 턴만 자릅니다.
+    앞에서 잘린 턴이 없으면(스레드 첫 메시지부터, 또는 요약 이후의 턴 전부) 첫 턴의 사본에 history_start 를 표시합니다.
+    이때만 다음 멘션에서도 대화 앞부분이 그대로이므로 프롬프트 캐싱 체크포인트를 둘 수 있습니다.
+    """
+    if thread_summarizer is None or not thread_turns:
+        prompt_turns, job = thread_turns[-THREAD_HISTORY_PROMPT_TURNS:], None
+    else:
+        prompt_turns, job = thread_summarizer.compact(bot_user_id, channel_id, thread_ts, thread_turns, llm_settings)
+    if not prompt_turns:
+        return prompt_turns, job
+    if prompt_turns[0]["from"] == THREAD_SUMMARY_SPEAKER:
+        summary_ts = float(prompt_turns[0]["ts"])
+        history_start = len(prompt_turns) - 1 == sum(1 for turn in thread_turns if float(turn["ts"]) > summary_ts)
+    else:
+        history_start = prompt_turns[0]["ts"] == thread_ts # 스레드 부모 메시지부터 포함 (기록 캐시 상한으로도 잘리지 않음)
+    if history_start:
+        prompt_turns = [dict(prompt_turns[0], history_start=True)] + prompt_turns[1:]
+    return prompt_turns, job
+
+# --- Helper 함수: 설정된 형식으로 LLM 요청 생성 ---
+def build_llm_request(system_prompt_text: str, conversation_turns: list, user_query: str,
+                      reference_chunks: list = None) -> Union[str, dict]:
+    if PROMPT_FORMAT == "messages":
+        return create_llm_messages(system_prompt_text, conversation_turns, user_query, reference_chunks=reference_chunks)
+    return create_llm_prompt(system_prompt_text, timeline_to_json(conversation_turns), user_query, reference_chunks)
+
+# --- Slack 이벤트 핸들러 (DISPATCH_MODE 에 따라 아래 '리스너 등록'에서 등록) ---
+def handle_app_mention_events(body, say, logger, client):
+    # `body`는 SlackRequestHandler가 파싱한 Slack 이벤트 페이로드 자체입니다.
+    # `event_id`는 이 `body`의 최상위 레벨에 있습니다.
+    # 모든 Slack 호출은 slack_api 를 거치므로 `say` 대신 post_thread_message / deliver_thread_reply 를 사용합니다.
+    event_id = body.get("event_id")
+    if not register_event_id(event_id, logger):
+        return
 
     # 실제 이벤트 내용은 `body['event']` 안에 있습니다.
     actual_event_payload = body.get("event", {})
@@ -181,77 +2846,77 @@ def handle_app_mention_events(body, say, logger, client):
 
     target_thread_ts_for_all_replies = thread_ts if thread_ts else event_ts
     waiting_message_ts = None 
+    summary_job = None # 답변 후 실행할 스레드 요약 갱신 작업
+    query_route = None # 질문 난이도 라우팅 결과 (QUERY_ROUTING / 봇 설정 routing)
+    mention_thread_key = None # 연속 멘션 조정용 스레드 키 (MENTION_COALESCE_ENABLED)
+    mention_started_at = time.time()
+    slack_call_tracking = slack_api.start_mention()
+    trace_token = start_trace("mention", event_id=event_id, channel=channel_id, in_thread=bool(thread_ts))
 
     try:
-        # 봇 ID는 `body['authorizations']` 또는 `body['authed_users']` 등에서 가져올 수 있습니다.
-        # `slack_bolt`가 `client` 객체를 통해 `auth.test()`를 호출하여 현재 봇 ID를 가져오는 것이 더 안정적일 수 있습니다.
-        # 여기서는 이전 방식대로 `authorizations`를 사용합니다.
-        auth_info_list = body.get("authorizations")
-        bot_user_id = ""
-        if auth_info_list and isinstance(auth_info_list, list) and len(auth_info_list) > 0:
-            bot_user_id = auth_info_list[0].get("user_id", "")
-        
-        if not bot_user_id:
-            # client.auth_test()를 사용한 봇 ID 획득 시도 (더 안정적)
-            try:
-                auth_test_result = client.auth_test()
-                bot_user_id = auth_test_result.get("user_id")
-                logger.info(f"client.auth_test()를 통해 봇 ID 획득: {bot_user_id}")
-            except Exception as auth_e:
-                logger.error(f"client.auth_test() 호출 실패: {auth_e}")
-                # 이 경우에도 처리를 중단하거나, bot_user_id 없이 진행 (멘션 제거 등에 영향)
+        # 봇 ID는 `body['authorizations']` 에서 가져오고, 없으면 워크스페이스 토큰별로 캐시된 auth.test 결과를 사용합니다.
+        try:
+            with trace_span("bot_identity"):
+                bot_user_id = bot_identity_cache.resolve(body, client)
+        except Exception as auth_e:
+            logger.error(f"client.auth_test() 호출 실패: {auth_e}")
+            bot_user_id = ""
 
         if not bot_user_id:
             logger.error("봇 ID를 가져올 수 없습니다. authorizations 블록 또는 auth.test() 결과를 확인해주세요.")
-            say(text="죄송합니다, 봇 설정을 초기화하는 중 오류가 발생했습니다. (봇 ID 확인 불가)", thread_ts=target_thread_ts_for_all_replies)
+            post_thread_message(client, channel_id, target_thread_ts_for_all_replies, "죄송합니다, 봇 설정을 초기화하는 중 오류가 발생했습니다. (봇 ID 확인 불가)")
             return
 
-        # 0. 시스템 프롬프트 로드
-        system_prompt_text = ""
-        prompt_filename = f"system_prompt_{bot_user_id}.txt"
-        try:
-            # Lambda 환경에서는 /var/task/ 가 현재 작업 디렉토리
-            # 로컬에서는 스크립트 실행 위치 기준
-            # 파일 경로를 절대 경로로 지정하거나, Lambda Layer를 사용하는 것이 더 안정적일 수 있습니다.
-            # 여기서는 현재 작업 디렉토리를 기준으로 파일을 찾습니다.
-            base_path = os.path.dirname(os.path.abspath(__file__)) if "__file__" in locals() else os.getcwd()
-            full_prompt_path = os.path.join(base_path, prompt_filename)
-            
-            with open(full_prompt_path, 'r', encoding='utf-8') as f:
-                system_prompt_text = f.read().strip()
-            if not system_prompt_text:
-                logger.error(f"시스템 프롬프트 파일 '{full_prompt_path}'이 비어있습니다.")
-                say(text=f"죄송합니다, <@{user_id}>님. 봇의 설정에 문제가 있습니다 (프롬프트 내용 없음). 관리자에게 문의해주세요.", thread_ts=target_thread_ts_for_all_replies)
-                return
-            logger.info(f"시스템 프롬프트 로드 완료: {full_prompt_path}")
-        except FileNotFoundError:
-            logger.error(f"시스템 프롬프트 파일 '{full_prompt_path}'을 찾을 수 없습니다.")
-            say(text=f"죄송합니다, <@{user_id}>님. 봇의 시스템 프롬프트가 설정되어 있지 않습니다. 관리자에게 문의해주세요.", thread_ts=target_thread_ts_for_all_replies)
-            return
-        except Exception as e:
-            logger.error(f"시스템 프롬프트 파일 로딩 중 오류 발생 ({prompt_filename}): {e}", exc_info=True)
-            say(text=f"죄송합니다, <@{user_id}>님. 봇 설정을 불러오는 중 오류가 발생했습니다. 관리자에게 문의해주세요.", thread_ts=target_thread_ts_for_all_replies)
+        # 0. 시스템 프롬프트 로드 (레지스트리에 캐시되어 warm 호출 시 디스크 접근 없음)
+        with trace_span("prompt_load"):
+            bot_profile, profile_error_message = load_bot_profile(bot_user_id, user_id, logger)
+        if bot_profile is None:
+            post_thread_message(client, channel_id, target_thread_ts_for_all_replies, profile_error_message)
             return
+        system_prompt_text = bot_profile.system_prompt
+        llm_settings = bot_profile.llm_settings
 
-        if bot_user_id and f"<@{bot_user_id}>" in text:
-             user_query = text.replace(f"<@{bot_user_id}>", "").strip()
-        else:
-             parts = text.split(" ", 1)
-             user_query = parts[1].strip() if len(parts) > 1 else ""
+        user_query = extract_user_query(text, bot_user_id)
 
         if not user_query:
             logger.warning("사용자 질문 내용이 비어있습니다.")
-            say(text=f"<@{user_id}>님, 질문 내용을 입력해주세요.", thread_ts=target_thread_ts_for_all_replies)
+            post_thread_message(client, channel_id, target_thread_ts_for_all_replies, f"<@{user_id}>님, 질문 내용을 입력해주세요.")
             return
 
         logger.info(f"추출된 사용자 질문: '{user_query}'")
 
+        if mention_coordinator:
+            # 답변할 수 있는 멘션만 임대를 가져갑니다 (빈 질문/설정 오류 멘션이 앞선 멘션의 답변을 버리게 하지 않음).
+            mention_thread_key = ThreadMentionCoordinator.thread_key(bot_user_id, channel_id, target_thread_ts_for_all_replies)
+            mention_coordinator.register(mention_thread_key, event_ts)
+
+        # 새 질문이면 대화가 질문 한 턴뿐이므로 라우팅과 문서 검색을 먼저 하고, 그 결과까지 키에 넣어
+        # 대기 메시지를 보내기 전에 응답 캐시를 확인합니다 (스레드 내 질문은 여러 턴이므로 캐시 대상 아님).
+        response_cache_key = None
+        if not thread_ts:
+            single_turn = [{"from": f"<@{user_id}>", "message": user_query}]
+            with trace_span("route"):
+                query_route, llm_settings = query_router.route(user_query, single_turn, llm_settings)
+            with trace_span("retrieval"):
+                reference_chunks = retrieve_reference_chunks(bot_user_id, user_query)
+            if response_cache and response_cache.is_cacheable(single_turn, llm_settings):
+                response_cache_key = response_cache.make_key(
+                    system_prompt_text, single_turn, llm_settings, query_route, reference_chunks
+                )
+                cached_response = response_cache.get(response_cache_key)
+                trace_value("response_cache_hit", 1 if cached_response else 0)
+                if cached_response:
+                    with trace_span("final_post"):
+                        deliver_thread_reply(client, channel_id, target_thread_ts_for_all_replies, None, cached_response, logger)
+                    logger.info(f"응답 캐시 적중, Bedrock 호출 생략 (캐시 통계: {response_cache.stats()})")
+                    return
+                logger.info(f"응답 캐시 미스 (캐시 통계: {response_cache.stats()})")
+
         try:
-            waiting_message_response = client.chat_postMessage(
-                channel=channel_id,
-                text="잠시만 기다려주세요, 답변을 생성하고 있습니다... ⏳",
-                thread_ts=target_thread_ts_for_all_replies
-            )
+            with trace_span("placeholder_post"):
+                waiting_message_response = post_thread_message(
+                    client, channel_id, target_thread_ts_for_all_replies, PLACEHOLDER_MESSAGE
+                )
             waiting_message_ts = waiting_message_response.get("ts")
             if waiting_message_ts:
                 logger.info(f"임시 메시지 전송 완료 (ts: {waiting_message_ts})")
@@ -260,101 +2925,595 @@ def handle_app_mention_events(body, say, logger, client):
         except SlackApiError as e:
             logger.error(f"임시 메시지 전송 실패: {e}")
 
-        conversation_json = "[]" 
-        messages_from_slack = [] 
+        conversation_turns = []
 
         if thread_ts: 
             logger.info(f"스레드({thread_ts}) 내 질문입니다. 대화 기록을 가져옵니다.")
             try:
-                result = client.conversations_replies(
-                    channel=channel_id,
-                    ts=thread_ts, 
-                    limit=20 
-                )
-                messages_from_slack = result.get("messages", [])
-
-                if messages_from_slack:
-                     logger.info(f"{len(messages_from_slack)}개의 메시지를 스레드에서 가져왔습니다.")
-                     conversation_json = format_conversation_to_json_timeline(messages_from_slack, bot_user_id)
-                     logger.debug(f"생성된 JSON 타임라인 (스레드 기록):\n{conversation_json}")
-                else:
-                     logger.info("스레드에서 메시지를 가져오지 못했거나 메시지가 없습니다. 현재 질문만 사용합니다.")
-                     current_message_timeline = [{"from": f"<@{user_id}>", "message": user_query}]
-                     conversation_json = json.dumps(current_message_timeline, ensure_ascii=False, indent=2)
-
-            except SlackApiError as e:
-                error_target_ts = thread_ts 
-                if e.response and e.response.get("error") == "missing_scope":
-                     logger.error(f"Slack API 권한 부족 오류: {e.response}. 'conversations:history' 권한이 필요합니다.")
-                     say(text=f"죄송합니다, <@{user_id}>님. 이전 대화 내용을 가져오려면 Slack 앱에 'conversations:history' 권한이 필요합니다. 앱 설정을 확인해주세요.", thread_ts=error_target_ts)
-                else:
-                     logger.error(f"Slack API 오류 (conversations.replies): {e.response['error'] if e.response else e}")
-                     say(text=f"죄송합니다, <@{user_id}>님. 이전 대화 내용을 가져오는 중 오류가 발생했습니다.", thread_ts=error_target_ts)
-                if waiting_message_ts:
-                    try: client.chat_delete(channel=channel_id, ts=waiting_message_ts); logger.info(f"오류로 임시 메시지 삭제(ts: {waiting_message_ts})")
-                    except Exception as del_e: logger.error(f"임시 메시지 삭제 실패: {del_e}")
-                return 
+                with trace_span("thread_history"):
+                    thread_turns = thread_history_cache.get_turns(
+                        client, channel_id, thread_ts, bot_user_id, latest_ts=event_ts
+                    )
             except Exception as e:
-                 error_target_ts = thread_ts
-                 logger.error(f"스레드 기록 처리 중 예외 발생: {e}", exc_info=True)
-                 say(text=f"죄송합니다, <@{user_id}>님. 이전 대화 내용을 처리하는 중 오류가 발생했습니다.", thread_ts=error_target_ts)
-                 if waiting_message_ts:
-                    try: client.chat_delete(channel=channel_id, ts=waiting_message_ts); logger.info(f"오류로 임시 메시지 삭제(ts: {waiting_message_ts})")
-                    except Exception as del_e: logger.error(f"임시 메시지 삭제 실패: {del_e}")
-                 return
+                # 오류 안내로 대기 메시지를 바꿉니다 (삭제 호출 없음).
+                deliver_thread_reply(client, channel_id, thread_ts, waiting_message_ts, thread_history_error_message(e, user_id, logger), logger)
+                return 
+
+            if thread_turns:
+                 conversation_turns, summary_job = select_prompt_turns(bot_user_id, channel_id, thread_ts, thread_turns, llm_settings)
+                 logger.info(f"스레드 대화 기록 {len(thread_turns)}턴 중 {len(conversation_turns)}턴을 사용합니다.")
+            else:
+                 logger.info("스레드에서 메시지를 가져오지 못했거나 메시지가 없습니다. 현재 질문만 사용합니다.")
         else: 
              logger.info("새로운 질문 스레드입니다. 현재 메시지를 타임라인에 포함합니다.")
-             current_message_timeline = [{"from": f"<@{user_id}>", "message": user_query}]
-             conversation_json = json.dumps(current_message_timeline, ensure_ascii=False, indent=2)
-             logger.debug(f"생성된 JSON 타임라인 (현재 메시지):\n{conversation_json}")
+        if not conversation_turns:
+             conversation_turns = [{"from": f"<@{user_id}>", "message": user_query}]
+
+        if thread_ts:
+            with trace_span("route"):
+                query_route, llm_settings = query_router.route(user_query, conversation_turns, llm_settings)
+
+            with trace_span("retrieval"):
+                reference_chunks = retrieve_reference_chunks(bot_user_id, user_query)
+
+        with trace_span("prompt_build"):
+            prompt_for_llm = build_llm_request(system_prompt_text, conversation_turns, user_query, reference_chunks)
 
-        prompt_for_llm = create_llm_prompt(system_prompt_text, conversation_json, user_query)
+        if mention_thread_key:
+            # 후속 멘션을 기다린 뒤, 더 새로운 멘션이 있으면 그쪽에서 이 질문까지 함께 답변하므로 Bedrock 호출을 생략합니다.
+            mention_coordinator.wait_debounce(mention_started_at)
+            if mention_coordinator.check_superseded(mention_thread_key, event_ts, "coalesced"):
+                deliver_thread_reply(client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts, SUPERSEDED_MENTION_MESSAGE, logger)
+                return
+
+        if LLM_STREAMING_ENABLED and waiting_message_ts:
+            posted, streamed_response = stream_llm_response_to_slack(
+                client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts, prompt_for_llm, llm_settings,
+                should_cancel=mention_coordinator.cancel_check(mention_thread_key, event_ts) if mention_thread_key else None
+            )
+            if posted:
+                # 임시 메시지가 곧 답변이 되었으므로 삭제하지 않습니다.
+                logger.info(f"LLM 스트리밍 응답 전송 완료 (스레드: {target_thread_ts_for_all_replies})")
+                if response_cache_key and streamed_response:
+                    response_cache.set(response_cache_key, streamed_response)
+                if summary_job and streamed_response:
+                    # 중단되지 않고 끝까지 보낸 답변 뒤에만(응답 경로 밖에서) 요약을 갱신합니다.
+                    run_thread_summary_refresh(summary_job)
+                return
+            logger.warning("스트리밍 응답 실패, 일반 호출로 재시도합니다.")
 
         start_time = time.time()
-        llm_response = invoke_llm(prompt_for_llm)
+        llm_response = invoke_llm(prompt_for_llm, llm_settings)
         end_time = time.time()
         llm_duration = end_time - start_time
         logger.info(f"LLM 답변 생성 시간: {llm_duration:.2f}초")
+        if response_cache_key:
+            response_cache.set(response_cache_key, llm_response)
+        if mention_thread_key and mention_coordinator.check_superseded(mention_thread_key, event_ts, "discarded"):
+            deliver_thread_reply(client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts, SUPERSEDED_MENTION_MESSAGE, logger)
+            return
 
-        say(text=llm_response, thread_ts=target_thread_ts_for_all_replies)
+        with trace_span("final_post"):
+            deliver_thread_reply(client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts, llm_response, logger)
         logger.info(f"LLM 응답 전송 완료 (스레드: {target_thread_ts_for_all_replies})")
-
-        if waiting_message_ts:
-            try:
-                client.chat_delete(channel=channel_id, ts=waiting_message_ts)
-                logger.info(f"임시 메시지(ts: {waiting_message_ts}) 삭제 완료")
-            except SlackApiError as e:
-                logger.error(f"임시 메시지 삭제 실패: {e}")
+        if summary_job and llm_response not in LLM_FALLBACK_RESPONSES:
+            run_thread_summary_refresh(summary_job)
         
     except Exception as e:
         logger.error(f"이벤트 처리 중 예상치 못한 오류 발생 (이벤트 ID: {event_id}): {e}", exc_info=True)
         try:
-            say(text=f"죄송합니다, <@{user_id}>님. 요청 처리 중 오류가 발생했습니다. 😥", thread_ts=target_thread_ts_for_all_replies)
+            deliver_thread_reply(
+                client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts,
+                f"죄송합니다, <@{user_id}>님. 요청 처리 중 오류가 발생했습니다. 😥", logger
+            )
         except Exception as notify_error:
             logger.error(f"오류 알림 메시지 전송 실패: {notify_error}", exc_info=True)
-        
-        if waiting_message_ts:
+    finally:
+        trace_value("slack_api_calls", slack_api.finish_mention(slack_call_tracking, event_id, logger))
+        if query_route:
+            query_router.record(query_route, _current_trace.get())
+        finish_trace(trace_token)
+
+
+# --- 응답 분리(ack-fast) 디스패치 설정 ---
+# "inline": 리스너에서 모든 처리를 마친 뒤 Slack 에 응답 (기존 방식, Lambda 에서는 Bedrock 호출까지 기다림)
+# "lazy": slack_bolt lazy listener 로 즉시 응답 후, Lambda 자기 자신을 비동기 호출(InvocationType=Event)하여 처리
+# "queue": 즉시 응답 후 작업 큐에 넣고 작업자가 처리 (WORK_QUEUE_URL 이 있으면 SQS, 없으면 in-process 큐)
+DISPATCH_MODE = os.environ.get("DISPATCH_MODE", "inline")
+WORK_QUEUE_URL = os.environ.get("WORK_QUEUE_URL") # SQS 큐 URL (.fifo 큐면 채널별 순서 보장)
+WORK_QUEUE_MAX_WORKERS = int(os.environ.get("WORK_QUEUE_MAX_WORKERS", "8")) # in-process 큐 작업자 수 (동시 처리 상한)
+
+class LocalWorkQueue:
+    """
+    in-process 작업 큐입니다 (로컬 서버에서 SQS FIFO / Lambda 비동기 호출을 대신함).
+    - 최대 max_workers 개의 작업자 스레드가 처리하므로 동시 처리 수가 제한됩니다.
+    - 같은 order_key(채널 ID)의 작업은 도착 순서대로 한 번에 하나씩만 처리됩니다.
+    - 대기 중인 작업 수와 큐 대기 시간은 stats() 로 확인할 수 있습니다.
+    """
+    def __init__(self, max_workers: int = WORK_QUEUE_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._pending = OrderedDict() # order_key -> deque[(넣은 시각, 함수, 인자)]
+        self._active_keys = set()
+        self._condition = threading.Condition()
+        self._workers = []
+        self.depth = 0
+        self.max_depth = 0
+        self.processed = 0
+        self.total_wait_sec = 0.0
+        self.max_wait_sec = 0.0
+
+    def submit(self, order_key: str, function, *args):
+        with self._condition:
+            self._pending.setdefault(order_key, deque()).append((time.time(), function, args))
+            self.depth += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            if len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._worker_loop, name=f"work-queue-{len(self._workers)}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._condition.notify()
+
+    def _next_item(self):
+        # 다른 작업자가 처리 중이지 않은 채널 중 가장 먼저 들어온 채널의 작업을 꺼냅니다.
+        for order_key, items in self._pending.items():
+            if order_key not in self._active_keys:
+                item = items.popleft()
+                if not items:
+                    del self._pending[order_key]
+                self._active_keys.add(order_key)
+                self.depth -= 1
+                return order_key, item
+        return None, None
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                order_key, item = self._next_item()
+                while item is None:
+                    self._condition.wait()
+                    order_key, item = self._next_item()
+                enqueued_at, function, args = item
+                wait_sec = time.time() - enqueued_at
+                self.total_wait_sec += wait_sec
+                self.max_wait_sec = max(self.max_wait_sec, wait_sec)
+            logger.info(f"작업 큐에서 꺼냄 (채널: {order_key}, 대기 시간: {wait_sec * 1000:.0f}ms, 남은 작업: {self.depth})")
             try:
-                client.chat_delete(channel=channel_id, ts=waiting_message_ts)
-                logger.info(f"최종 예외 처리 중 임시 메시지(ts: {waiting_message_ts}) 삭제 시도 (이벤트 ID: {event_id})")
-            except SlackApiError as delete_e:
-                logger.error(f"최종 예외 처리 중 임시 메시지 삭제 실패: {delete_e}")
+                function(*args)
+            except Exception as e:
+                logger.error(f"작업 큐 작업 처리 중 오류: {e}", exc_info=True)
+            finally:
+                with self._condition:
+                    self._active_keys.discard(order_key)
+                    self.processed += 1
+                    self._condition.notify_all()
 
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "in_flight": len(self._active_keys),
+            "processed": self.processed,
+            "avg_wait_ms": round(self.total_wait_sec * 1000 / self.processed, 1) if self.processed else 0.0,
+            "max_wait_ms": round(self.max_wait_sec * 1000, 1),
+        }
+
+class SqsWorkQueue:
+    """
+    SQS 작업 큐입니다. FIFO 큐(.fifo)면 MessageGroupId=채널 ID 로 채널별 순서를 보장합니다.
+    작업자 동시성은 Lambda 이벤트 소스 매핑의 최대 동시성(maximum concurrency)으로 제한합니다.
+    """
+    def __init__(self, queue_url: str):
+        self.queue_url = queue_url
+        self.is_fifo = queue_url.endswith(".fifo")
+        self.sqs = create_aws_client('sqs')
+
+    def submit_payload(self, order_key: str, payload: dict, deduplication_id: str = None):
+        params = {"QueueUrl": self.queue_url, "MessageBody": json.dumps(payload, ensure_ascii=False)}
+        if self.is_fifo:
+            params["MessageGroupId"] = order_key or "default"
+            params["MessageDeduplicationId"] = deduplication_id or hashlib.sha256(params["MessageBody"].encode("utf-8")).hexdigest()
+        self.sqs.send_message(**params)
+
+    def stats(self) -> dict:
+        attributes = self.sqs.get_queue_attributes(
+            QueueUrl=self.queue_url,
+            AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"]
+        ).get("Attributes", {})
+        return {
+            "depth": int(attributes.get("ApproximateNumberOfMessages", 0)),
+            "in_flight": int(attributes.get("ApproximateNumberOfMessagesNotVisible", 0)),
+        }
+
+class LocalLambdaInvoker:
+    """
+    LambdaLazyListenerRunner 의 lambda_client 대용입니다.
+    로컬 서버에서 lazy 모드의 자기 호출(InvocationType=Event)을 LocalWorkQueue 로 넘깁니다.
+    """
+    def __init__(self, work_queue: LocalWorkQueue, context_factory):
+        self.work_queue = work_queue
+        self.context_factory = context_factory
+
+    def invoke(self, FunctionName: str, InvocationType: str = "Event", Payload: str = "{}"):
+        lambda_event = json.loads(Payload)
+        try:
+            order_key = json.loads(lambda_event.get("body") or "{}").get("event", {}).get("channel", "")
+        except json.JSONDecodeError:
+            order_key = ""
+        self.work_queue.submit(order_key, lambda_handler, lambda_event, self.context_factory())
+        return {"StatusCode": 202}
+
+def process_queued_mention(payload: dict):
+    """작업 큐에서 꺼낸 app_mention 이벤트를 처리합니다 (Slack 에는 이미 응답한 상태)."""
+    body = payload["body"]
+    wait_sec = time.time() - payload.get("enqueued_at", time.time())
+    channel_id = body.get("event", {}).get("channel")
+    logger.info(f"큐 작업 처리 시작 (이벤트 ID: {body.get('event_id')}, 큐 대기 시간: {wait_sec * 1000:.0f}ms)")
+    client = app.client
+    handle_app_mention_events(body, Say(client=client, channel=channel_id), logger, client)
+
+def enqueue_app_mention_event(body, logger):
+    """queue 모드 리스너: 이벤트를 작업 큐에 넣고 바로 반환하여 Slack 에 즉시 200 을 응답합니다."""
+    event = body.get("event", {})
+    channel_id = event.get("channel", "")
+    bot_user_id = BotIdentityCache.from_authorizations(body)
+    if mention_coordinator and bot_user_id and extract_user_query(event.get("text", ""), bot_user_id) \
+            and load_bot_profile(bot_user_id, event.get("user"), logger)[0] is not None:
+        # 큐에서 앞선 멘션을 처리하는 동안에도 후속 멘션이 있음을 알 수 있도록 수신 시점에 임대를 기록합니다.
+        # 답변하지 않을 멘션(빈 질문, 프롬프트 없음)은 임대를 가져가지 않습니다.
+        mention_coordinator.register(
+            ThreadMentionCoordinator.thread_key(bot_user_id, channel_id, event.get("thread_ts") or event.get("ts")), event.get("ts"))
+    payload = {"enqueued_at": time.time(), "body": body}
+    if isinstance(work_queue, SqsWorkQueue):
+        work_queue.submit_payload(channel_id, payload, deduplication_id=body.get("event_id"))
+    else:
+        work_queue.submit(channel_id, process_queued_mention, payload)
+    logger.info(f"이벤트를 작업 큐에 넣음 (이벤트 ID: {body.get('event_id')}, 채널: {channel_id}, 큐 상태: {work_queue.stats() if isinstance(work_queue, LocalWorkQueue) else 'SQS'})")
+
+def process_sqs_records(event) -> dict:
+    """
+    SQS 트리거로 호출된 Lambda 이벤트의 레코드를 순서대로 처리합니다.
+    처리 중 오류는 핸들러가 사용자에게 안내하고, 이벤트 ID 는 이미 처리한 것으로 기록되므로 SQS 재전달로 재시도하지 않습니다.
+    한 레코드의 예외(잘못된 메시지 본문 등)가 배치 전체의 재전달로 이어지지 않도록 레코드별로 기록만 합니다.
+    """
+    for record in event.get("Records", []):
+        try:
+            process_queued_mention(json.loads(record["body"]))
+        except Exception as e:
+            logger.error(f"SQS 레코드 처리 실패, 재시도하지 않습니다 ({record.get('messageId')}): {e}", exc_info=True)
+    return {"batchItemFailures": []} # ReportBatchItemFailures 설정 여부와 관계없이 배치 전체를 처리 완료로 보고
+
+work_queue = None
+local_lambda_invoker = None # 로컬 서버의 lazy 모드에서 __main__ 이 설정
+if DISPATCH_MODE == "queue":
+    work_queue = SqsWorkQueue(WORK_QUEUE_URL) if WORK_QUEUE_URL else LocalWorkQueue()
+    if not WORK_QUEUE_URL and os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        logger.warning("Lambda 환경에서 WORK_QUEUE_URL 없이 queue 모드를 사용하면 응답 후 작업이 중단될 수 있습니다.")
+
+# --- 리스너 등록 ---
+if DISPATCH_MODE == "lazy":
+    app.event("app_mention")(ack=lambda ack: ack(), lazy=[handle_app_mention_events])
+elif DISPATCH_MODE == "queue":
+    app.event("app_mention")(enqueue_app_mention_event)
+else:
+    app.event("app_mention")(handle_app_mention_events)
+logger.info(f"app_mention 리스너 등록 완료 (DISPATCH_MODE: {DISPATCH_MODE})")
+
+# --- 비동기(asyncio) 실행 모드 ---
+# SLACK_APP_MODE=async 이면 slack_bolt AsyncApp(aiohttp 필요)으로 멘션을 처리합니다.
+# 대기 메시지 게시, 시스템 프롬프트 로드, 스레드 기록 조회처럼 서로 독립적인 단계를 동시에 진행하고,
+# 동기 API 인 boto3 Bedrock 호출은 전용 스레드 풀에서 실행하여 하나의 이벤트 루프가 여러 멘션을 함께 처리합니다.
+SLACK_APP_MODE = os.environ.get("SLACK_APP_MODE", "sync") # "sync" | "async"
+ASYNC_BEDROCK_MAX_WORKERS = int(os.environ.get("ASYNC_BEDROCK_MAX_WORKERS", "16")) # 동시에 진행할 수 있는 Bedrock 호출 수
+
+async_app = None
+_async_bedrock_executor = None
+_async_event_loop = None
+_async_event_loop_lock = threading.Lock()
+
+async def run_in_bedrock_executor(function, *args):
+    # 현재 컨텍스트(멘션별 Slack API 호출 수 집계 등)를 작업 스레드로 넘깁니다.
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_async_bedrock_executor, context.run, function, *args)
+
+async def async_invoke_llm(prompt: Union[str, dict], llm_settings: dict = None) -> str:
+    """invoke_llm 을 Bedrock 전용 스레드 풀에서 실행하는 비동기 버전입니다."""
+    return await run_in_bedrock_executor(invoke_llm, prompt, llm_settings)
+
+async def _async_skip():
+    return None
+
+async def async_handle_app_mention_events(body, say, logger, client):
+    """
+    handle_app_mention_events 의 비동기 버전입니다. 처리 순서는 같지만
+    (대기 메시지 게시 / 시스템 프롬프트 로드 / 스레드 기록 조회) 세 단계를 asyncio.gather 로 동시에 실행합니다.
+    sqlite/DynamoDB 저장소(중복 이벤트, 스레드 기록/요약, 멘션 임대, 응답 캐시)는 동기 API 이므로
+    이벤트 루프를 막지 않도록 모두 run_in_bedrock_executor 로 작업 스레드에서 호출합니다.
+    """
+    event_id = body.get("event_id")
+    if not await run_in_bedrock_executor(register_event_id, event_id, logger):
+        return
+
+    actual_event_payload = body.get("event", {})
+    user_id = actual_event_payload.get("user")
+    text = actual_event_payload.get("text", "")
+    channel_id = actual_event_payload.get("channel")
+    thread_ts = actual_event_payload.get("thread_ts") 
+    event_ts = actual_event_payload.get("ts") 
+
+    logger.info(f"멘션 수신 (이벤트 ID: {event_id}): 사용자={user_id}, 채널={channel_id}, 스레드={thread_ts}, 원본 메시지 TS={event_ts}, 내용='{text}'")
+
+    target_thread_ts_for_all_replies = thread_ts if thread_ts else event_ts
+    waiting_message_ts = None 
+    summary_job = None
+    query_route = None
+    mention_thread_key = None
+    mention_started_at = time.time()
+    slack_call_tracking = slack_api.start_mention()
+    trace_token = start_trace("mention", event_id=event_id, channel=channel_id, in_thread=bool(thread_ts))
+
+    try:
+        try:
+            bot_user_id = await async_trace_span("bot_identity", bot_identity_cache.async_resolve(body, client))
+        except Exception as auth_e:
+            logger.error(f"client.auth_test() 호출 실패: {auth_e}")
+            bot_user_id = ""
+        if not bot_user_id:
+            logger.error("봇 ID를 가져올 수 없습니다. authorizations 블록 또는 auth.test() 결과를 확인해주세요.")
+            await async_post_thread_message(client, channel_id, target_thread_ts_for_all_replies, "죄송합니다, 봇 설정을 초기화하는 중 오류가 발생했습니다. (봇 ID 확인 불가)")
+            return
+
+        user_query = extract_user_query(text, bot_user_id)
+        if not user_query:
+            logger.warning("사용자 질문 내용이 비어있습니다.")
+            await async_post_thread_message(client, channel_id, target_thread_ts_for_all_replies, f"<@{user_id}>님, 질문 내용을 입력해주세요.")
+            return
+        logger.info(f"추출된 사용자 질문: '{user_query}'")
+
+        # 서로 독립적인 세 단계를 동시에 실행합니다.
+        # 스레드 기록은 멘션 메시지 ts 까지만 조회하므로 동시에 게시되는 대기 메시지가 섞이지 않습니다.
+        profile_result, placeholder_result, history_result = await asyncio.gather(
+            async_trace_span("prompt_load", run_in_bedrock_executor(load_bot_profile, bot_user_id, user_id, logger)),
+            async_trace_span("placeholder_post", async_post_thread_message(
+                client, channel_id, target_thread_ts_for_all_replies, PLACEHOLDER_MESSAGE)),
+            async_trace_span("thread_history", thread_history_cache.async_get_turns(
+                client, channel_id, thread_ts, bot_user_id, latest_ts=event_ts)) if thread_ts else _async_skip(),
+            return_exceptions=True
+        )
+
+        if isinstance(placeholder_result, Exception):
+            logger.error(f"임시 메시지 전송 실패: {placeholder_result}")
+        else:
+            waiting_message_ts = placeholder_result.get("ts")
+            logger.info(f"임시 메시지 전송 완료 (ts: {waiting_message_ts})")
+
+        if isinstance(profile_result, Exception):
+            raise profile_result
+        bot_profile, profile_error_message = profile_result
+        if bot_profile is None:
+            await async_deliver_thread_reply(client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts, profile_error_message, logger)
+            return
+        system_prompt_text = bot_profile.system_prompt
+        llm_settings = bot_profile.llm_settings
+        if mention_coordinator:
+            # 빈 질문/설정 오류 확인 뒤에 임대를 가져갑니다 (동기 핸들러와 동일).
+            mention_thread_key = ThreadMentionCoordinator.thread_key(bot_user_id, channel_id, target_thread_ts_for_all_replies)
+            await run_in_bedrock_executor(mention_coordinator.register, mention_thread_key, event_ts)
+
+        if isinstance(history_result, Exception):
+            await async_deliver_thread_reply(
+                client, channel_id, thread_ts, waiting_message_ts, thread_history_error_message(history_result, user_id, logger), logger
+            )
+            return
+        conversation_turns, summary_job = await run_in_bedrock_executor(
+            select_prompt_turns, bot_user_id, channel_id, thread_ts, history_result or [], llm_settings
+        )
+        if not conversation_turns:
+            conversation_turns = [{"from": f"<@{user_id}>", "message": user_query}]
+
+        # 분류기 모델 호출이 있을 수 있으므로 Bedrock 작업 스레드에서 실행합니다.
+        query_route, llm_settings = await async_trace_span(
+            "route", run_in_bedrock_executor(query_router.route, user_query, conversation_turns, llm_settings)
+        )
+        reference_chunks = await async_trace_span(
+            "retrieval", run_in_bedrock_executor(retrieve_reference_chunks, bot_user_id, user_query)
+        )
+
+        # 라우팅된 모델과 검색된 참고 문서까지 키에 넣어야 하므로 두 단계 뒤에 응답 캐시를 확인합니다.
+        response_cache_key = None
+        if response_cache and not thread_ts and response_cache.is_cacheable(conversation_turns, llm_settings):
+            response_cache_key = response_cache.make_key(
+                system_prompt_text, conversation_turns, llm_settings, query_route, reference_chunks
+            )
+            cached_response = await run_in_bedrock_executor(response_cache.get, response_cache_key)
+            trace_value("response_cache_hit", 1 if cached_response else 0)
+            if cached_response:
+                # stats() 의 항목 수 조회(sqlite COUNT)도 작업 스레드에서 실행합니다.
+                cache_stats = await run_in_bedrock_executor(response_cache.stats)
+                logger.info(f"응답 캐시 적중, Bedrock 호출 생략 (캐시 통계: {cache_stats})")
+                await async_deliver_thread_reply(client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts, cached_response, logger)
+                return
+
+        with trace_span("prompt_build"):
+            prompt_for_llm = build_llm_request(system_prompt_text, conversation_turns, user_query, reference_chunks)
+
+        if mention_thread_key:
+            await mention_coordinator.async_wait_debounce(mention_started_at)
+            if await run_in_bedrock_executor(mention_coordinator.check_superseded, mention_thread_key, event_ts, "coalesced"):
+                await async_deliver_thread_reply(client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts, SUPERSEDED_MENTION_MESSAGE, logger)
+                return
+
+        if LLM_STREAMING_ENABLED and waiting_message_ts:
+            # 스트리밍 갱신은 동기 WebClient 로 Bedrock 스트림과 같은 작업 스레드에서 진행합니다.
+            posted, streamed_response = await run_in_bedrock_executor(
+                stream_llm_response_to_slack, WebClient(token=client.token, base_url=client.base_url), channel_id,
+                target_thread_ts_for_all_replies, waiting_message_ts, prompt_for_llm, llm_settings,
+                mention_coordinator.cancel_check(mention_thread_key, event_ts) if mention_thread_key else None
+            )
+            if posted:
+                logger.info(f"LLM 스트리밍 응답 전송 완료 (스레드: {target_thread_ts_for_all_replies})")
+                if response_cache_key and streamed_response:
+                    await run_in_bedrock_executor(response_cache.set, response_cache_key, streamed_response)
+                if summary_job and streamed_response:
+                    await async_run_thread_summary_refresh(summary_job)
+                return
+            logger.warning("스트리밍 응답 실패, 일반 호출로 재시도합니다.")
+
+        start_time = time.time()
+        llm_response = await async_invoke_llm(prompt_for_llm, llm_settings)
+        logger.info(f"LLM 답변 생성 시간: {time.time() - start_time:.2f}초")
+        if response_cache_key:
+            await run_in_bedrock_executor(response_cache.set, response_cache_key, llm_response)
+        if mention_thread_key and await run_in_bedrock_executor(mention_coordinator.check_superseded, mention_thread_key, event_ts, "discarded"):
+            await async_deliver_thread_reply(client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts, SUPERSEDED_MENTION_MESSAGE, logger)
+            return
+
+        await async_trace_span("final_post", async_deliver_thread_reply(
+            client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts, llm_response, logger))
+        logger.info(f"LLM 응답 전송 완료 (스레드: {target_thread_ts_for_all_replies})")
+        if summary_job and llm_response not in LLM_FALLBACK_RESPONSES:
+            await async_run_thread_summary_refresh(summary_job)
+
+    except Exception as e:
+        logger.error(f"이벤트 처리 중 예상치 못한 오류 발생 (이벤트 ID: {event_id}): {e}", exc_info=True)
+        try:
+            await async_deliver_thread_reply(
+                client, channel_id, target_thread_ts_for_all_replies, waiting_message_ts,
+                f"죄송합니다, <@{user_id}>님. 요청 처리 중 오류가 발생했습니다. 😥", logger
+            )
+        except Exception as notify_error:
+            logger.error(f"오류 알림 메시지 전송 실패: {notify_error}", exc_info=True)
+    finally:
+        trace_value("slack_api_calls", slack_api.finish_mention(slack_call_tracking, event_id, logger))
+        if query_route:
+            query_router.record(query_route, _current_trace.get())
+        finish_trace(trace_token)
+
+def get_async_event_loop():
+    """
+    백그라운드 스레드에서 계속 실행되는 이벤트 루프를 반환합니다.
+    Lambda 에서는 warm 호출 간에, 로컬 서버에서는 모든 요청이 이 루프 하나를 공유합니다.
+    """
+    global _async_event_loop
+    with _async_event_loop_lock:
+        if _async_event_loop is None:
+            _async_event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_async_event_loop.run_forever, name="asyncio-event-loop", daemon=True).start()
+        return _async_event_loop
+
+def submit_async_slack_request(event, context):
+    """
+    Lambda 형식 이벤트를 AsyncApp 으로 디스패치하고 concurrent.futures.Future(BoltResponse) 를 반환합니다.
+    """
+    from slack_bolt.request.async_request import AsyncBoltRequest
+    import base64
+
+    request_body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        request_body = base64.b64decode(request_body).decode("utf-8")
+    bolt_request = AsyncBoltRequest(
+        body=request_body,
+        query=event.get("queryStringParameters") or {},
+        headers=event.get("headers") or {},
+    )
+    return asyncio.run_coroutine_threadsafe(
+        _async_dispatch_with_deadline(bolt_request, _invocation_deadline.get()), get_async_event_loop()
+    )
+
+async def _async_dispatch_with_deadline(bolt_request, deadline):
+    # 이벤트 루프 스레드의 태스크에는 호출자의 컨텍스트가 전달되지 않으므로 마감 시각을 다시 설정합니다.
+    _invocation_deadline.set(deadline)
+    return await async_app.async_dispatch(bolt_request)
+
+if SLACK_APP_MODE == "async":
+    from slack_bolt.async_app import AsyncApp
+    from slack_sdk.web.async_client import AsyncWebClient
+    async_app = AsyncApp(
+        token=os.environ["SLACK_BOT_TOKEN"],
+        signing_secret=os.environ["SLACK_SIGNING_SECRET"],
+        process_before_response=True,
+        client=AsyncWebClient(token=os.environ["SLACK_BOT_TOKEN"], base_url=SLACK_API_BASE_URL) if SLACK_API_BASE_URL else None
+    )
+    async_app.event("app_mention")(async_handle_app_mention_events)
+    _async_bedrock_executor = ThreadPoolExecutor(max_workers=ASYNC_BEDROCK_MAX_WORKERS, thread_name_prefix="bedrock")
+    logger.info(f"Slack AsyncApp 초기화 완료 (Bedrock 작업 스레드: {ASYNC_BEDROCK_MAX_WORKERS})")
 
 # --- AWS Lambda 핸들러 (Lambda 배포 시 사용) ---
+def slack_retry_short_circuit_response(event):
+    """
+    Slack 재시도 요청(X-Slack-Retry-Num 헤더)이면서 이미 처리 중/처리된 이벤트라면
+    Bolt 디스패치 없이 바로 돌려줄 200 응답을, 아니면 None 을 반환합니다.
+    """
+    headers = event.get("headers") or {}
+    retry_num = next((value for key, value in headers.items() if key.lower() == "x-slack-retry-num"), None)
+    if retry_num is None or headers.get("x-slack-bolt-lazy-only"):
+        # lazy 모드의 자기 호출은 원래 요청의 헤더를 그대로 가지므로 대상에서 제외합니다.
+        return None
+    retry_reason = next((value for key, value in headers.items() if key.lower() == "x-slack-retry-reason"), None)
+
+    if not SLACK_DROP_ALL_RETRIES:
+        # 서명 검증 전이므로 event_id 확인에만 사용하며, 처음 보는 이벤트는 정상 디스패치로 넘깁니다.
+        try:
+            event_id = json.loads(event.get("body") or "{}").get("event_id")
+        except (json.JSONDecodeError, AttributeError):
+            return None
+        try:
+            if not event_id or not event_deduplicator.seen(event_id):
+                return None
+        except Exception as e:
+            logger.error(f"재시도 이벤트 중복 확인 실패, 정상 처리합니다: {e}")
+            return None
+
+    logger.info(f"Slack 재시도 요청 즉시 응답 (재시도 횟수: {retry_num}, 사유: {retry_reason})")
+    return {"statusCode": 200, "body": "", "headers": {"X-Slack-No-Retry": "1"}}
+
+_slack_request_handler = None
+_is_cold_start = True # 컨테이너의 첫 lambda_handler 호출 여부 (지표용)
+
+def get_slack_request_handler() -> SlackRequestHandler:
+    """SlackRequestHandler 를 한 번만 생성하여 warm 호출 간에 재사용합니다."""
+    global _slack_request_handler
+    if _slack_request_handler is None:
+        _slack_request_handler = SlackRequestHandler(app=app)
+        if local_lambda_invoker is not None:
+            _slack_request_handler.app.listener_runner.lazy_listener_runner.lambda_client = local_lambda_invoker
+    return _slack_request_handler
+
 def lambda_handler(event, context):
-    logger.info("Lambda 핸들러 시작")
-    slack_handler = SlackRequestHandler(app=app)
+    logger.info(f"Lambda 핸들러 시작 (요청 ID: {getattr(context, 'aws_request_id', 'N/A')})")
+    global _is_cold_start
+    # Bedrock 재시도가 Lambda 제한 시간 안에서만 이루어지도록 이 호출의 마감 시각을 기록합니다.
+    deadline_token = set_invocation_deadline(context)
+    trace_token = start_trace("invocation", request_id=getattr(context, 'aws_request_id', None))
+    trace_value("cold_start", 1 if _is_cold_start else 0)
+    _is_cold_start = False
+    try:
+        with trace_span("handler"):
+            return _dispatch_lambda_event(event, context)
+    finally:
+        finish_trace(trace_token)
+        _invocation_deadline.reset(deadline_token)
+
+def _dispatch_lambda_event(event, context):
+    if event.get("Records") and event["Records"][0].get("eventSource") == "aws:sqs":
+        # queue 모드의 작업자 호출 (SQS 트리거)
+        return process_sqs_records(event)
+
+    retry_response = slack_retry_short_circuit_response(event)
+    if retry_response is not None:
+        return retry_response
+
     # Lambda 이벤트 전체를 로깅하면 민감 정보가 포함될 수 있으므로, 필요한 부분만 로깅하거나 크기 제한
-    # logger.debug(f"Lambda 이벤트 수신 (일부): {str(event)[:500]}") 
-    if isinstance(event.get("body"), str):
+    # body 는 Bolt 가 다시 파싱하므로 로깅만을 위한 파싱은 DEBUG 레벨에서만 수행합니다.
+    if logger.isEnabledFor(logging.DEBUG) and isinstance(event.get("body"), str):
         try:
             body_json = json.loads(event["body"])
-            logger.info(f"Lambda 수신 이벤트 ID: {body_json.get('event_id')}, 타입: {body_json.get('type')}/{body_json.get('event',{}).get('type')}")
+            logger.debug(f"Lambda 수신 이벤트 ID: {body_json.get('event_id')}, 타입: {body_json.get('type')}/{body_json.get('event',{}).get('type')}")
         except json.JSONDecodeError:
             logger.warning("Lambda 이벤트 body가 JSON 형식이 아닙니다.")
     
-    return slack_handler.handle(event, context)
+    if async_app is not None:
+        return to_aws_response(submit_async_slack_request(event, context).result())
+    return get_slack_request_handler().handle(event, context)
 
 # --- 로컬 개발 서버 실행 (로컬 테스트 시 사용 - Lambda 시뮬레이션) ---
 if __name__ == "__main__":
@@ -372,6 +3531,43 @@ if __name__ == "__main__":
         except Exception as e:
             logger.error(f"백그라운드 스레드: lambda_handler 처리 중 오류: {e}", exc_info=True)
 
+    class DummyContext:
+        def __init__(self):
+            self.function_name = "local-slack-bot-sim"
+            self.aws_request_id = f"local-aws-req-{os.urandom(8).hex()}"
+            self.invoked_function_arn = "arn:aws:lambda:local:123456789012:function:local-slack-bot-sim"
+            self.memory_limit_in_mb = 128
+            self._start_time = time.time()
+            self._max_duration_ms = 300000 # 예: 5분
+        def get_remaining_time_in_millis(self):
+            elapsed_ms = (time.time() - self._start_time) * 1000
+            return max(0, self._max_duration_ms - int(elapsed_ms))
+
+    # 단계별 지연 시간 p50/p95/p99 를 주기적으로(새 기록이 있을 때만), SIGUSR1 수신 시, 서버 종료 시 출력합니다.
+    stage_latency_aggregator = StageLatencyAggregator()
+
+    def log_stage_latency_summary():
+        logger.info(f"단계별 지연 시간 (최근 {stage_latency_aggregator.window}건 기준):\n{stage_latency_aggregator.format_summary()}")
+        if prompt_cache_policy.enabled:
+            logger.info(f"프롬프트 캐싱 누적 사용량: {prompt_cache_policy.stats()}")
+        route_stats = query_router.stats()
+        if route_stats:
+            logger.info(f"질문 라우팅 경로별 통계 (Bedrock 지연 시간은 최근 {query_router.window}건 기준): {route_stats}")
+
+    def stage_latency_reporter():
+        reported_count = 0
+        while True:
+            time.sleep(METRICS_LOCAL_SUMMARY_INTERVAL_SEC)
+            if stage_latency_aggregator.recorded != reported_count:
+                reported_count = stage_latency_aggregator.recorded
+                log_stage_latency_summary()
+
+    threading.Thread(target=stage_latency_reporter, name="stage-latency-reporter", daemon=True).start()
+
+    if DISPATCH_MODE == "lazy":
+        # lazy 모드의 Lambda 자기 호출을 in-process 작업 큐로 대신합니다.
+        local_lambda_invoker = LocalLambdaInvoker(LocalWorkQueue(), DummyContext)
+
     class LocalSlackRequestHandler(BaseHTTPRequestHandler):
         def do_POST(self):
             content_length = int(self.headers.get('Content-Length', 0))
@@ -408,18 +3604,6 @@ if __name__ == "__main__":
                 }
             }
 
-            class DummyContext:
-                def __init__(self):
-                    self.function_name = "local-slack-bot-sim"
-                    self.aws_request_id = f"local-aws-req-{os.urandom(8).hex()}"
-                    self.invoked_function_arn = "arn:aws:lambda:local:123456789012:function:local-slack-bot-sim"
-                    self.memory_limit_in_mb = 128
-                    self._start_time = time.time()
-                    self._max_duration_ms = 300000 # 예: 5분
-                def get_remaining_time_in_millis(self):
-                    elapsed_ms = (time.time() - self._start_time) * 1000
-                    return max(0, self._max_duration_ms - int(elapsed_ms))
-
             lambda_context = DummyContext()
 
             try:
@@ -432,12 +3616,31 @@ if __name__ == "__main__":
                 logger.error(f"로컬 서버: 즉시 200 OK 응답 전송 중 오류: {e}", exc_info=True)
                 return
 
+            if async_app is not None:
+                # 비동기 모드: 요청별 스레드 없이 공유 이벤트 루프에 작업을 넘깁니다.
+                future = submit_async_slack_request(lambda_event, lambda_context)
+                future.add_done_callback(lambda f: f.exception() and logger.error(f"비동기 요청 처리 중 오류: {f.exception()}"))
+                logger.info(f"로컬 서버: 이벤트 루프에 요청 전달 (이벤트 ID: {log_event_id}).")
+                return
+
             thread = threading.Thread(target=process_lambda_request, args=(lambda_event, lambda_context))
             thread.daemon = True 
             thread.start()
             logger.info(f"로컬 서버: lambda_handler를 백그라운드 스레드에서 실행 시작 (이벤트 ID: {log_event_id}).")
 
 
+    # SIGHUP 수신 시 시스템 프롬프트/봇 설정(과 검색 인덱스) 캐시를 비워 다음 요청에서 다시 읽습니다.
+    def reload_bot_files():
+        prompt_registry.invalidate()
+        if retrieval_registry:
+            retrieval_registry.invalidate()
+
+    import signal
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload_bot_files())
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: log_stage_latency_summary())
+
     host = 'localhost'
     port = int(os.environ.get("PORT", 3000))
     server_address = (host, port)
@@ -459,4 +3662,6 @@ if __name__ == "__main__":
         logger.info("로컬 서버 종료 중...")
     finally:
         httpd.server_close()
+        if stage_latency_aggregator.recorded:
+            log_stage_latency_summary()
         logger.info("로컬 서버가 성공적으로 종료되었습니다.")